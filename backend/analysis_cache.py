@@ -0,0 +1,81 @@
+# persistent on-disk caches for the analysis pipeline
+# every fresh process rebuilds the same CQT filter bases, chroma maps and mel
+# bases for our fixed sr / hop / n_fft, and numba recompiles librosa's kernels
+# (beat tracking, pyin's viterbi, ...). configure() points librosa's own filter
+# cache and numba's on-disk cache at a directory keyed by the library versions,
+# so new workers and serverless cold starts load both instead.
+#
+# librosa decides whether to cache its filters, and numba where to cache, when
+# they are first imported - so this has to run before anything touches librosa.
+# audio_codec and muzic_integration call configure() at import for that reason.
+
+import importlib.metadata
+import logging
+import os
+import sys
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR_ENV = "CHORDCRAFT_ANALYSIS_CACHE_DIR"
+# anything whose upgrade could change a cached filter bank or compiled kernel
+VERSIONED_PACKAGES = ("librosa", "numpy", "scipy", "numba", "joblib")
+
+_configured: Optional[str] = None
+
+
+def default_directory() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "chordcraft")
+
+
+def version_key() -> str:
+    """python + library versions, e.g. py3.11_librosa-0.11.0_numpy-1.26.4_..."""
+    parts = [f"py{sys.version_info.major}.{sys.version_info.minor}"]
+    for name in VERSIONED_PACKAGES:
+        try:
+            parts.append(f"{name}-{importlib.metadata.version(name)}")
+        except importlib.metadata.PackageNotFoundError:
+            parts.append(f"{name}-none")
+    return "_".join(parts)
+
+
+def configure(directory: Optional[str] = None) -> Optional[str]:
+    """turn on the persistent caches; returns the versioned directory in use (None when off)
+
+    directory defaults to $CHORDCRAFT_ANALYSIS_CACHE_DIR, then ~/.cache/chordcraft;
+    "off" disables caching. Only the first call in a process does anything, and
+    LIBROSA_CACHE_* / NUMBA_CACHE_DIR already set in the environment win.
+    """
+    global _configured
+    if _configured is not None:
+        return _configured or None
+
+    directory = directory or os.environ.get(CACHE_DIR_ENV) or default_directory()
+    if directory == "off":
+        _configured = ""
+        return None
+    root = os.path.join(directory, version_key())
+    try:
+        os.makedirs(root, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Analysis cache disabled, can't create {root}: {e}")
+        _configured = ""
+        return None
+
+    if "librosa._cache" in sys.modules:
+        logger.warning("librosa was loaded before the analysis cache was configured, filter banks won't be cached")
+
+    os.environ.setdefault("LIBROSA_CACHE_DIR", os.path.join(root, "librosa"))
+    # copy-on-write memory maps: filter banks load without being read in full,
+    # and librosa can still scale them in place
+    os.environ.setdefault("LIBROSA_CACHE_MMAP", "c")
+    # level 10 is filter banks and note tables - not per-track results
+    os.environ.setdefault("LIBROSA_CACHE_LEVEL", "10")
+    os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(root, "numba"))
+    if "numba" in sys.modules:
+        # numba reads its config once at import; kernels compiled from now on use the new dir
+        sys.modules["numba"].core.config.reload_config()
+
+    _configured = root
+    return root
@@ -1,20 +1,61 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.datastructures import FileStorage
-import tempfile, os, logging, time
+import io, os, json, logging, tempfile, time
 from audio_codec import ChordCraftCodec  # just importing the codec class we made earlier
+from resampling import DEFAULT_RESAMPLER
+from result_cache import HashingBytesIO, cache_key, create_cache, hash_stream, iter_pieces
+from jobs import JobQueue, QueueFullError, analyze_job, encode_job
+from warmup import warm_up as warm_components
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("chordcraft")
 
+class InMemoryUploadRequest(Request):
+    """keep uploads in memory instead of spooling them to /tmp - MAX_CONTENT_LENGTH bounds the size
+
+    the buffer hashes the upload as werkzeug writes it, which gives us the result cache key for free
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingBytesIO()
+
 app = Flask(__name__)
+app.request_class = InMemoryUploadRequest
 CORS(app, resources={r"/*": {"origins": ["https://studio.yourdomain.com", "https://chord-craft-l32h.vercel.app", "https://*.vercel.app"]}})
 
 # keeping file uploads reasonable - 100MB max
 app.config["MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024
 
+# content-addressed cache of finished codes: "memory", "disk" or "off"
+app.config["RESULT_CACHE"] = os.environ.get("CHORDCRAFT_RESULT_CACHE", "memory")
+app.config["RESULT_CACHE_DIR"] = os.environ.get("CHORDCRAFT_RESULT_CACHE_DIR")
+app.config["RESULT_CACHE_MAX_BYTES"] = int(os.environ.get("CHORDCRAFT_RESULT_CACHE_MAX_BYTES", 0)) or None
+
+# background jobs (/analyze?async=1 + GET /jobs/<id>) - size these to the box's cores
+app.config["JOB_WORKERS"] = int(os.environ.get("CHORDCRAFT_JOB_WORKERS", 0)) or None
+app.config["JOB_QUEUE_DEPTH"] = int(os.environ.get("CHORDCRAFT_JOB_QUEUE_DEPTH", 16))
+app.config["JOB_TIMEOUT"] = float(os.environ.get("CHORDCRAFT_JOB_TIMEOUT", 600))
+app.config["JOB_RESULT_TTL"] = float(os.environ.get("CHORDCRAFT_JOB_RESULT_TTL", 3600))
+# job state shared by every worker on the box, so GET /jobs/<id> works whichever
+# gunicorn worker answers it - "memory" keeps it in this process only
+app.config["JOB_STATE_DIR"] = os.environ.get("CHORDCRAFT_JOB_STATE_DIR",
+                                             os.path.join(tempfile.gettempdir(), "chordcraft-jobs"))
+
+# pitch tracker for the Muzic-enhanced analysis behind the event stream: pyin, onset_pyin or hps
+app.config["PITCH_ENGINE"] = os.environ.get("CHORDCRAFT_PITCH_ENGINE", "pyin")
+
+# >1 encodes the FLAC as independent segments on this many threads (segmented v2 code)
+app.config["ENCODE_WORKERS"] = int(os.environ.get("CHORDCRAFT_ENCODE_WORKERS", 1))
+
+# resampler for uploads that aren't already 44.1 kHz: poly, soxr_hq or soxr_vhq (benchmark_resample.py)
+app.config["RESAMPLER"] = os.environ.get("CHORDCRAFT_RESAMPLER", "soxr_hq")
+
+# run the codec + analyzer once at startup (numba JIT, filter banks) - see warmup.py / gunicorn.conf.py
+app.config["WARMUP"] = os.environ.get("CHORDCRAFT_WARMUP", "1") != "0"
+
 # don't let people spam the API
 limiter = Limiter(get_remote_address, app=app, default_limits=["60/min"])
 
@@ -38,11 +79,119 @@ def sniff_audio(sig: bytes) -> str:
         return "audio/aac"  # AAC ADTS
     return "application/octet-stream"
 
-codec = ChordCraftCodec(target_sr=44100, stereo=True)
+# raw ChordCraft text, streamed chunk-by-chunk instead of wrapped in JSON
+CHORDCRAFT_MIME = "text/x-chordcraft"
+# per-stage analysis results as server-sent events
+EVENT_STREAM_MIME = "text/event-stream"
+
+CODE_VERSION = "cc-v2.1"
+
+codec = ChordCraftCodec(target_sr=44100, stereo=True, workers=app.config["ENCODE_WORKERS"],
+                        resampler=app.config["RESAMPLER"])
+
+result_cache = create_cache(
+    app.config["RESULT_CACHE"],
+    directory=app.config["RESULT_CACHE_DIR"],
+    max_bytes=app.config["RESULT_CACHE_MAX_BYTES"],
+)
+
+job_queue = JobQueue(
+    max_workers=app.config["JOB_WORKERS"],
+    max_queue_depth=app.config["JOB_QUEUE_DEPTH"],
+    job_timeout=app.config["JOB_TIMEOUT"],
+    result_ttl=app.config["JOB_RESULT_TTL"],
+    state_dir=None if app.config["JOB_STATE_DIR"] == "memory" else app.config["JOB_STATE_DIR"],
+)
+
+enhanced_analyzer = None
+
+def get_enhanced_analyzer():
+    """the Muzic-enhanced analyzer, created on first use so startup stays cheap"""
+    global enhanced_analyzer
+    if enhanced_analyzer is None:
+        from muzic_integration import MuzicEnhancedAnalyzer
+        enhanced_analyzer = MuzicEnhancedAnalyzer(pitch_engine=app.config["PITCH_ENGINE"])
+    return enhanced_analyzer
+
+def warm_up():
+    """warm the shared codec and analyzer so the first request doesn't pay for JIT compilation
+
+    called by gunicorn's master before it forks (or by each worker without
+    preload_app), and by the dev server - never at import time.
+    """
+    if not app.config["WARMUP"]:
+        return {}
+    start = time.time()
+    timings = warm_components(codec=codec, analyzer=get_enhanced_analyzer())
+    log.info(f"Warmup done ({time.time() - start:.2f}s): {timings}")
+    return timings
+
+def build_date() -> str:
+    """the date stamped into each code's meta - taken once per request"""
+    return time.strftime("%Y-%m-%d")
+
+def result_key(upload, date=None) -> str:
+    """cache key for an upload: its sha256 plus every codec setting that shapes the code
+
+    the build date is part of the code's header, so it is part of the key too -
+    a code cached yesterday is never served as today's
+    """
+    return cache_key(
+        hash_stream(upload),
+        target_sr=codec.target_sr,
+        stereo=codec.stereo,
+        chunk_size=codec.chunk_size,
+        # only non-default settings add a parameter, so existing cache entries stay valid
+        **({"segment_seconds": codec.segment_seconds} if codec.segmented else {}),
+        **({"resampler": codec.resampler} if codec.resampler != DEFAULT_RESAMPLER else {}),
+        version=CODE_VERSION,
+        build_date=date or build_date(),
+    )
+
+def code_options(date=None) -> dict:
+    """codec arguments shared by the JSON and streaming /analyze responses"""
+    return dict(
+        bpm=None,                # let codec/analysis set default if unknown
+        key="Unknown",
+        time_sig="4/4",
+        chords=None,
+        include_lossless=True,   # guarantees identical
+        include_neural=False,    # optional, keep false for now
+        version=CODE_VERSION,    # version stamp for future compatibility
+        build_date=date or build_date()  # build date stamp, same one as in result_key
+    )
+
+def wants_job() -> bool:
+    """?async=1 or Prefer: respond-async queues the work and returns a job id"""
+    if request.args.get("async", "").lower() in ("1", "true", "yes"):
+        return True
+    return "respond-async" in request.headers.get("Prefer", "")
+
+def wants_events() -> bool:
+    """?events=1 or Accept: text/event-stream asks for the analysis stage by stage"""
+    if request.args.get("events", "").lower() in ("1", "true", "yes"):
+        return True
+    return request.accept_mimetypes.best_match(["application/json", EVENT_STREAM_MIME]) == EVENT_STREAM_MIME
+
+def sse(event: str, data) -> str:
+    """one server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_stream() -> bool:
+    """?stream=1 or Accept: text/x-chordcraft asks for the raw streamed code"""
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return True
+    return request.accept_mimetypes.best_match(["application/json", CHORDCRAFT_MIME]) == CHORDCRAFT_MIME
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "version": "2.0.0", "endpoints": ["/analyze", "/generate-music"]})
+    return jsonify({
+        "status": "ok",
+        "version": "2.0.0",
+        "endpoints": ["/analyze", "/generate-music"],
+        "cache": result_cache.stats() if result_cache else None,
+        "jobs": job_queue.stats(),
+    })
 
 @app.route("/analyze", methods=["POST"])
 @limiter.limit("6/min")  # Rate limit uploads
@@ -51,6 +200,14 @@ def analyze():
     Music → Code: returns a ChordCraft v2 block with lossless payload.
     Response JSON:
       { success: true, code: "<ChordCraft v2 text>" }
+    With ?stream=1 or Accept: text/x-chordcraft the code itself is streamed
+    back as text/x-chordcraft using chunked transfer encoding.
+    With ?async=1 the work is queued and the response is 202
+      { success: true, job_id: "...", status_url: "/jobs/<id>" }
+    add &kind=analysis to run the Muzic-enhanced analyzer instead of the codec.
+    With ?events=1 or Accept: text/event-stream the Muzic-enhanced analysis
+    runs instead and each stage is sent as a server-sent event when ready:
+      tempo, key, chords, rhythm, notes, structure, then result (or error)
     """
     start_time = time.time()
     
@@ -78,23 +235,30 @@ def analyze():
     
     log.info(f"Analyzing audio: {f.filename} ({file_size} bytes, {file_format})")
 
+    if wants_job():
+        return submit_job(f, start_time)
+
+    if wants_events():
+        return stream_events(f, start_time)
+
+    date = build_date()
+    key = result_key(stream, date) if result_cache else None
+    cached = result_cache.get(key) if key else None
+
+    if wants_stream():
+        return stream_analysis(f, start_time, key, cached, date)
+
+    if cached is not None:
+        elapsed = time.time() - start_time
+        log.info(f"Analysis cache hit: {f.filename} ({elapsed:.2f}s, {len(cached)} chars)")
+        return jsonify({"success": True, "code": cached})
+
     try:
-        # Save to a temp file only because the codec API expects a path
-        with tempfile.NamedTemporaryFile(suffix=file_format, delete=True) as tmp:
-            f.save(tmp.name)
-
-            # Produce ChordCraft code with embedded FLAC (identical playback)
-            code = codec.create_chordcraft_code(
-                audio_path=tmp.name,
-                bpm=None,                # let codec/analysis set default if unknown
-                key="Unknown",
-                time_sig="4/4",
-                chords=None,
-                include_lossless=True,   # guarantees identical
-                include_neural=False,    # optional, keep false for now
-                version="cc-v2.1",       # version stamp for future compatibility
-                build_date=time.strftime("%Y-%m-%d")  # build date stamp
-            )
+        # Produce ChordCraft code with embedded FLAC (identical playback),
+        # decoding straight from the in-memory upload
+        code = codec.create_chordcraft_code(audio_path=stream, **code_options(date))
+        if key:
+            result_cache.put(key, code)
 
         elapsed = time.time() - start_time
         log.info(f"Analysis complete: {f.filename} ({elapsed:.2f}s, {len(code)} chars)")
@@ -104,6 +268,129 @@ def analyze():
         log.exception(f"Analysis failed: {f.filename} ({elapsed:.2f}s)")
         return jsonify({"success": False, "error": f"analysis_failed: {e}"}), 500
 
+def stream_analysis(f: FileStorage, start_time: float, key=None, cached=None, date=None) -> Response:
+    """pipe iter_chordcraft_code straight to the client as it is produced"""
+    headers = {"X-Accel-Buffering": "no"}
+    if cached is not None:
+        elapsed = time.time() - start_time
+        log.info(f"Analysis cache hit: {f.filename} ({elapsed:.2f}s, {len(cached)} chars)")
+        return Response(iter_pieces(cached, codec.chunk_size), mimetype=CHORDCRAFT_MIME, headers=headers)
+
+    # take the upload buffer over from the request - werkzeug closes request
+    # files when the view returns, long before the generator below is done
+    upload, f.stream = f.stream, io.BytesIO()
+    try:
+        pieces = codec.iter_chordcraft_code(audio_path=upload, **code_options(date))
+        first = next(pieces)
+    except Exception as e:
+        elapsed = time.time() - start_time
+        log.exception(f"Analysis failed: {f.filename} ({elapsed:.2f}s)")
+        return jsonify({"success": False, "error": f"analysis_failed: {e}"}), 500
+
+    filename = f.filename
+
+    def generate():
+        sent = len(first)
+        completed = False
+        # tee the pieces into the cache; only a complete result gets committed
+        writer = result_cache.writer(key) if key else None
+        try:
+            if writer:
+                writer.write(first)
+            yield first
+            for piece in pieces:
+                sent += len(piece)
+                if writer:
+                    writer.write(piece)
+                yield piece
+            completed = True
+            elapsed = time.time() - start_time
+            log.info(f"Analysis streamed: {filename} ({elapsed:.2f}s, {sent} chars)")
+        except Exception:
+            # headers are already out, so all we can do is cut the stream short;
+            # clients notice the missing closing brace / sha256 mismatch
+            elapsed = time.time() - start_time
+            log.exception(f"Analysis failed mid-stream: {filename} ({elapsed:.2f}s, {sent} chars sent)")
+        finally:
+            pieces.close()
+            upload.close()
+            if writer and completed:
+                writer.commit()
+            elif writer:
+                writer.discard()
+
+    # no Content-Length, so the WSGI server falls back to chunked encoding;
+    # X-Accel-Buffering stops nginx from re-buffering the whole body
+    return Response(generate(), mimetype=CHORDCRAFT_MIME, headers=headers)
+
+def stream_events(f: FileStorage, start_time: float) -> Response:
+    """run the enhanced analysis and forward each stage's result as a server-sent event"""
+    # same as stream_analysis - the generator outlives the request's file
+    upload, f.stream = f.stream, io.BytesIO()
+    filename = f.filename
+    analyzer = get_enhanced_analyzer()
+
+    def generate():
+        events = analyzer.iter_analysis(upload)
+        try:
+            for event, payload in events:
+                yield sse(event, payload)
+                log.info(f"Analysis event {event}: {filename} ({time.time() - start_time:.2f}s)")
+        except Exception as e:
+            # unlike the raw code stream we can still tell the client what went wrong
+            elapsed = time.time() - start_time
+            log.exception(f"Analysis failed mid-stream: {filename} ({elapsed:.2f}s)")
+            yield sse("error", {"success": False, "error": f"analysis_failed: {e}"})
+        finally:
+            events.close()
+            upload.close()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(generate(), mimetype=EVENT_STREAM_MIME, headers=headers)
+
+def submit_job(f: FileStorage, start_time: float):
+    """queue the upload on the job pool and hand back its id"""
+    kind = request.args.get("kind", "encode")
+    if kind not in ("encode", "analysis"):
+        return jsonify({"success": False, "error": f"Unknown job kind: {kind}"}), 400
+
+    try:
+        if kind == "analysis":
+            job = job_queue.submit(kind, analyze_job, f.stream.getvalue(),
+                                   {"pitch_engine": app.config["PITCH_ENGINE"]})
+        else:
+            date = build_date()
+            key = result_key(f.stream, date) if result_cache else None
+            cached = result_cache.get(key) if key else None
+            if cached is not None:
+                job = job_queue.completed(kind, cached)
+            else:
+                job = job_queue.submit(
+                    kind, encode_job, f.stream.getvalue(),
+                    {"target_sr": codec.target_sr, "stereo": codec.stereo,
+                     "workers": codec.workers, "segment_seconds": codec.segment_seconds,
+                     "resampler": codec.resampler},
+                    code_options(date),
+                    on_result=(lambda code: result_cache.put(key, code)) if key else None,
+                )
+    except QueueFullError as e:
+        log.warning(f"Job queue full, rejecting {f.filename}: {e}")
+        return jsonify({"success": False, "error": "queue_full"}), 503, {"Retry-After": "30"}
+
+    elapsed = time.time() - start_time
+    log.info(f"Queued {kind} job {job.id}: {f.filename} ({elapsed:.2f}s)")
+    status_url = f"/jobs/{job.id}"
+    return jsonify({"success": True, "job_id": job.id, "status": job.status,
+                    "status_url": status_url}), 202, {"Location": status_url}
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str):
+    """status/progress of a queued job, plus its result once done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown or expired job"}), 404
+    return jsonify({"success": True, **job.to_dict()})
+
 @app.route("/generate-music", methods=["POST"])
 def generate_music():
     """
@@ -123,4 +410,7 @@ def generate_music():
     })
 
 if __name__ == "__main__":
+    # the debug reloader runs this file twice - only warm the process that serves
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        warm_up()
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -6,101 +6,419 @@ import hashlib
 import io
 import json
 import math
+import os
+import shutil
 import sys
-from typing import Dict, List, Tuple, Optional, Union
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Sequence, Tuple, Optional, Union
 import numpy as np
 import soundfile as sf
+
+import analysis_cache
+analysis_cache.configure()  # has to happen before librosa loads anything
 import librosa
 
-# try to load the neural codec stuff - it's optional
-try:
-    import torch
-    from transformers import AutoModel, AutoTokenizer
-    NEURAL_CODECS_AVAILABLE = True
-except ImportError:
-    NEURAL_CODECS_AVAILABLE = False
+from resampling import DEFAULT_RESAMPLER, resample, stream_resampler, validate_resampler
+
+# the neural codec stuff is optional (torch + transformers)
+from neural_codec import (DEFAULT_BANDWIDTH, DEFAULT_MODEL, NEURAL_CODECS_AVAILABLE, NEURAL_CODECS_ENABLED,
+                          get_encoder)
+from neural_tokens import bits_for, pack_codes
+if NEURAL_CODECS_ENABLED and not NEURAL_CODECS_AVAILABLE:
     print("Neural codecs not available. Install them with: pip install torch transformers")
 
 CHUNK_SIZE = 65536  # how big each base64 chunk should be for copy-paste
+BLOCK_FRAMES = 65536  # how many PCM frames we read/resample/encode at a time
+HASH_BLOCK = 1 << 20  # read size when hashing the finished FLAC stream
+SEGMENT_SECONDS = 30.0  # length of each independently encoded FLAC in segmented mode
+
+# anything we can decode from: a path, an open binary file (e.g. werkzeug's
+# FileStorage.stream) or the raw bytes of the upload
+AudioSource = Union[str, "os.PathLike[str]", BinaryIO, bytes, bytearray, memoryview]
+
+def _as_stream(source: AudioSource) -> Union[str, "os.PathLike[str]", BinaryIO]:
+    """wrap bytes-likes in a BytesIO and rewind file objects so each encoder sees the whole upload"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "read") and source.seekable():
+        source.seek(0)
+    return source
+
+def _load_whole(source: AudioSource, sr: int, mono: bool,
+                resampler: str = DEFAULT_RESAMPLER) -> Tuple[np.ndarray, int]:
+    """librosa.load that also copes with streams libsndfile can't parse
+    
+    audioread (MP3 on old libsndfile, AAC, ...) only opens real paths, so only
+    in that case does the stream get spooled to a temp file first. Audio is
+    loaded at its own rate and resampled with `resampler` (skipped if it's already at sr).
+    """
+    source = _as_stream(source)
+    if not hasattr(source, "read"):
+        y, native_sr = librosa.load(source, sr=None, mono=mono)
+        return resample(y, native_sr, sr, resampler), sr
+    
+    try:
+        y, native_sr = librosa.load(source, sr=None, mono=mono)
+        return resample(y, native_sr, sr, resampler), sr
+    except Exception:
+        source.seek(0)
+    
+    suffix = os.path.splitext(getattr(source, "name", "") or "")[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        shutil.copyfileobj(source, tmp)
+    try:
+        y, native_sr = librosa.load(tmp.name, sr=None, mono=mono)
+    finally:
+        os.unlink(tmp.name)
+    return resample(y, native_sr, sr, resampler), sr
+
+# text layout helpers - shared with the binary container so conversions are byte-exact
+
+CODE_FOOTER = "\n}"
+
+def format_meta(meta: Dict) -> str:
+    """meta fields as they appear in the header - numbers bare, everything else quoted"""
+    return ", ".join(
+        f"{name}: {value}" if isinstance(value, (int, float)) and not isinstance(value, bool)
+        else f'{name}: "{value}"'
+        for name, value in meta.items()
+    )
+
+def format_header(meta: Dict, chords_line: str) -> str:
+    """Song { meta + analysis block"""
+    lines = []
+    lines.append("Song {")
+    lines.append(f"  meta: {{ {format_meta(meta)} }}")
+    lines.append("  analysis: {")
+    lines.append(f"    chords: {chords_line}")
+    lines.append("  }")
+    return "\n".join(lines)
+
+def format_audio_block(sample_rate: int, channels: int, sha256: str, chunks: int, chunk_size: int) -> str:
+    """the audio: { ... } block that precedes the FLAC payload"""
+    lines = [""]
+    lines.append("  audio: {")
+    lines.append(f'    format: "flac", sr: {sample_rate}, channels: {channels},')
+    lines.append(f'    sha256: "{sha256}", chunks: {chunks}, chunk_size: {chunk_size}')
+    lines.append("  }")
+    lines.append("")
+    return "\n".join(lines)
+
+def iter_payload_chunks(flac, chunk_size: int, segment: Optional[int] = None) -> Iterator[str]:
+    """<<PAYLOAD:FLAC:n>> sections for a bytes-like FLAC file (<<PAYLOAD:FLAC:s.n>> for segment s)"""
+    prefix = f"{segment}." if segment is not None else ""
+    # encode 3*chunk_size raw bytes at a time, which is 3-byte aligned and
+    # comes out as exactly 4 full base64 chunks
+    with memoryview(flac) as flac_view:
+        index = 0
+        group = 3 * chunk_size
+        for offset in range(0, len(flac_view), group):
+            b64_data = base64.b64encode(flac_view[offset:offset + group]).decode("ascii")
+            for start in range(0, len(b64_data), chunk_size):
+                index += 1
+                yield f"\n<<PAYLOAD:FLAC:{prefix}{index}>>\n" + b64_data[start:start + chunk_size]
+
+def payload_chunk_count(flac_size: int, chunk_size: int) -> int:
+    return math.ceil(4 * math.ceil(flac_size / 3) / chunk_size)
+
+def format_segmented_audio_block(sample_rate: int, channels: int, segment_frames: int, chunk_size: int) -> str:
+    """audio: { ... } for a payload split into independently encoded FLAC segments"""
+    lines = [""]
+    lines.append("  audio: {")
+    lines.append(f'    format: "flac", sr: {sample_rate}, channels: {channels},')
+    lines.append(f'    segment_frames: {segment_frames}, chunk_size: {chunk_size}')
+    lines.append("  }")
+    return "\n".join(lines)
+
+def format_segment_header(index: int, start: int, frames: int, sha256: str, chunks: int) -> str:
+    """goes in front of each segment's payload chunks"""
+    return (f"\n\n  segment: {{ index: {index}, start: {start}, frames: {frames}, "
+            f'sha256: "{sha256}", chunks: {chunks} }}')
+
+def format_audio_end(segments: int, frames: int) -> str:
+    """closes a segmented payload so a truncated code can't pass for a shorter song"""
+    return f"\n\n  audio_end: {{ segments: {segments}, frames: {frames} }}"
+
+def token_count(tokens: List) -> int:
+    """tokens in a flat list or a (codebooks, frames) nested one"""
+    return sum(len(row) for row in tokens) if tokens and isinstance(tokens[0], list) else len(tokens)
+
+def format_neural_block(model: str, compression_ratio: float, tokens_text: str, tokens_count: int,
+                        packing: Optional[Dict] = None) -> str:
+    """the neural: { ... } block plus its token line
+    
+    the token line is JSON, or base64 of pack_codes() output when `packing`
+    (its layout fields) is given.
+    """
+    lines = [""]
+    lines.append("")
+    lines.append("  neural: {")
+    lines.append(f'    format: "neural_codec", model: "{model}",')
+    if packing is None:
+        lines.append(f'    tokens: {tokens_count}, compression_ratio: {compression_ratio:.2f}')
+    else:
+        lines.append(f'    tokens: {tokens_count}, compression_ratio: {compression_ratio:.2f},')
+        lines.append(f'    encoding: "{packing["encoding"]}", bits: {packing["bits"]}, '
+                     f'codebooks: {packing["codebooks"]}, frames: {packing["frames"]}')
+    lines.append("  }")
+    lines.append("")
+    lines.append("<<NEURAL_TOKENS>>")
+    lines.append(tokens_text)
+    return "\n".join(lines)
+
+def format_tokens(tokens, codebook_size: Optional[int] = None,
+                  compress: bool = False) -> Tuple[str, int, Optional[Dict]]:
+    """(token line, token count, packing) for format_neural_block
+    
+    (codebooks, frames) codes are bit-packed (see neural_tokens.py) - about
+    1.7 characters a token instead of ~5 for JSON; anything that can't be
+    packed (flat or negative tokens) stays JSON.
+    """
+    try:
+        data, packing = pack_codes(tokens, bits=bits_for(codebook_size), compress=compress)
+    except ValueError:
+        return json.dumps(tokens), token_count(tokens), None
+    return base64.b64encode(data).decode("ascii"), packing["codebooks"] * packing["frames"], packing
 
 class ChordCraftCodec:
-    def __init__(self, target_sr: int = 44100, stereo: bool = True):
+    def __init__(self, target_sr: int = 44100, stereo: bool = True, workers: int = 1,
+                 segment_seconds: Optional[float] = None, resampler: str = DEFAULT_RESAMPLER,
+                 compress_tokens: bool = False):
         self.target_sr = target_sr
         self.stereo = stereo
+        # poly / soxr_hq / soxr_vhq (see resampling.py) - never used when rates already match
+        validate_resampler(resampler)
+        self.resampler = resampler
         self.chunk_size = CHUNK_SIZE
+        # segmented mode splits the payload into independent FLAC files that are
+        # encoded in parallel and can be decoded/seeked per segment; it's on when
+        # a segment length is given or there's more than one worker
+        self.workers = max(int(workers), 1)
+        if segment_seconds is None and self.workers > 1:
+            segment_seconds = SEGMENT_SECONDS
+        self.segment_seconds = segment_seconds
+        # deflate the packed neural tokens too - EnCodec codes are close to
+        # uniform, so this rarely saves more than a few percent
+        self.compress_tokens = compress_tokens
+    
+    @property
+    def segmented(self) -> bool:
+        return self.segment_seconds is not None
         
-    def encode_lossless(self, audio_path: str) -> Tuple[bytes, Dict]:
+    def encode_lossless(self, audio_path: AudioSource) -> Tuple[bytes, Dict]:
         """turn audio into lossless FLAC data"""
-        y, sr = librosa.load(audio_path, sr=self.target_sr, mono=not self.stereo)
+        buf = io.BytesIO()
+        metadata = self.encode_lossless_to(audio_path, buf)
+        return buf.getvalue(), metadata
+    
+    def encode_lossless_to(self, audio_path: AudioSource, sink: BinaryIO) -> Dict:
+        """stream audio into `sink` as FLAC one block at a time
         
-        if y.ndim == 1 and self.stereo:
-            y = np.vstack([y, y])  # make mono into stereo by duplicating
+        peak memory is a few BLOCK_FRAMES worth of PCM no matter how long the track is.
+        `sink` has to be seekable because libsndfile rewrites the FLAC header on close.
+        """
+        channels = 2 if self.stereo else 1
+        start = sink.tell()
+        frames = 0
         
-        y = (y.T).astype(np.float32)
-        buf = io.BytesIO()
-        sf.write(buf, y, self.target_sr, format="FLAC", subtype="PCM_16")
-        flac_bytes = buf.getvalue()
+        with sf.SoundFile(sink, "w", samplerate=self.target_sr, channels=channels,
+                          format="FLAC", subtype="PCM_16") as out:
+            for block in self.iter_pcm_blocks(audio_path):
+                out.write(block)
+                frames += len(block)
         
-        # Calculate metadata
-        duration = len(y) / self.target_sr
-        sha256_hash = hashlib.sha256(flac_bytes).hexdigest()
+        # hash the finished stream block by block (the header only becomes final on close)
+        sink.seek(start)
+        sha = hashlib.sha256()
+        size = 0
+        while True:
+            piece = sink.read(HASH_BLOCK)
+            if not piece:
+                break
+            sha.update(piece)
+            size += len(piece)
         
-        metadata = {
+        return {
             "format": "flac",
             "sample_rate": self.target_sr,
-            "channels": 2 if self.stereo else 1,
-            "duration": duration,
-            "sha256": sha256_hash,
-            "size_bytes": len(flac_bytes)
+            "channels": channels,
+            "duration": frames / self.target_sr,
+            "sha256": sha.hexdigest(),
+            "size_bytes": size
         }
+    
+    def encode_segments(self, audio_path: AudioSource) -> Iterator[Tuple[bytes, Dict]]:
+        """encode the track as consecutive, independent FLAC files of segment_seconds each
         
-        return flac_bytes, metadata
+        yields (flac, metadata) in order. segments are encoded on a thread pool -
+        libsndfile drops the GIL while it encodes - with at most two per worker
+        in flight, so memory follows the segment length, not the track length.
+        """
+        segment_frames = max(int(round((self.segment_seconds or SEGMENT_SECONDS) * self.target_sr)), 1)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            start = 0
+            for pcm in self._iter_segment_pcm(audio_path, segment_frames):
+                pending.append(pool.submit(self._encode_segment, pcm, start))
+                start += len(pcm)
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    def _iter_segment_pcm(self, audio_path: AudioSource, segment_frames: int) -> Iterator[np.ndarray]:
+        """regroup the PCM blocks into segment_frames-long pieces (the last may be shorter)"""
+        blocks, held = [], 0
+        for block in self.iter_pcm_blocks(audio_path):
+            blocks.append(block)
+            held += len(block)
+            while held >= segment_frames:
+                pcm = np.concatenate(blocks)
+                yield pcm[:segment_frames]
+                blocks, held = [pcm[segment_frames:]], held - segment_frames
+        if held:
+            yield np.concatenate(blocks)
+    
+    def _encode_segment(self, pcm: np.ndarray, start: int) -> Tuple[bytes, Dict]:
+        buf = io.BytesIO()
+        with sf.SoundFile(buf, "w", samplerate=self.target_sr, channels=pcm.shape[1],
+                          format="FLAC", subtype="PCM_16") as out:
+            out.write(pcm)
+        flac = buf.getvalue()
+        return flac, {
+            "start": start,
+            "frames": len(pcm),
+            "sha256": hashlib.sha256(flac).hexdigest(),
+            "size_bytes": len(flac),
+        }
     
-    def encode_neural(self, audio_path: str, model_name: str = "facebook/encodec_24khz") -> Tuple[List, Dict]:
-        """Encode audio using neural codec (EnCodec)"""
+    def iter_pcm_blocks(self, audio_path: AudioSource) -> Iterator[np.ndarray]:
+        """yield float32 (frames, channels) blocks at target_sr in our channel layout"""
+        source = _as_stream(audio_path)
+        try:
+            src = sf.SoundFile(source)
+        except RuntimeError:
+            # libsndfile can't read this container (AAC, old MP3 builds...) so let
+            # librosa/audioread decode it in one go and just block the result
+            y, _ = _load_whole(source, sr=self.target_sr, mono=not self.stereo, resampler=self.resampler)
+            y = np.atleast_2d(y).T
+            for i in range(0, len(y), BLOCK_FRAMES):
+                yield self._to_layout(y[i:i + BLOCK_FRAMES])
+            return
+        
+        with src:
+            channels = 2 if self.stereo else 1
+            # None when the file is already at target_sr - blocks go straight through
+            resampler = stream_resampler(src.samplerate, self.target_sr, channels, self.resampler)
+            
+            for block in src.blocks(blocksize=BLOCK_FRAMES, dtype="float32", always_2d=True):
+                block = self._to_layout(block)
+                if resampler is not None:
+                    block = resampler.resample_chunk(block)
+                if len(block):
+                    yield block
+            
+            if resampler is not None:
+                tail = resampler.resample_chunk(np.zeros((0, channels), dtype=np.float32), last=True)
+                if len(tail):
+                    yield tail
+    
+    def _to_layout(self, block: np.ndarray) -> np.ndarray:
+        """map a (frames, channels) block onto mono or stereo"""
+        if not self.stereo:
+            return np.ascontiguousarray(block.mean(axis=1, keepdims=True), dtype=np.float32)
+        if block.shape[1] == 1:
+            return np.ascontiguousarray(np.repeat(block, 2, axis=1), dtype=np.float32)  # mono -> stereo
+        return np.ascontiguousarray(block[:, :2], dtype=np.float32)
+    
+    def encode_neural(self, audio_path: AudioSource, model_name: str = DEFAULT_MODEL,
+                      bandwidth: float = DEFAULT_BANDWIDTH) -> Tuple[List, Dict]:
+        """Encode audio using neural codec (EnCodec) - tokens are a (codebooks, frames) nested list"""
+        return self.encode_neural_batch([audio_path], model_name, bandwidth)[0]
+    
+    def encode_neural_batch(self, sources: Sequence[AudioSource], model_name: str = DEFAULT_MODEL,
+                            bandwidth: float = DEFAULT_BANDWIDTH) -> List[Tuple[List, Dict]]:
+        """encode_neural for several files at once - their frames share the model's forward passes"""
+        if not NEURAL_CODECS_ENABLED:
+            raise RuntimeError("Neural codec is disabled (CHORDCRAFT_ENABLE_NEURAL=0)")
         if not NEURAL_CODECS_AVAILABLE:
             raise ImportError("Neural codecs not available. Install torch and transformers.")
         
-        # Load audio
-        y, sr = librosa.load(audio_path, sr=24000, mono=True)  # EnCodec works best at 24kHz mono
-        duration = len(y) / sr
-        
-        # Convert to tensor
-        audio_tensor = torch.tensor(y).unsqueeze(0).unsqueeze(0)  # (1, 1, T)
-        
-        # Load model (simplified - in practice you'd cache this)
-        # This is a placeholder - actual implementation would load the real model
-        print(f"Encoding with {model_name} (placeholder implementation)")
-        
-        # Simulate encoding (replace with actual model)
-        # In practice: model = EncodecModel.from_pretrained(model_name)
-        # codes = model.encode(audio_tensor)
-        
-        # For now, create a simple representation
-        codes = y[::100].tolist()  # Downsample for demo
-        tokens = [int(x * 1000) for x in codes]  # Convert to integer tokens
-        
-        metadata = {
-            "format": "neural_codec",
-            "model": model_name,
-            "sample_rate": 24000,
-            "channels": 1,
-            "duration": duration,
-            "tokens_count": len(tokens),
-            "compression_ratio": len(y) / len(tokens)
-        }
+        # model is loaded once per process and shared (see neural_codec.py)
+        encoder = get_encoder(model_name, bandwidth)
+        signals = [_load_whole(source, sr=encoder.sample_rate, mono=True, resampler=self.resampler)[0]
+                   for source in sources]
         
-        return tokens, metadata
+        results = []
+        for y, codes in zip(signals, encoder.encode_batch(signals)):
+            metadata = {
+                "format": "neural_codec",
+                "model": model_name,
+                "sample_rate": encoder.sample_rate,
+                "channels": 1,
+                "duration": len(y) / encoder.sample_rate,
+                "bandwidth": encoder.bandwidth,
+                "codebooks": codes.shape[0],
+                "codebook_size": encoder.codebook_size,
+                "tokens_count": int(codes.size),
+                "compression_ratio": len(y) / max(codes.size, 1)
+            }
+            results.append((codes.tolist(), metadata))
+        return results
     
     def create_chordcraft_code(self, 
-                              audio_path: str, 
+                              audio_path: AudioSource, 
                               bpm: Optional[int] = None,
                               key: str = "Unknown",
                               time_sig: str = "4/4",
                               chords: Optional[str] = None,
                               include_lossless: bool = True,
-                              include_neural: bool = False) -> str:
+                              include_neural: bool = False,
+                              version: Optional[str] = None,
+                              build_date: Optional[str] = None,
+                              neural_tokens: Optional[Tuple[List, Dict]] = None) -> str:
         """Create ChordCraft v2 code with both lossless and neural encoding"""
+        return "".join(self.iter_chordcraft_code(
+            audio_path, bpm=bpm, key=key, time_sig=time_sig, chords=chords,
+            include_lossless=include_lossless, include_neural=include_neural,
+            version=version, build_date=build_date, neural_tokens=neural_tokens
+        ))
+    
+    def _iter_segmented_payload(self, audio_path: AudioSource) -> Iterator[str]:
+        channels = 2 if self.stereo else 1
+        segment_frames = max(int(round(self.segment_seconds * self.target_sr)), 1)
+        yield format_segmented_audio_block(self.target_sr, channels, segment_frames, self.chunk_size)
+        
+        count = frames = 0
+        for flac, meta in self.encode_segments(audio_path):
+            count += 1
+            frames += meta["frames"]
+            yield format_segment_header(count, meta["start"], meta["frames"], meta["sha256"],
+                                        payload_chunk_count(meta["size_bytes"], self.chunk_size))
+            yield from iter_payload_chunks(flac, self.chunk_size, segment=count)
+        yield format_audio_end(count, frames)
+    
+    def iter_chordcraft_code(self, 
+                             audio_path: AudioSource, 
+                             bpm: Optional[int] = None,
+                             key: str = "Unknown",
+                             time_sig: str = "4/4",
+                             chords: Optional[str] = None,
+                             include_lossless: bool = True,
+                             include_neural: bool = False,
+                             version: Optional[str] = None,
+                             build_date: Optional[str] = None,
+                             neural_tokens: Optional[Tuple[List, Dict]] = None) -> Iterator[str]:
+        """Yield ChordCraft v2 code piece by piece: the header, then one FLAC chunk at a time
+        
+        "".join() of the pieces is exactly what create_chordcraft_code returns, so callers
+        can stream the code to a file or socket without ever holding the whole text.
+        `audio_path` may also be an open binary file or the upload's bytes.
+        `neural_tokens` is an encode_neural() result worked out beforehand (e.g. by
+        encode_neural_batch over several files); without it the tokens are encoded here.
+        """
         
         # Analyze audio if metadata not provided
         if bpm is None:
@@ -112,65 +430,56 @@ class ChordCraftCodec:
         
         chords_line = chords or "| N | N | N | N |"
         
-        # Build code structure
-        lines = []
-        lines.append("Song {")
-        lines.append(f'  meta: {{ bpm: {bpm}, key: "{key}", time: "{time_sig}" }}')
-        lines.append("  analysis: {")
-        lines.append(f"    chords: {chords_line}")
-        lines.append("  }")
+        meta = {"bpm": bpm, "key": key, "time": time_sig}
+        if version:
+            meta["version"] = version
+        if build_date:
+            meta["build"] = build_date
+        
+        # Header goes out straight away - it doesn't depend on the payload
+        yield format_header(meta, chords_line)
         
         # Add lossless payload if requested
-        if include_lossless:
-            flac_bytes, flac_meta = self.encode_lossless(audio_path)
-            b64_data = base64.b64encode(flac_bytes).decode("ascii")
-            total_chunks = math.ceil(len(b64_data) / self.chunk_size)
+        if include_lossless and self.segmented:
+            yield from self._iter_segmented_payload(audio_path)
+        elif include_lossless:
+            buf = io.BytesIO()
+            flac_meta = self.encode_lossless_to(audio_path, buf)
+            total_chunks = payload_chunk_count(flac_meta["size_bytes"], self.chunk_size)
             
-            lines.append("  audio: {")
-            lines.append(f'    format: "flac", sr: {flac_meta["sample_rate"]}, channels: {flac_meta["channels"]},')
-            lines.append(f'    sha256: "{flac_meta["sha256"]}", chunks: {total_chunks}, chunk_size: {self.chunk_size}')
-            lines.append("  }")
-            lines.append("")
+            yield format_audio_block(flac_meta["sample_rate"], flac_meta["channels"],
+                                     flac_meta["sha256"], total_chunks, self.chunk_size)
             
             # Add FLAC chunks
-            for i in range(total_chunks):
-                start = i * self.chunk_size
-                end = min((i + 1) * self.chunk_size, len(b64_data))
-                lines.append(f"<<PAYLOAD:FLAC:{i+1}>>")
-                lines.append(b64_data[start:end])
+            with buf.getbuffer() as flac_view:
+                yield from iter_payload_chunks(flac_view, self.chunk_size)
+            buf.close()
         
         # Add neural codec if requested
-        if include_neural and NEURAL_CODECS_AVAILABLE:
+        if include_neural and NEURAL_CODECS_ENABLED and NEURAL_CODECS_AVAILABLE:
             try:
-                tokens, neural_meta = self.encode_neural(audio_path)
-                lines.append("")
-                lines.append("  neural: {")
-                lines.append(f'    format: "neural_codec", model: "{neural_meta["model"]}",')
-                lines.append(f'    tokens: {len(tokens)}, compression_ratio: {neural_meta["compression_ratio"]:.2f}')
-                lines.append("  }")
-                lines.append("")
-                
-                # Add neural tokens (much smaller)
-                tokens_json = json.dumps(tokens)
-                lines.append("<<NEURAL_TOKENS>>")
-                lines.append(tokens_json)
+                tokens, neural_meta = neural_tokens or self.encode_neural(audio_path)
+                # Add neural tokens (much smaller), bit-packed
+                yield format_neural_block(neural_meta["model"], neural_meta["compression_ratio"],
+                                          *format_tokens(tokens, neural_meta.get("codebook_size"),
+                                                         self.compress_tokens))
             except Exception as e:
                 print(f"Neural encoding failed: {e}")
         
-        lines.append("}")
-        return "\n".join(lines)
+        yield CODE_FOOTER
 
 def main():
     """CLI for encoding audio files"""
     if len(sys.argv) < 2:
-        print("Usage: python audio_codec.py <audio_file> [--neural] [--lossless-only]")
+        print("Usage: python audio_codec.py <audio_file> [--neural] [--lossless-only] [--workers N]")
         sys.exit(1)
     
     audio_path = sys.argv[1]
     include_neural = "--neural" in sys.argv
     lossless_only = "--lossless-only" in sys.argv
+    workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv else 1
     
-    codec = ChordCraftCodec()
+    codec = ChordCraftCodec(workers=workers)
     
     try:
         code = codec.create_chordcraft_code(
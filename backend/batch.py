@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Batch processing for ChordCraft
+Encodes and/or analyses whole directories (or manifests) of audio files on a
+process pool, writes one result per file and skips finished files on rerun
+
+Usage: python batch.py INPUT [INPUT ...] (-o OUTPUT_DIR | --jsonl FILE)
+                       [--tasks encode analysis] [-j N] [--pitch-engine ENGINE]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+AUDIO_EXTENSIONS = {".wav", ".flac", ".mp3", ".ogg", ".oga", ".aac", ".m4a", ".aif", ".aiff"}
+TASKS = ("encode", "analysis")
+# settings that shape each task's output - part of the resume key
+TASK_SETTINGS = {"encode": ("target_sr", "stereo", "neural"), "analysis": ("pitch_engine",)}
+MANIFEST_NAME = "manifest.jsonl"
+# files per work item when neural tokens are on - their EnCodec frames share forward passes
+NEURAL_GROUP = 4
+
+
+def discover(inputs: Iterable[str]) -> List[str]:
+    """audio files from a mix of files, directories (walked recursively) and manifests
+
+    a manifest is a .txt/.lst file with one path per line or a .jsonl file with
+    a "path" per record; relative entries are resolved against the manifest's folder.
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                found.extend(os.path.join(root, name) for name in sorted(files)
+                             if os.path.splitext(name)[1].lower() in AUDIO_EXTENSIONS)
+        elif os.path.splitext(item)[1].lower() in (".txt", ".lst", ".jsonl"):
+            base = os.path.dirname(os.path.abspath(item))
+            with open(item, encoding="utf-8") as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    path = json.loads(line)["path"] if item.endswith(".jsonl") else line
+                    found.append(os.path.join(base, path))
+        else:
+            found.append(item)
+
+    # keep the first occurrence of each file
+    seen, unique = set(), []
+    for path in map(os.path.abspath, found):
+        if path not in seen:
+            seen.add(path)
+            unique.append(path)
+    return unique
+
+
+def fingerprint(path: str) -> List:
+    st = os.stat(path)
+    return [st.st_size, int(st.st_mtime)]
+
+
+def task_settings(tasks: Iterable[str], settings: Dict) -> Dict:
+    """the settings that matter for these tasks"""
+    return {name: settings[name] for task in sorted(tasks) for name in TASK_SETTINGS[task]}
+
+
+# ---------------------------------------------------------------------------
+# worker side
+
+# one codec / analyzer per distinct settings - with workers=1 this runs in the
+# caller's process, where several runners with different settings may share it
+_codec_cache: Dict[tuple, object] = {}
+_analyzer_cache: Dict[str, object] = {}
+
+
+def _audio_seconds(path: str) -> Optional[float]:
+    import soundfile as sf
+    try:
+        return sf.info(path).duration
+    except Exception:
+        try:
+            import librosa
+            return librosa.get_duration(path=path)
+        except Exception:
+            return None
+
+
+def _get_codec(settings: Dict):
+    codec_key = (settings["target_sr"], settings["stereo"])
+    codec = _codec_cache.get(codec_key)
+    if codec is None:
+        from audio_codec import ChordCraftCodec
+        codec = _codec_cache[codec_key] = ChordCraftCodec(target_sr=settings["target_sr"],
+                                                          stereo=settings["stereo"])
+    return codec
+
+
+def process_file(path: str, tasks: List[str], output_base: Optional[str], settings: Dict,
+                 neural_tokens: Optional[Tuple[List, Dict]] = None) -> Dict:
+    """run the requested tasks on one file (in a worker); never raises"""
+    started = time.perf_counter()
+    record = {"path": path, "tasks": sorted(tasks), "settings": task_settings(tasks, settings)}
+    try:
+        record.update(fingerprint=fingerprint(path), audio_seconds=_audio_seconds(path))
+        outputs = {}
+        if "encode" in tasks:
+            code = _get_codec(settings).create_chordcraft_code(audio_path=path, include_neural=settings["neural"],
+                                                               neural_tokens=neural_tokens)
+            outputs["code"] = _write_output(output_base, ".cc", code)
+
+        if "analysis" in tasks:
+            analyzer = _analyzer_cache.get(settings["pitch_engine"])
+            if analyzer is None:
+                from muzic_integration import MuzicEnhancedAnalyzer
+                analyzer = _analyzer_cache[settings["pitch_engine"]] = MuzicEnhancedAnalyzer(
+                    pitch_engine=settings["pitch_engine"])
+            results = analyzer.analyze_audio_enhanced(path)
+            if results.get("analysis_type") == "muzic_error":
+                raise RuntimeError(results.get("error", "analysis failed"))
+            outputs["analysis"] = _write_output(output_base, ".analysis.json", json.dumps(results))
+
+        record.update(status="ok", outputs=outputs)
+    except Exception as e:
+        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+    record["elapsed"] = time.perf_counter() - started
+    return record
+
+
+def process_group(paths: List[str], tasks: List[str], output_bases: List[Optional[str]],
+                  settings: Dict) -> List[Dict]:
+    """process_file over several files, encoding their neural tokens in one batch first"""
+    started = time.perf_counter()
+    batched = [None] * len(paths)
+    if settings["neural"] and "encode" in tasks and len(paths) > 1:
+        try:
+            from audio_codec import NEURAL_CODECS_AVAILABLE, NEURAL_CODECS_ENABLED
+            if NEURAL_CODECS_ENABLED and NEURAL_CODECS_AVAILABLE:
+                batched = _get_codec(settings).encode_neural_batch(paths)
+        except Exception:
+            pass  # e.g. one unreadable file - every file encodes (or fails) on its own below
+    shared = (time.perf_counter() - started) / len(paths)
+
+    records = []
+    for path, output_base, neural_tokens in zip(paths, output_bases, batched):
+        record = process_file(path, tasks, output_base, settings, neural_tokens=neural_tokens)
+        record["elapsed"] += shared
+        records.append(record)
+    return records
+
+
+def _write_output(output_base: Optional[str], suffix: str, text: str):
+    """write next to output_base (directory mode) or hand the text back (JSONL mode)"""
+    if output_base is None:
+        return text if suffix == ".cc" else json.loads(text)
+    path = output_base + suffix
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".part"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+    return path
+
+
+# ---------------------------------------------------------------------------
+# parent side
+
+class BatchRunner:
+    """
+    Process many audio files with the codec and/or the enhanced analyzer.
+
+    Results go either to output_dir (one .cc / .analysis.json per input,
+    mirroring the input tree, plus manifest.jsonl) or, with jsonl_path, into a
+    single JSON lines file with the results inline. Either way the JSONL file
+    doubles as the resume manifest: files whose last record is "ok" for the
+    same tasks and settings and an unchanged size/mtime are skipped.
+    """
+
+    def __init__(self, tasks=("encode",), output_dir: Optional[str] = None,
+                 jsonl_path: Optional[str] = None, workers: Optional[int] = None,
+                 target_sr: int = 44100, stereo: bool = True, neural: bool = False,
+                 pitch_engine: str = "pyin", progress_every: float = 5.0):
+        if (output_dir is None) == (jsonl_path is None):
+            raise ValueError("exactly one of output_dir or jsonl_path is required")
+        unknown = set(tasks) - set(TASKS)
+        if unknown or not tasks:
+            raise ValueError(f"tasks must be a non-empty subset of {TASKS}")
+        if neural and "encode" in tasks:
+            # otherwise every code would quietly come out without its tokens
+            import neural_codec
+            if not neural_codec.NEURAL_CODECS_AVAILABLE:
+                raise ValueError("neural tokens need torch and transformers installed")
+            if not neural_codec.NEURAL_CODECS_ENABLED:
+                raise ValueError("neural tokens are switched off (CHORDCRAFT_ENABLE_NEURAL=0)")
+
+        self.tasks = sorted(set(tasks))
+        self.output_dir = output_dir
+        self.manifest_path = jsonl_path or os.path.join(output_dir, MANIFEST_NAME)
+        self.workers = workers or os.cpu_count() or 1
+        self.settings = {"target_sr": target_sr, "stereo": stereo, "neural": neural,
+                         "pitch_engine": pitch_engine}
+        self.progress_every = progress_every
+
+    def completed(self) -> Dict[str, List]:
+        """path -> fingerprint of every file already finished with these tasks and settings"""
+        settings = task_settings(self.tasks, self.settings)
+        done = {}
+        try:
+            with open(self.manifest_path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from an interrupted run
+                    if (record.get("status") == "ok" and record.get("tasks") == self.tasks
+                            and record.get("settings") == settings):
+                        done[record["path"]] = record.get("fingerprint")
+                    else:
+                        done.pop(record.get("path"), None)
+        except FileNotFoundError:
+            pass
+        return done
+
+    def _output_base(self, path: str, root: str) -> Optional[str]:
+        if self.output_dir is None:
+            return None
+        relative = os.path.relpath(path, root)
+        return os.path.join(self.output_dir, os.path.splitext(relative)[0])
+
+    def pending(self, paths: List[str]) -> List[str]:
+        done = self.completed()
+        return [p for p in paths if done.get(p) != _safe_fingerprint(p)]
+
+    def run(self, inputs: Iterable[str]) -> Dict:
+        """process everything under inputs that isn't done yet; returns throughput stats"""
+        paths = discover(inputs)
+        todo = self.pending(paths)
+        root = os.path.commonpath([os.path.dirname(p) for p in paths]) if paths else ""
+
+        stats = {"files": len(paths), "skipped": len(paths) - len(todo), "ok": 0, "failed": 0,
+                 "audio_seconds": 0.0}
+        started = time.perf_counter()
+        last_report = started
+
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.manifest_path, "a+", encoding="utf-8") as manifest:
+            if manifest.tell():
+                manifest.seek(manifest.tell() - 1)
+                if manifest.read(1) != "\n":
+                    manifest.write("\n")  # don't glue new records onto a torn last line
+            for record in self._iter_results(todo, root):
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+                stats[record["status"]] += 1
+                stats["audio_seconds"] += record.get("audio_seconds") or 0.0
+                if record["status"] != "ok":
+                    print(f"FAIL {record['path']}: {record['error']}", file=sys.stderr)
+
+                now = time.perf_counter()
+                if now - last_report >= self.progress_every:
+                    last_report = now
+                    print(self._progress_line(stats, len(todo), now - started), file=sys.stderr)
+
+        elapsed = time.perf_counter() - started
+        processed = stats["ok"] + stats["failed"]
+        stats.update(
+            elapsed=elapsed,
+            files_per_second=processed / elapsed if elapsed else 0.0,
+            audio_seconds_per_second=stats["audio_seconds"] / elapsed if elapsed else 0.0,
+        )
+        return stats
+
+    def _progress_line(self, stats: Dict, total: int, elapsed: float) -> str:
+        processed = stats["ok"] + stats["failed"]
+        return (f"{processed}/{total} files ({stats['failed']} failed) - "
+                f"{processed / elapsed:.2f} files/s, {stats['audio_seconds'] / elapsed:.1f} audio s/s")
+
+    def _groups(self, paths: List[str]) -> List[List[str]]:
+        size = NEURAL_GROUP if self.settings["neural"] and "encode" in self.tasks else 1
+        return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+    def _iter_results(self, paths: List[str], root: str) -> Iterator[Dict]:
+        groups = self._groups(paths)
+        if self.workers <= 1:
+            for group in groups:
+                yield from process_group(group, self.tasks, [self._output_base(p, root) for p in group],
+                                         self.settings)
+            return
+
+        # spawn, not fork - librosa/numba and BLAS threads don't survive forking well
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+            queue = iter(groups)
+            in_flight = set()
+            while True:
+                # keep a couple of groups per worker queued, not the whole catalogue
+                while len(in_flight) < self.workers * 2:
+                    group = next(queue, None)
+                    if group is None:
+                        break
+                    in_flight.add(pool.submit(process_group, group, self.tasks,
+                                              [self._output_base(p, root) for p in group], self.settings))
+                if not in_flight:
+                    return
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+
+
+def _safe_fingerprint(path: str) -> Optional[List]:
+    try:
+        return fingerprint(path)
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode and/or analyse many audio files at once")
+    parser.add_argument("inputs", nargs="+", help="audio files, directories, or .txt/.jsonl manifests")
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument("-o", "--output-dir", help="write one result file per input here")
+    out.add_argument("--jsonl", help="append results inline to this JSON lines file")
+    parser.add_argument("--tasks", nargs="+", choices=TASKS, default=["encode"],
+                        help="what to run on each file (default: encode)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument("--target-sr", type=int, default=44100, help="codec sample rate")
+    parser.add_argument("--mono", action="store_true", help="encode mono instead of stereo")
+    parser.add_argument("--neural", action="store_true", help="include neural codec tokens")
+    parser.add_argument("--pitch-engine", default="pyin", help="analyzer pitch engine (pyin, onset_pyin, hps)")
+    args = parser.parse_args()
+
+    try:
+        runner = BatchRunner(
+            tasks=args.tasks, output_dir=args.output_dir, jsonl_path=args.jsonl, workers=args.workers,
+            target_sr=args.target_sr, stereo=not args.mono, neural=args.neural,
+            pitch_engine=args.pitch_engine,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    stats = runner.run(args.inputs)
+    print(f"{stats['ok']} ok, {stats['failed']} failed, {stats['skipped']} skipped "
+          f"in {stats['elapsed']:.1f}s - {stats['files_per_second']:.2f} files/s, "
+          f"{stats['audio_seconds_per_second']:.1f} audio s/s")
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Pitch engine benchmark for MuzicEnhancedAnalyzer
+Compares latency and accuracy of the onset_pyin and hps engines against
+full-resolution pYIN, on a synthetic melody or on an audio file
+
+Usage: python benchmark_pitch.py [audio_file] [--seconds N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import librosa
+
+from muzic_integration import AnalysisFeatures, MuzicEnhancedAnalyzer
+
+
+NOTE_LENGTH = 0.4  # seconds per note in the synthetic melody
+
+
+def create_benchmark_audio(seconds=30.0, sample_rate=22050, seed=0):
+    """random melody across C2-C7 with harmonics and a decaying envelope
+
+    returns (y, sr, midi) where midi[i] is the note sounding from i * NOTE_LENGTH
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(sample_rate * NOTE_LENGTH)) / sample_rate
+    envelope = np.exp(-t * 3)
+    midi = rng.randint(36, 96, size=int(seconds / NOTE_LENGTH))
+    notes = []
+    for note in midi:
+        freq = librosa.midi_to_hz(note)
+        tone = sum((0.6 ** k) * np.sin(2 * np.pi * freq * (k + 1) * t) for k in range(5))
+        notes.append(envelope * tone)
+    y = np.concatenate(notes) * 0.2
+    return y.astype(np.float32), sample_rate, midi
+
+
+def run_engine(engine, features):
+    analyzer = MuzicEnhancedAnalyzer(pitch_engine=engine)
+    start = time.perf_counter()
+    result = analyzer._analyze_pitch_advanced(features)
+    return result, time.perf_counter() - start
+
+
+def note_accuracy(result, midi, hop_length, sr):
+    """share of onsets whose detected note matches the synthetic ground truth"""
+    times = np.asarray(result['onset_times'])
+    if len(times) == 0:
+        return float('nan')
+    frames = librosa.time_to_frames(times, sr=sr, hop_length=hop_length)
+    truth = midi[np.minimum((times / NOTE_LENGTH + 1e-3).astype(int), len(midi) - 1)]
+    f0 = result['f0'][frames]
+    detected = np.where(np.isnan(f0), -1, np.round(librosa.hz_to_midi(np.nan_to_num(f0, nan=1.0))))
+    return float(np.mean(detected == truth))
+
+
+def compare(reference, candidate, hop_length, sr):
+    """agreement with the reference engine at the onset frames _generate_enhanced_code reads"""
+    frames = librosa.time_to_frames(reference['onset_times'], sr=sr, hop_length=hop_length)
+    frames = frames[frames < len(reference['f0'])]
+    ref_voiced = reference['voiced_flag'][frames]
+    cand_voiced = candidate['voiced_flag'][frames]
+    both = ref_voiced & cand_voiced & ~np.isnan(candidate['f0'][frames])
+    cents = 1200 * np.abs(np.log2(candidate['f0'][frames][both] / reference['f0'][frames][both]))
+    return {
+        'onsets': len(frames),
+        'voicing_agreement': float(np.mean(ref_voiced == cand_voiced)) if len(frames) else 1.0,
+        'note_agreement': float(np.mean(cents < 50)) if len(cents) else 0.0,
+        'median_cents_error': float(np.median(cents)) if len(cents) else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MuzicEnhancedAnalyzer pitch engines")
+    parser.add_argument("audio_file", nargs="?", help="audio to analyse (default: synthetic melody)")
+    parser.add_argument("--seconds", type=float, default=30.0, help="how much audio to use")
+    args = parser.parse_args()
+
+    analyzer = MuzicEnhancedAnalyzer()
+    midi = None
+    if args.audio_file:
+        y, sr = librosa.load(args.audio_file, sr=analyzer.sample_rate, duration=args.seconds)
+    else:
+        y, sr, midi = create_benchmark_audio(args.seconds, analyzer.sample_rate)
+    print(f"Benchmarking pitch engines on {len(y) / sr:.1f}s of audio")
+
+    # shared features (HPSS, onsets, chroma) are computed up front so only pitch tracking is timed
+    features = AnalysisFeatures(y, sr, hop_length=analyzer.hop_length, n_fft=analyzer.frame_size)
+    _ = (features.harmonic_magnitude, features.harmonic_chroma, features.harmonic_onset_envelope)
+    librosa.pyin(y[:sr], fmin=65.0, fmax=2093.0, sr=sr)  # numba warm-up
+
+    # voicing/notes/cents are measured against full pYIN at the onset frames;
+    # truth is note accuracy against the synthetic melody (n/a for real files)
+    reference, ref_time = run_engine('pyin', features)
+    print(f"{'engine':<12}{'time (s)':>10}{'speedup':>10}{'voicing':>10}{'notes':>10}{'cents':>10}{'truth':>10}")
+    for engine in MuzicEnhancedAnalyzer.PITCH_ENGINES:
+        if engine == 'pyin':
+            result, elapsed = reference, ref_time
+        else:
+            result, elapsed = run_engine(engine, features)
+        stats = compare(reference, result, analyzer.hop_length, sr)
+        truth = note_accuracy(result, midi, analyzer.hop_length, sr) if midi is not None else float('nan')
+        print(f"{engine:<12}{elapsed:>10.3f}{ref_time / elapsed:>10.1f}"
+              f"{stats['voicing_agreement']:>10.3f}{stats['note_agreement']:>10.3f}"
+              f"{stats['median_cents_error']:>10.1f}{truth:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+# ChordCraft binary container - the same song as a v2 code, without the base64
+# the FLAC sits in the file raw and 8-byte aligned, so a container can be mmap'd and
+# its payload handed out (or sendfile'd) without decoding or copying anything.
+# conversion to and from the text form is exact: to_text() reproduces the original
+# code byte for byte.
+#
+# layout:  MAGIC, then sections of  tag[4] | u32 flags | u64 length | payload | pad to 8
+#   META  json - the meta: { } fields in order
+#   CHRD  utf-8 - the analysis chords line
+#   AUDI  json - sr / channels / sha256 (or segment_frames) / chunk_size of the lossless payload
+#   SEGS  json - start / frames / sha256 / offset / size of each FLAC in a segmented payload
+#   FLAC  raw FLAC file (a segmented payload's FLAC files back to back)
+#   NEUR  json - neural block fields, plus how TOKN is stored
+#   TOKN  neural tokens - the raw bit-packed bytes for packed tokens, otherwise a
+#         little-endian int32 array (or json when they don't fit one)
+#   HEAD  verbatim text before the payload, only when regenerating it wouldn't match
+#   TAIL  verbatim text after the payload, same
+#   END.  terminator
+
+import base64
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import soundfile as sf
+
+from audio_codec import (CODE_FOOTER, format_audio_block, format_audio_end, format_header,
+                         format_neural_block, format_segment_header, format_segmented_audio_block,
+                         iter_payload_chunks, payload_chunk_count, token_count)
+from chordcraft_decoder import (NEURAL_MARKER, ChecksumMismatch, ChordCraftDecodeError,
+                                ChordCraftDocument, SegmentedAudio)
+from neural_tokens import PACKED_ENCODINGS, unpack_codes
+
+MAGIC = b"CCBIN\x00\x00\x01"  # last byte is the container version
+CONTAINER_MIME = "application/vnd.chordcraft.v2+binary"
+_SECTION = struct.Struct("<4sIQ")
+_ALIGN = 8
+
+TOKEN_DTYPE = "<i4"
+
+
+class ContainerError(ChordCraftDecodeError):
+    """the file isn't a well-formed container, or the text can't be converted exactly"""
+
+
+def _pad(length: int) -> int:
+    return -length % _ALIGN
+
+
+def _write_section(sink, tag: bytes, payload, flags: int = 0) -> int:
+    """one section; payload may be any bytes-like (or a list of them). returns bytes written"""
+    pieces = payload if isinstance(payload, list) else [payload]
+    length = sum(len(memoryview(p)) for p in pieces)
+    sink.write(_SECTION.pack(tag, flags, length))
+    for piece in pieces:
+        sink.write(piece)
+    sink.write(b"\0" * _pad(length))
+    return _SECTION.size + length + _pad(length)
+
+
+def _json(value) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+_PACKING_FIELDS = ("encoding", "bits", "codebooks", "frames")
+
+
+def _pack_tokens(tokens_line: bytes, fields: Dict):
+    """(stored bytes, layout) for the token line under a neural block with these fields
+
+    packed tokens are stored as their raw bytes; json ones as an int32 array
+    when that round-trips the json exactly.
+    """
+    if fields.get("encoding") in PACKED_ENCODINGS:
+        try:
+            return base64.b64decode(tokens_line, validate=True), {k: fields.get(k) for k in _PACKING_FIELDS}
+        except ValueError as e:
+            raise ContainerError(f"bad packed neural tokens: {e}") from e
+    tokens_json = tokens_line
+    tokens = json.loads(tokens_json)
+    try:
+        array = np.asarray(tokens)
+    except ValueError:
+        array = None  # ragged
+    if (array is not None and array.size and array.dtype.kind == "i"
+            and np.all(array == array.astype(TOKEN_DTYPE))
+            and json.dumps(array.tolist()).encode("ascii") == bytes(tokens_json)):
+        return array.astype(TOKEN_DTYPE).tobytes(), {"encoding": "int32", "shape": list(array.shape)}
+    return bytes(tokens_json), {"encoding": "json"}
+
+
+# ---------------------------------------------------------------------------
+# text -> container
+
+def text_to_container(code, sink) -> int:
+    """convert ChordCraft v2 text (str, bytes or mmap) into a container written to sink
+
+    the payload has to be chunked the way the encoder chunks it (the decoder
+    assumes the same); anything else in the text that a plain regeneration
+    wouldn't reproduce is kept verbatim. Returns bytes written.
+    """
+    doc = code if isinstance(code, ChordCraftDocument) else ChordCraftDocument(code)
+    data = doc._data
+    written = sink.write(MAGIC)
+
+    written += _write_section(sink, b"META", _json(doc.meta))
+    written += _write_section(sink, b"CHRD", (doc.chords or "").encode("utf-8"))
+
+    audio = None
+    if doc.has_audio:
+        # the FLAC's length goes in front of it, so decode it into a buffer first
+        # (checking the sha256s on the way)
+        flac = io.BytesIO()
+        segments = []
+        for index, info in enumerate(doc.segments):
+            offset = flac.tell()
+            doc.write_flac(flac, verify=True, segment=index)
+            segments.append({"start": info["start"], "frames": info["frames"], "sha256": info["sha256"],
+                             "offset": offset, "size": flac.tell() - offset})
+
+        if doc.segmented:
+            audio = {k: doc.audio.get(k) for k in ("sr", "channels", "segment_frames", "chunk_size")}
+            head_end = data.rfind(b"\n\n  segment: {", 0, doc.chunks[0][0])
+        else:
+            audio = {k: doc.audio.get(k) for k in ("sr", "channels", "sha256", "chunk_size")}
+            head_end = doc.chunks[0][0] - len("\n<<PAYLOAD:FLAC:1>>\n")
+        written += _write_section(sink, b"AUDI", _json(audio))
+        if doc.segmented:
+            written += _write_section(sink, b"SEGS", _json(segments))
+        tail_start = _check_payload(data, head_end, _iter_payload_text(audio, segments, flac.getbuffer()))
+        written += _write_section(sink, b"FLAC", flac.getbuffer())
+    else:
+        regenerated = format_header(doc.meta, doc.chords or "").encode("utf-8")
+        head_end = len(regenerated) if bytes(data[:len(regenerated)]) == regenerated else len(data)
+        tail_start = head_end
+
+    neural, stored = None, None
+    neural_pos = data.find(NEURAL_MARKER, tail_start)
+    if neural_pos >= 0 and doc.neural is not None:
+        start = neural_pos + len(NEURAL_MARKER)
+        end = data.find(b"\n", start)
+        stored, layout = _pack_tokens(bytes(data[start:end if end >= 0 else len(data)]), doc.neural)
+        neural = {"model": doc.neural.get("model"), "compression_ratio": doc.neural.get("compression_ratio"),
+                  **layout}
+        written += _write_section(sink, b"NEUR", _json(neural))
+        written += _write_section(sink, b"TOKN", stored)
+
+    # keep whatever the regenerated text wouldn't reproduce
+    head, tail = _regenerate_edges(doc.meta, doc.chords or "", audio, len(doc.chunks), neural, stored)
+    if bytes(data[:head_end]) != head:
+        written += _write_section(sink, b"HEAD", bytes(data[:head_end]))
+    if bytes(data[tail_start:]) != tail:
+        written += _write_section(sink, b"TAIL", bytes(data[tail_start:]))
+
+    written += _write_section(sink, b"END.", b"")
+    return written
+
+
+def _iter_payload_text(audio: Dict, segments: List[Dict], flac) -> Iterator[str]:
+    """the payload part of the text - chunks, plus segment headers for a segmented payload"""
+    chunk_size = audio["chunk_size"]
+    if "segment_frames" not in audio:
+        yield from iter_payload_chunks(flac, chunk_size)
+        return
+    for index, info in enumerate(segments, start=1):
+        view = flac[info["offset"]:info["offset"] + info["size"]]
+        yield format_segment_header(index, info["start"], info["frames"], info["sha256"],
+                                    payload_chunk_count(info["size"], chunk_size))
+        yield from iter_payload_chunks(view, chunk_size, segment=index)
+    yield format_audio_end(len(segments), sum(info["frames"] for info in segments))
+
+
+def _check_payload(data, pos: int, pieces: Iterator[str]) -> int:
+    """the payload text must be exactly what the encoder would write; returns where it ends"""
+    for piece in pieces:
+        piece = piece.encode("ascii")
+        if data[pos:pos + len(piece)] != piece:
+            raise ContainerError("payload isn't laid out the way the encoder writes it, can't convert exactly")
+        pos += len(piece)
+    return pos
+
+
+def _regenerate_edges(meta: Dict, chords: str, audio: Optional[Dict], chunks: int,
+                      neural: Optional[Dict], stored):
+    """(text before the payload, text after it) as the encoder would write them"""
+    head = format_header(meta, chords) + (_format_audio(audio, chunks) if audio is not None else "")
+    tail = ""
+    if neural is not None:
+        tail += format_neural_block(neural["model"], neural["compression_ratio"], *_token_line(neural, stored))
+    tail += CODE_FOOTER
+    return head.encode("utf-8"), tail.encode("utf-8")
+
+
+def _token_line(neural: Dict, stored):
+    """(token line, token count, packing) for format_neural_block, from TOKN as stored"""
+    if neural.get("encoding") in PACKED_ENCODINGS:
+        packing = {k: neural[k] for k in _PACKING_FIELDS}
+        return base64.b64encode(stored).decode("ascii"), packing["codebooks"] * packing["frames"], packing
+    if neural.get("encoding") == "int32":
+        tokens_json = json.dumps(np.frombuffer(stored, dtype=TOKEN_DTYPE).reshape(neural["shape"]).tolist())
+    else:
+        tokens_json = bytes(stored).decode("utf-8")
+    return tokens_json, token_count(json.loads(tokens_json)), None
+
+
+def _format_audio(audio: Dict, chunks: int) -> str:
+    if "segment_frames" in audio:
+        return format_segmented_audio_block(audio["sr"], audio["channels"], audio["segment_frames"],
+                                            audio["chunk_size"])
+    return format_audio_block(audio["sr"], audio["channels"], audio["sha256"], chunks, audio["chunk_size"])
+
+
+def convert_file(src: str, dst: str) -> int:
+    """text code -> container or container -> text code, depending on what src is"""
+    tmp = dst + ".part"
+    with open(src, "rb") as fh:
+        is_container = fh.read(len(MAGIC)) == MAGIC
+    try:
+        if is_container:
+            with ChordCraftContainer.open(src) as container, open(tmp, "wb") as out:
+                size = 0
+                for piece in container.iter_text():
+                    size += out.write(piece.encode("utf-8"))
+        else:
+            with ChordCraftDocument.open(src) as doc, open(tmp, "wb") as out:
+                size = text_to_container(doc, out)
+        os.replace(tmp, dst)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return size
+
+
+# ---------------------------------------------------------------------------
+# container -> everything else
+
+class ChordCraftContainer(SegmentedAudio):
+    """
+    A binary ChordCraft container, parsed by walking its section headers.
+
+    Nothing is decoded or copied up front: `flac` and `neural_tokens` are views
+    straight into the underlying bytes / mmap (see open()), and `flac_offset`
+    / `flac_length` give the payload's place in the file for sendfile-style
+    serving. A segmented payload's FLAC files are listed in `segments`, with
+    offsets relative to `flac`.
+    """
+
+    def __init__(self, data):
+        if bytes(data[:len(MAGIC)]) != MAGIC:
+            raise ContainerError("not a ChordCraft container (bad magic)")
+        self._data = data
+        self._mmap = None
+        self.sections: Dict[str, tuple] = {}  # tag -> (offset, length)
+
+        pos = len(MAGIC)
+        while True:
+            if pos + _SECTION.size > len(data):
+                raise ContainerError("container is truncated (no END section)")
+            tag, _flags, length = _SECTION.unpack_from(data, pos)
+            pos += _SECTION.size
+            if pos + length > len(data):
+                raise ContainerError(f"section {tag!r} runs past the end of the file")
+            if tag == b"END.":
+                break
+            self.sections[tag.decode("ascii")] = (pos, length)
+            pos += length + _pad(length)
+
+        self.meta = self._json_section("META") or {}
+        self.chords = bytes(self._section("CHRD") or b"").decode("utf-8")
+        self.audio = self._json_section("AUDI")
+        self.segments = self._json_section("SEGS")
+        if self.audio is not None and self.segments is None:
+            self.audio["chunks"] = payload_chunk_count(self.flac_length, self.audio["chunk_size"])
+            self.segments = [{"start": 0, "frames": None, "sha256": self.audio.get("sha256"),
+                              "offset": 0, "size": self.flac_length}]
+        self.neural = self._json_section("NEUR")
+
+    @classmethod
+    def open(cls, path: str) -> "ChordCraftContainer":
+        """memory-map a container file instead of reading it"""
+        with open(path, "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        container = cls(mapped)
+        container._mmap = mapped
+        return container
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _json_section(self, tag: str):
+        section = self._section(tag)
+        return json.loads(bytes(section)) if section is not None else None
+
+    def _section(self, tag: str) -> Optional[memoryview]:
+        if tag not in self.sections:
+            return None
+        offset, length = self.sections[tag]
+        return memoryview(self._data)[offset:offset + length]
+
+    # -- FLAC payload -------------------------------------------------------
+
+    @property
+    def has_audio(self) -> bool:
+        return "FLAC" in self.sections
+
+    @property
+    def flac_offset(self) -> int:
+        return self.sections["FLAC"][0]
+
+    @property
+    def flac_length(self) -> int:
+        return self.sections["FLAC"][1] if self.has_audio else 0
+
+    @property
+    def segmented(self) -> bool:
+        return self.audio is not None and "segment_frames" in self.audio
+
+    def _require_audio(self):
+        if not self.has_audio:
+            raise ContainerError("container has no lossless audio payload")
+
+    @property
+    def flac(self) -> memoryview:
+        """the FLAC payload, zero-copy"""
+        self._require_audio()
+        return self._section("FLAC")
+
+    def segment_flac(self, segment: int = 0) -> memoryview:
+        """one segment's FLAC file, zero-copy"""
+        info = self.segments[segment]
+        return self.flac[info["offset"]:info["offset"] + info["size"]]
+
+    def verify(self) -> bool:
+        """check the sha256 of every segment"""
+        return all(hashlib.sha256(self.segment_flac(segment)).hexdigest() == info["sha256"]
+                   for segment, info in enumerate(self.segments))
+
+    def flac_bytes(self, verify: bool = True, segment: int = 0) -> bytes:
+        flac = self.segment_flac(segment)
+        if verify and hashlib.sha256(flac).hexdigest() != self.segments[segment]["sha256"]:
+            raise ChecksumMismatch(f"FLAC payload doesn't match sha256 {self.segments[segment]['sha256']}")
+        return bytes(flac)
+
+    def payload_reader(self, segment: int = 0) -> io.BufferedReader:
+        """seekable file object over one segment's FLAC bytes"""
+        return io.BufferedReader(_ViewReader(self.segment_flac(segment)))
+
+    @property
+    def duration(self) -> float:
+        if self.segmented:
+            return sum(info["frames"] for info in self.segments) / self.audio["sr"]
+        info = sf.info(self.payload_reader())
+        return info.frames / info.samplerate
+
+    # -- neural tokens -------------------------------------------------------
+
+    @property
+    def neural_tokens(self):
+        """(codebooks, frames) array for packed tokens, an int32 array view for
+        array-shaped json ones, otherwise the decoded json list"""
+        if self.neural is None:
+            return None
+        stored = self._section("TOKN")
+        encoding = self.neural.get("encoding")
+        if encoding in PACKED_ENCODINGS:
+            return unpack_codes(stored, self.neural["bits"], self.neural["codebooks"],
+                                self.neural["frames"], encoding)
+        if encoding == "int32":
+            return np.frombuffer(stored, dtype=TOKEN_DTYPE).reshape(self.neural["shape"])
+        return json.loads(bytes(stored))
+
+    # -- back to text ----------------------------------------------------------
+
+    def iter_text(self) -> Iterator[str]:
+        """the original ChordCraft v2 code, piece by piece"""
+        head = self._section("HEAD")
+        if head is not None:
+            yield bytes(head).decode("utf-8")
+        else:
+            yield format_header(self.meta, self.chords)
+            if self.audio is not None:
+                yield _format_audio(self.audio, self.audio.get("chunks"))
+
+        if self.has_audio:
+            yield from _iter_payload_text(self.audio, self.segments, self.flac)
+
+        tail = self._section("TAIL")
+        if tail is not None:
+            yield bytes(tail).decode("utf-8")
+            return
+        if self.neural is not None:
+            yield format_neural_block(self.neural["model"], self.neural["compression_ratio"],
+                                      *_token_line(self.neural, self._section("TOKN")))
+        yield CODE_FOOTER
+
+    def to_text(self) -> str:
+        return "".join(self.iter_text())
+
+
+class _ViewReader(io.RawIOBase):
+    """read-only, seekable file object over a memoryview, without copying it"""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, min(offset, len(self._view)))
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        out = memoryview(buffer).cast("B")
+        n = min(len(out), len(self._view) - self._pos)
+        out[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+
+def main():
+    """CLI: convert between ChordCraft text codes and binary containers"""
+    if len(sys.argv) != 3:
+        print("Usage: python chordcraft_container.py <input> <output>")
+        print("  text code in -> container out, container in -> text code out")
+        sys.exit(1)
+
+    try:
+        size = convert_file(sys.argv[1], sys.argv[2])
+        print(f"Wrote {size} bytes to {sys.argv[2]} ({os.path.getsize(sys.argv[1])} bytes in)")
+    except ChordCraftDecodeError as e:
+        print(f"Error converting: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
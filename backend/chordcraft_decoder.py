@@ -0,0 +1,442 @@
+# ChordCraft v2 decoder - reads the text that audio_codec.py writes back into FLAC / PCM
+# the payload is indexed by offset in one pass and only base64-decoded when it's read,
+# so pulling a few seconds out of a long song never touches the rest of it
+
+import base64
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import soundfile as sf
+
+from neural_tokens import PACKED_ENCODINGS, unpack_codes
+
+PAYLOAD_MARKER = b"<<PAYLOAD:FLAC:"
+NEURAL_MARKER = b"<<NEURAL_TOKENS>>\n"
+BLOCK_FRAMES = 65536  # PCM frames per decoded block, same as the encoder
+
+# key: "string" or key: bare-value inside a { ... } header block
+_FIELD = re.compile(rb'(\w+):\s*(?:"([^"]*)"|([^,\s}]+))')
+
+
+class ChordCraftDecodeError(ValueError):
+    """the text isn't well-formed ChordCraft v2"""
+
+
+class ChecksumMismatch(ChordCraftDecodeError):
+    """the decoded FLAC doesn't match the sha256 in the audio header"""
+
+
+def _parse_fields(block: bytes) -> Dict:
+    fields = {}
+    for key, quoted, bare in _FIELD.findall(block):
+        if quoted or not bare:
+            value = quoted.decode("utf-8")
+        else:
+            value = bare.decode("ascii")
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+        fields[key.decode("ascii")] = value
+    return fields
+
+
+def _block(header: bytes, name: bytes) -> Optional[bytes]:
+    """contents of `name: { ... }` in the header (blocks don't nest)"""
+    start = header.find(name + b": {")
+    if start < 0:
+        return None
+    start += len(name) + 3
+    end = header.find(b"}", start)
+    if end < 0:
+        raise ChordCraftDecodeError(f"unterminated {name.decode()} block")
+    return header[start:end]
+
+
+class SegmentedAudio:
+    """PCM access shared by ChordCraftDocument and the binary container
+
+    needs `audio`, `segments` (each with start and frames, frames None for a
+    classic single-FLAC payload), payload_reader(segment) and _require_audio().
+    """
+
+    def iter_blocks(self, block_frames: int = BLOCK_FRAMES, dtype: str = "float32") -> Iterator[np.ndarray]:
+        """decoded PCM as (frames, channels) blocks, without holding the whole track"""
+        for segment in range(len(self.segments)):
+            with sf.SoundFile(self.payload_reader(segment)) as snd:
+                for block in snd.blocks(blocksize=block_frames, dtype=dtype, always_2d=True):
+                    yield block
+
+    def _read_segment(self, segment: int, first: int, last: Optional[int], dtype: str) -> np.ndarray:
+        with sf.SoundFile(self.payload_reader(segment)) as snd:
+            first = min(max(first, 0), snd.frames)
+            last = snd.frames if last is None else min(last, snd.frames)
+            snd.seek(first)
+            return snd.read(max(last - first, 0), dtype=dtype, always_2d=True)
+
+    def read(self, start: float = 0.0, end: Optional[float] = None, dtype: str = "float32") -> np.ndarray:
+        """PCM for [start, end) seconds as (frames, channels)
+
+        libFLAC seeks within the payload, so only the chunks around the
+        requested range (plus a few probed while seeking) are decoded - and in
+        a segmented code only the segments that overlap the range are touched.
+        """
+        self._require_audio()
+        sr = self.audio["sr"]
+        first = int(round(start * sr))
+        last = None if end is None else int(round(end * sr))
+        pieces = []
+        for segment, info in enumerate(self.segments):
+            if info["frames"] is not None and info["start"] + info["frames"] <= first:
+                continue
+            if last is not None and info["start"] >= last:
+                break
+            pieces.append(self._read_segment(segment, first - info["start"],
+                                             None if last is None else last - info["start"], dtype))
+        if not pieces:
+            return np.zeros((0, self.audio["channels"]), dtype=dtype)
+        return np.concatenate(pieces)
+
+    def decode(self, workers: Optional[int] = None, dtype: str = "float32") -> np.ndarray:
+        """the whole track as (frames, channels), decoding segments on a thread pool"""
+        self._require_audio()
+        with ThreadPoolExecutor(max_workers=workers or len(self.segments)) as pool:
+            pieces = list(pool.map(lambda segment: self._read_segment(segment, 0, None, dtype),
+                                   range(len(self.segments))))
+        return np.concatenate(pieces)
+
+
+class ChordCraftDocument(SegmentedAudio):
+    """
+    Parsed ChordCraft v2 code.
+
+    Only the header is parsed up front; the payload is located by offset and
+    decoded on demand. Works on str, bytes or an mmap (see open()), so a code
+    file on disk is never read into memory as a whole.
+
+    A segmented code (ChordCraftCodec(workers=...)) carries several
+    independent FLAC files back to back; `segments` lists them and the
+    FLAC-level methods take a segment index. A classic code is one segment.
+    """
+
+    def __init__(self, data):
+        if isinstance(data, str):
+            data = data.encode("ascii")
+        self._data = data
+        self._mmap = None
+        self._neural = None
+
+        first_payload = data.find(PAYLOAD_MARKER)
+        header_end = first_payload if first_payload >= 0 else data.find(NEURAL_MARKER)
+        header = bytes(data[:header_end if header_end >= 0 else len(data)])
+        if not header.lstrip().startswith(b"Song {"):
+            raise ChordCraftDecodeError("not ChordCraft code (missing 'Song {')")
+
+        self.meta = _parse_fields(_block(header, b"meta") or b"")
+        chords = re.search(rb"chords:\s*(.*)", _block(header, b"analysis") or b"")
+        self.chords = chords.group(1).decode("utf-8").strip() if chords else None
+        audio = _block(header, b"audio")
+        self.audio = _parse_fields(audio) if audio is not None else None
+
+        if self.audio is not None and self.audio.get("chunk_size", 4) % 4:
+            raise ChordCraftDecodeError("chunk_size must be a multiple of 4 for chunks to decode independently")
+        self.chunks, self.segments = self._index_payload(first_payload)
+
+        # the neural block sits after the payload, ahead of its token line
+        tail_start = self.chunks[-1][1] if self.chunks else 0
+        neural_pos = data.find(NEURAL_MARKER, tail_start)
+        tail = bytes(data[tail_start:neural_pos if neural_pos >= 0 else len(data)])
+        neural = _block(tail, b"neural")
+        self.neural = _parse_fields(neural) if neural is not None else None
+
+        if self.segmented:
+            self._check_segments(tail)
+        elif self.audio is not None and len(self.chunks) != self.audio.get("chunks"):
+            raise ChordCraftDecodeError(
+                f"audio header promises {self.audio.get('chunks')} chunks, found {len(self.chunks)}"
+            )
+
+    @classmethod
+    def open(cls, path: str) -> "ChordCraftDocument":
+        """memory-map a code file instead of reading it"""
+        with open(path, "rb") as fh:
+            mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        doc = cls(mapped)
+        doc._mmap = mapped
+        return doc
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def segmented(self) -> bool:
+        return self.audio is not None and "segment_frames" in self.audio
+
+    def _index_payload(self, pos: int) -> Tuple[List[Tuple[int, int]], List[Dict]]:
+        """(start, end) byte offsets of every base64 chunk plus the segment table, in one pass"""
+        data = self._data
+        segmented = self.segmented
+        chunks, segments = [], []
+        previous_end = 0
+        while pos >= 0:
+            label_end = data.find(b">>\n", pos)
+            if label_end < 0:
+                raise ChordCraftDecodeError(f"unterminated payload marker at offset {pos}")
+            label = bytes(data[pos + len(PAYLOAD_MARKER):label_end])
+            try:
+                segment, index = map(int, label.split(b".")) if segmented else (1, int(label))
+            except ValueError:
+                raise ChordCraftDecodeError(f"bad payload marker {label!r}")
+
+            if segment == len(segments) + 1 and index == 1:
+                info = {"index": segment, "first_chunk": len(chunks), "chunks": 0}
+                if segmented:
+                    header = _block(bytes(data[previous_end:pos]), b"segment")
+                    if header is None:
+                        raise ChordCraftDecodeError(f"segment {segment} has no segment header")
+                    fields = _parse_fields(header)
+                    info.update(fields, index=segment, chunks=0, expected_chunks=fields.get("chunks"))
+                segments.append(info)
+            elif segment != len(segments) or index != segments[-1]["chunks"] + 1:
+                raise ChordCraftDecodeError(f"payload chunk {label.decode()} out of order")
+
+            start = label_end + 3
+            end = data.find(b"\n", start)
+            end = len(data) if end < 0 else end
+            chunks.append((start, end))
+            segments[-1]["chunks"] = index
+            previous_end = end
+            pos = data.find(PAYLOAD_MARKER, end)
+
+        if not segmented and segments:
+            segments[0].update(start=0, frames=None, sha256=self.audio.get("sha256") if self.audio else None)
+        return chunks, segments
+
+    def _check_segments(self, tail: bytes):
+        """every segment complete and contiguous, and nothing cut off after the last one"""
+        frames = 0
+        for info in self.segments:
+            if info["chunks"] != info["expected_chunks"]:
+                raise ChordCraftDecodeError(
+                    f"segment {info['index']} promises {info['expected_chunks']} chunks, found {info['chunks']}"
+                )
+            if info["start"] != frames:
+                raise ChordCraftDecodeError(f"segment {info['index']} starts at frame {info['start']}, expected {frames}")
+            frames += info["frames"]
+        end = _block(tail, b"audio_end")
+        if end is None:
+            raise ChordCraftDecodeError("segmented payload is truncated (no audio_end)")
+        end = _parse_fields(end)
+        if end.get("segments") != len(self.segments) or end.get("frames") != frames:
+            raise ChordCraftDecodeError(
+                f"audio_end promises {end.get('segments')} segments / {end.get('frames')} frames, "
+                f"found {len(self.segments)} / {frames}"
+            )
+
+    # -- FLAC payload ---------------------------------------------------------
+
+    @property
+    def has_audio(self) -> bool:
+        return bool(self.chunks)
+
+    def _require_audio(self):
+        if not self.chunks:
+            raise ChordCraftDecodeError("code has no lossless audio payload")
+
+    def decode_chunk(self, index: int) -> bytes:
+        """raw FLAC bytes of one payload chunk (0-based)"""
+        start, end = self.chunks[index]
+        try:
+            return base64.b64decode(self._data[start:end], validate=True)
+        except ValueError as e:
+            raise ChordCraftDecodeError(f"payload chunk {index + 1} is not valid base64: {e}")
+
+    def _segment(self, segment: int) -> Dict:
+        self._require_audio()
+        try:
+            return self.segments[segment]
+        except IndexError:
+            raise ChordCraftDecodeError(f"code has {len(self.segments)} segments, no segment {segment}")
+
+    def iter_flac(self, verify: bool = True, segment: int = 0) -> Iterator[bytes]:
+        """stream one segment's FLAC file chunk by chunk, checking the sha256 as it goes
+
+        with verify on, ChecksumMismatch is raised after the last chunk if the
+        hash doesn't match, so consumers should treat the stream as tentative
+        until the iterator is exhausted.
+        """
+        info = self._segment(segment)
+        sha = hashlib.sha256() if verify else None
+        for index in range(info["first_chunk"], info["first_chunk"] + info["chunks"]):
+            piece = self.decode_chunk(index)
+            if sha is not None:
+                sha.update(piece)
+            yield piece
+        if sha is not None and sha.hexdigest() != info["sha256"]:
+            raise ChecksumMismatch(f"segment {info['index']}: sha256 {sha.hexdigest()} != {info['sha256']}")
+
+    def flac_bytes(self, verify: bool = True, segment: int = 0) -> bytes:
+        return b"".join(self.iter_flac(verify=verify, segment=segment))
+
+    def write_flac(self, sink, verify: bool = True, segment: int = 0) -> int:
+        """copy one segment's FLAC file into a binary sink; returns bytes written"""
+        written = 0
+        for piece in self.iter_flac(verify=verify, segment=segment):
+            sink.write(piece)
+            written += len(piece)
+        return written
+
+    def verify(self) -> bool:
+        """check the sha256 of every segment"""
+        try:
+            for segment in range(len(self.segments)):
+                for _ in self.iter_flac(verify=True, segment=segment):
+                    pass
+        except ChecksumMismatch:
+            return False
+        return True
+
+    def payload_reader(self, segment: int = 0) -> "PayloadReader":
+        """seekable file object over one segment's FLAC bytes that decodes chunks lazily"""
+        self._segment(segment)
+        return PayloadReader(self, segment=segment)
+
+    @property
+    def duration(self) -> float:
+        if self.segmented:
+            return sum(info["frames"] for info in self.segments) / self.audio["sr"]
+        info = sf.info(self.payload_reader())
+        return info.frames / info.samplerate
+
+    # -- neural tokens ----------------------------------------------------------
+
+    @property
+    def neural_tokens(self):
+        """(codebooks, frames) int64 array for packed tokens, otherwise the JSON list"""
+        if self._neural is None:
+            pos = self._data.find(NEURAL_MARKER)
+            if pos < 0:
+                return None
+            start = pos + len(NEURAL_MARKER)
+            end = self._data.find(b"\n", start)
+            line = self._data[start:end if end >= 0 else len(self._data)]
+            neural = self.neural or {}
+            if neural.get("encoding") in PACKED_ENCODINGS:
+                try:
+                    self._neural = unpack_codes(base64.b64decode(line, validate=True), neural["bits"],
+                                                neural["codebooks"], neural["frames"], neural["encoding"])
+                except (ValueError, KeyError) as e:
+                    raise ChordCraftDecodeError(f"bad packed neural tokens: {e}") from e
+            else:
+                self._neural = json.loads(line)
+        return self._neural
+
+
+class PayloadReader(io.RawIOBase):
+    """read-only, seekable view of one segment's FLAC bytes
+
+    every chunk but the last holds exactly chunk_size * 3 / 4 raw bytes (the
+    encoder keeps chunks 4-aligned), so any byte offset maps straight to a
+    chunk. A few decoded chunks are kept around for libFLAC's back-and-forth.
+    """
+
+    def __init__(self, doc: ChordCraftDocument, cache_chunks: int = 4, segment: int = 0):
+        self._doc = doc
+        info = doc.segments[segment]
+        self._first = info["first_chunk"]
+        self._per_chunk = doc.audio["chunk_size"] * 3 // 4
+        last = doc.chunks[self._first + info["chunks"] - 1]
+        tail = len(base64.b64decode(doc._data[last[0]:last[1]][-4:])) if last[1] > last[0] else 0
+        self._size = self._per_chunk * (info["chunks"] - 1) + (last[1] - last[0] - 4) * 3 // 4 + tail
+        self._pos = 0
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._cache_chunks = cache_chunks
+        self.decoded_chunks = 0  # how many base64 chunks were decoded, for diagnostics
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+        return self._pos
+
+    def _chunk(self, index: int) -> bytes:
+        data = self._cache.get(index)
+        if data is None:
+            data = self._doc.decode_chunk(self._first + index)
+            self.decoded_chunks += 1
+            self._cache[index] = data
+            if len(self._cache) > self._cache_chunks:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(index)
+        return data
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        filled = 0
+        while filled < len(view) and self._pos < self._size:
+            index, offset = divmod(self._pos, self._per_chunk)
+            data = self._chunk(index)
+            n = min(len(data) - offset, len(view) - filled)
+            view[filled:filled + n] = data[offset:offset + n]
+            filled += n
+            self._pos += n
+        return filled
+
+
+def main():
+    """CLI: extract the FLAC payload from a ChordCraft code file"""
+    if len(sys.argv) < 3:
+        print("Usage: python chordcraft_decoder.py <code_file> <output.flac> [--no-verify]")
+        print("  a segmented code is joined into one FLAC (re-encoded from the decoded PCM)")
+        sys.exit(1)
+
+    try:
+        with ChordCraftDocument.open(sys.argv[1]) as doc:
+            if doc.segmented:
+                if "--no-verify" not in sys.argv and not doc.verify():
+                    raise ChecksumMismatch("a segment doesn't match its sha256")
+                sf.write(sys.argv[2], doc.decode(dtype="int16"), doc.audio["sr"], format="FLAC", subtype="PCM_16")
+                size = os.path.getsize(sys.argv[2])
+            else:
+                with open(sys.argv[2], "wb") as out:
+                    size = doc.write_flac(out, verify="--no-verify" not in sys.argv)
+        print(f"Wrote {size} bytes of FLAC to {sys.argv[2]}")
+    except ChordCraftDecodeError as e:
+        print(f"Error decoding code: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# gunicorn settings for the ChordCraft backend - gunicorn reads this file
+# automatically when started from backend/ (gunicorn app:app ...)
+#
+# the app is imported and warmed up once in the master, then forked: workers
+# start with librosa's JIT-compiled code and the analyzer's caches already in
+# memory, shared copy-on-write instead of each worker paying the first-request
+# spike itself. CHORDCRAFT_PRELOAD=0 goes back to importing (and warming) in
+# every worker. That's the default for gevent / eventlet workers: they have to
+# monkey-patch before the app is imported, which a preloading master can't do.
+
+import os
+import shlex
+import sys
+
+# gunicorn applies -k after reading this file, so look at the command line ourselves
+PATCHING_WORKERS = ("gevent", "eventlet")
+
+
+def _worker_class(argv):
+    for i, arg in enumerate(argv):
+        if arg in ("-k", "--worker-class") and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith("--worker-class="):
+            return arg.split("=", 1)[1]
+        if arg.startswith("-k") and len(arg) > 2:
+            return arg[2:]
+    return ""
+
+
+_worker = _worker_class(shlex.split(os.environ.get("GUNICORN_CMD_ARGS", "")) + sys.argv[1:])
+_patching = any(name in _worker for name in PATCHING_WORKERS)
+preload_app = os.environ.get("CHORDCRAFT_PRELOAD", "0" if _patching else "1") != "0"
+
+
+def when_ready(server):
+    """master, after preloading the app and before the first fork"""
+    if not server.cfg.preload_app:
+        return
+    from app import warm_up
+    from warmup import freeze_for_fork
+
+    warm_up()
+    freeze_for_fork()
+
+
+def post_worker_init(worker):
+    """each worker, when the app wasn't preloaded in the master"""
+    if worker.cfg.preload_app:
+        return
+    from app import warm_up
+
+    warm_up()
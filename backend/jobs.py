@@ -0,0 +1,404 @@
+"""
+Background job queue for ChordCraft
+Runs long codec/analysis work on a bounded process pool so /analyze can hand
+back a job id straight away and clients poll GET /jobs/<id> for the result
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+
+_JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class QueueFullError(Exception):
+    """raised when the queue is already holding max_queue_depth unfinished jobs"""
+
+
+class JobTimeoutError(BaseException):
+    """raised inside a worker when its job runs past the per-job timeout
+
+    a BaseException, like KeyboardInterrupt, so the analyzer's `except Exception`
+    fallbacks can't swallow it and carry on with default values
+    """
+
+
+# ---------------------------------------------------------------------------
+# worker side - everything here runs inside the pool processes
+
+_progress_queue = None
+_codec_cache: Dict = {}
+_analyzer_cache: Dict = {}
+
+
+def _init_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+    # the parent owns Ctrl+C handling, workers just get torn down with the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def report_progress(job_id: str, progress: float, stage: str = ""):
+    """post a progress update from inside a worker (no-op outside the pool)"""
+    if _progress_queue is not None:
+        _progress_queue.put((job_id, progress, stage))
+
+
+def _on_alarm(signum, frame):
+    raise JobTimeoutError("job exceeded its time limit")
+
+
+def _run(job_id: str, timeout: Optional[float], fn: Callable, args: tuple, kwargs: dict):
+    """wrapper every job goes through: marks it running and enforces the timeout"""
+    report_progress(job_id, 0.0, RUNNING)
+    use_alarm = timeout and hasattr(signal, "setitimer")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(job_id, *args, **kwargs)
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def encode_job(job_id: str, data: bytes, codec_settings: Dict, options: Dict) -> str:
+    """ChordCraft code for an uploaded file (runs in a worker)"""
+    from audio_codec import ChordCraftCodec
+
+    settings_key = tuple(sorted(codec_settings.items()))
+    codec = _codec_cache.get(settings_key)
+    if codec is None:
+        codec = _codec_cache[settings_key] = ChordCraftCodec(**codec_settings)
+
+    report_progress(job_id, 0.1, "encoding")
+    return codec.create_chordcraft_code(audio_path=io.BytesIO(data), **options)
+
+
+def analyze_job(job_id: str, data: bytes, analyzer_settings: Optional[Dict] = None) -> Dict:
+    """MuzicEnhancedAnalyzer results for an uploaded file (runs in a worker)"""
+    from muzic_integration import MuzicEnhancedAnalyzer
+
+    analyzer_settings = analyzer_settings or {}
+    settings_key = tuple(sorted(analyzer_settings.items()))
+    analyzer = _analyzer_cache.get(settings_key)
+    if analyzer is None:
+        analyzer = _analyzer_cache[settings_key] = MuzicEnhancedAnalyzer(**analyzer_settings)
+
+    report_progress(job_id, 0.1, "analyzing")
+    results = analyzer.analyze_audio_enhanced(io.BytesIO(data))
+    if results.get("analysis_type") == "muzic_error":
+        raise RuntimeError(results.get("error", "analysis failed"))
+    return results
+
+
+# ---------------------------------------------------------------------------
+# parent side
+
+class Job:
+    def __init__(self, job_id: str, kind: str):
+        self.id = job_id
+        self.kind = kind
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED, TIMEOUT)
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        info = {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": round(self.progress, 3),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            info["error"] = self.error
+        if include_result and self.status == DONE:
+            info["result"] = self.result
+        return info
+
+    @classmethod
+    def from_dict(cls, info: Dict) -> "Job":
+        job = cls(info["job_id"], info["kind"])
+        for field in ("status", "stage", "progress", "created_at", "started_at", "finished_at"):
+            setattr(job, field, info[field])
+        job.error = info.get("error")
+        job.result = info.get("result")
+        return job
+
+
+class JobQueue:
+    """bounded ProcessPoolExecutor plus the bookkeeping behind GET /jobs/<id>
+
+    the pool is started lazily on the first submit so importing the app (and
+    forking gunicorn workers) stays cheap.
+
+    with state_dir, every job's state is also kept as <state_dir>/<id>.json, so
+    any process sharing the directory (all gunicorn workers on the box) can
+    answer GET /jobs/<id>, and finished jobs outlive the worker that ran them.
+    A job whose owning process is gone before it finished reads as failed.
+    """
+
+    # how often (seconds) expired state files are swept from state_dir
+    DISK_PURGE_INTERVAL = 60.0
+
+    def __init__(self, max_workers: Optional[int] = None, max_queue_depth: int = 16,
+                 job_timeout: Optional[float] = 600.0, result_ttl: float = 3600.0,
+                 state_dir: Optional[str] = None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue_depth = max_queue_depth
+        self.job_timeout = job_timeout
+        self.result_ttl = result_ttl
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        self._last_disk_purge = 0.0
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress_queue = None
+        self._listener = None
+
+    def _ensure_pool(self):
+        if self._executor is not None:
+            return
+        ctx = multiprocessing.get_context("spawn")  # don't fork the web worker's threads/sockets
+        if self._progress_queue is None:
+            self._progress_queue = ctx.Queue()
+            self._listener = threading.Thread(target=self._listen, name="job-progress", daemon=True)
+            self._listener.start()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=ctx,
+            initializer=_init_worker, initargs=(self._progress_queue,)
+        )
+
+    def _listen(self):
+        while True:
+            try:
+                item = self._progress_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                return  # queue closed on shutdown
+            if item is None:
+                return
+            job_id, progress, stage = item
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished:
+                    continue
+                if job.status == QUEUED:
+                    job.status = RUNNING
+                    job.started_at = time.time()
+                job.progress = max(job.progress, progress)
+                job.stage = stage
+                self._save(job)
+
+    def submit(self, kind: str, fn: Callable, *args,
+               on_result: Optional[Callable] = None, **kwargs) -> Job:
+        """queue fn(job_id, *args, **kwargs) on the pool; fn must be a module-level function"""
+        with self._lock:
+            self._purge()
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_queue_depth:
+                raise QueueFullError(f"{pending} jobs already pending (limit {self.max_queue_depth})")
+            self._ensure_pool()
+            executor = self._executor
+            job = Job(uuid.uuid4().hex, kind)
+            self._jobs[job.id] = job
+            self._save(job)
+
+        future = executor.submit(_run, job.id, self.job_timeout, fn, args, kwargs)
+        future.add_done_callback(lambda fut: self._finish(job, fut, on_result, executor))
+        return job
+
+    def completed(self, kind: str, result) -> Job:
+        """register an already-finished job, e.g. for a result cache hit"""
+        job = Job(uuid.uuid4().hex, kind)
+        job.status = job.stage = DONE
+        job.progress = 1.0
+        job.result = result
+        job.started_at = job.finished_at = job.created_at
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = job
+            self._save(job)
+        return job
+
+    def _finish(self, job: Job, future, on_result: Optional[Callable], executor=None):
+        try:
+            result = future.result()
+        except JobTimeoutError:
+            status, error, result = TIMEOUT, f"job exceeded {self.job_timeout}s", None
+        except BrokenProcessPool as e:
+            # a worker died (OOM kill, segfault in a native lib) - start a fresh pool next time
+            logger.error(f"Job {job.id} ({job.kind}) lost its worker: {e}")
+            status, error, result = FAILED, "worker_crashed", None
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed")
+            status, error, result = FAILED, str(e), None
+        else:
+            status, error = DONE, None
+
+        with self._lock:
+            job.status = job.stage = status
+            job.error = error
+            job.result = result
+            job.finished_at = time.time()
+            if job.started_at is None:
+                job.started_at = job.finished_at
+            if status == DONE:
+                job.progress = 1.0
+            self._save(job)
+
+        if status == DONE and on_result is not None:
+            try:
+                on_result(result)
+            except Exception:
+                logger.exception(f"Job {job.id} result callback failed")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._purge()
+            job = self._jobs.get(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def _purge(self):
+        # caller holds the lock
+        now = time.time()
+        cutoff = now - self.result_ttl
+        expired = [jid for jid, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for jid in expired:
+            del self._jobs[jid]
+            self._remove_state(jid)
+
+        if self.state_dir and now - self._last_disk_purge >= self.DISK_PURGE_INTERVAL:
+            # other processes' jobs expire too - state files untouched for a TTL are done with
+            self._last_disk_purge = now
+            for name in os.listdir(self.state_dir):
+                path = os.path.join(self.state_dir, name)
+                try:
+                    if name.endswith(".json") and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+    # -- shared state on disk --------------------------------------------------
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, job_id + ".json")
+
+    def _save(self, job: Job):
+        """write the job's state for other processes (caller holds the lock)"""
+        if not self.state_dir:
+            return
+        path = self._state_path(job.id)
+        tmp = f"{path}.{os.getpid()}.part"
+        try:
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump({**job.to_dict(), "owner": os.getpid()}, fh)
+            os.replace(tmp, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning(f"Could not save state of job {job.id}: {e}")
+
+    def _remove_state(self, job_id: str):
+        if self.state_dir:
+            try:
+                os.remove(self._state_path(job_id))
+            except OSError:
+                pass
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        """a job owned by another process, from its state file"""
+        if not self.state_dir or not _JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._state_path(job_id), encoding="utf-8") as fh:
+                info = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        job = Job.from_dict(info)
+        if job.finished and job.finished_at < time.time() - self.result_ttl:
+            self._remove_state(job_id)
+            return None
+        if not job.finished and not _process_alive(info.get("owner")):
+            # the worker that ran it was recycled or crashed mid-job
+            job.status = job.stage = FAILED
+            job.error = "worker_lost"
+        return job
+
+    def stats(self) -> Dict:
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0, TIMEOUT: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return {
+            "workers": self.max_workers,
+            "max_queue_depth": self.max_queue_depth,
+            "job_timeout": self.job_timeout,
+            "started": self._executor is not None,
+            **counts,
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for job in self._jobs.values():
+                if not job.finished:
+                    # gone with this process - tell anyone polling from another worker
+                    job.status = job.stage = FAILED
+                    job.error = "worker_restarted"
+                    job.finished_at = time.time()
+                    self._save(job)
+        if self._progress_queue is not None:
+            self._progress_queue.put(None)
+            self._progress_queue = None
+
+
+def _process_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, just not ours
+    return True
@@ -0,0 +1,55 @@
+# lazy imports for optional and heavy dependencies
+# torch/transformers, music21, pretty_midi, sklearn and scipy.signal each cost
+# anywhere from a few hundred ms to seconds to import, and most requests never
+# touch them. available() asks the import system whether a package is installed
+# without running it, and LazyModule defers the real import to first use, so
+# importing app stays cheap however much is installed.
+
+import importlib
+import importlib.util
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def available(*names: str) -> bool:
+    """whether every module in names is installed - found via find_spec, nothing is imported
+
+    use top-level names: find_spec imports the parents of a dotted name.
+    """
+    for name in names:
+        try:
+            if importlib.util.find_spec(name) is None:
+                return False
+        except (ImportError, ValueError):
+            return False
+    return True
+
+
+class LazyModule:
+    """stands in for a module and imports it on first attribute access
+
+    `torch = LazyModule("torch")` then `torch.inference_mode()` works as usual;
+    a missing or broken install raises its ImportError at that first use.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # import_module holds the per-module import lock, so threads racing
+            # here all end up with the same module
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
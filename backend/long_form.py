@@ -0,0 +1,319 @@
+"""
+Windowed long-form analysis for ChordCraft
+Analyses hour-long recordings in overlapping windows so memory is bounded by
+the window size, stitches the per-window results back together and can pick
+up where it left off after a crash
+"""
+
+import json
+import logging
+import os
+
+import librosa
+import numpy as np
+
+from muzic_integration import AnalysisFeatures
+
+logger = logging.getLogger(__name__)
+
+# stages run on every window - structure needs the whole recording and runs
+# once at the end on the stitched beat-synchronous chroma
+WINDOW_STAGES = ('tempo_analysis', 'pitch_analysis', 'rhythm_analysis', 'harmonic_analysis')
+
+CHECKPOINT_VERSION = 1
+
+
+def _weighted_median(values, weights):
+    order = np.argsort(values)
+    values, weights = np.asarray(values)[order], np.asarray(weights)[order]
+    cumulative = np.cumsum(weights)
+    return float(values[np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+
+def _source_fingerprint(source):
+    """something that changes when the input does - paths by size/mtime, streams by content"""
+    if isinstance(source, (str, os.PathLike)):
+        st = os.stat(source)
+        return [os.path.abspath(source), st.st_size, int(st.st_mtime)]
+
+    from audio_codec import _as_stream
+    from result_cache import hash_stream
+    return hash_stream(_as_stream(source))
+
+
+class LongFormAnalysis:
+    """
+    Overlapping-window analysis of a single recording.
+
+    Windows are window_seconds long and start every window_seconds -
+    overlap_seconds. Each window owns the span between the midpoints of its
+    overlaps with its neighbours; onsets, beats, chords and notes are kept
+    from the window that owns them, so every event is reported exactly once
+    and always with some context on both sides.
+
+    Iterating yields each window's partial results as soon as it is done.
+    With checkpoint_path set, every finished window is appended to a JSON
+    lines file and a rerun with the same input and settings skips straight
+    past the windows that are already in it.
+    """
+
+    def __init__(self, analyzer, audio_path, window_seconds=30.0, overlap_seconds=5.0,
+                 checkpoint_path=None):
+        if overlap_seconds < 0 or window_seconds <= overlap_seconds:
+            raise ValueError("window_seconds must be longer than overlap_seconds (and overlap non-negative)")
+
+        self.analyzer = analyzer
+        self.audio_path = audio_path
+        self.sr = analyzer.sample_rate
+        self.hop_length = analyzer.hop_length
+
+        # keep window starts on the analysis frame grid so frame indices stitch exactly
+        hop = self.hop_length
+        self.overlap_samples = int(round(overlap_seconds * self.sr / hop)) * hop
+        self.hop_samples = max(int(round((window_seconds - overlap_seconds) * self.sr / hop)), 1) * hop
+        self.window_samples = self.hop_samples + self.overlap_samples
+
+        self.checkpoint_path = checkpoint_path
+        self.windows = []  # per-window state, in order
+        self._done = False
+
+    # -- input --------------------------------------------------------------
+
+    def _iter_windows(self):
+        """yield (start_sample, samples, is_last) without holding more than one window of audio"""
+        from audio_codec import ChordCraftCodec
+
+        codec = ChordCraftCodec(target_sr=self.sr, stereo=False)
+        blocks = codec.iter_pcm_blocks(self.audio_path)
+        buf = np.zeros(0, dtype=np.float32)
+        start = 0
+        eof = False
+        while True:
+            # read until we know whether anything follows the current window
+            while not eof and len(buf) <= self.window_samples:
+                block = next(blocks, None)
+                if block is None:
+                    eof = True
+                else:
+                    buf = np.concatenate([buf, block[:, 0]])
+
+            if len(buf) <= self.window_samples:
+                if start == 0 and not len(buf):
+                    raise ValueError("audio contains no samples")
+                yield start, buf, True
+                return
+
+            yield start, buf[:self.window_samples], False
+            buf = buf[self.hop_samples:]
+            start += self.hop_samples
+
+    # -- checkpoint ----------------------------------------------------------
+
+    def _checkpoint_params(self):
+        return {
+            "version": CHECKPOINT_VERSION,
+            "source": _source_fingerprint(self.audio_path),
+            "sample_rate": self.sr,
+            "hop_length": self.hop_length,
+            "frame_size": self.analyzer.frame_size,
+            "window_samples": self.window_samples,
+            "hop_samples": self.hop_samples,
+            **self.analyzer._stage_settings(),
+        }
+
+    def _load_checkpoint(self, params):
+        """windows already finished by an earlier run with the same settings"""
+        windows = []
+        valid_bytes = 0
+        try:
+            with open(self.checkpoint_path, "rb") as fh:
+                header = json.loads(fh.readline())
+                if header.get("params") != params:
+                    logger.info("Long-form checkpoint is for different input/settings, starting over")
+                    return None
+                valid_bytes = fh.tell()
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn write from a crash - redo that window
+                    if record.get("index") != len(windows):
+                        break
+                    windows.append(record)
+                    valid_bytes += len(line)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # drop anything after the last good record so new windows append cleanly
+        with open(self.checkpoint_path, "r+b") as fh:
+            fh.truncate(valid_bytes)
+        return windows
+
+    def _open_checkpoint(self):
+        if not self.checkpoint_path:
+            return None
+        params = self._checkpoint_params()
+        resumed = self._load_checkpoint(params)
+        if resumed is None:
+            fh = open(self.checkpoint_path, "w", encoding="utf-8")
+            fh.write(json.dumps({"params": params}) + "\n")
+            fh.flush()
+            return fh
+        self.windows = resumed
+        if resumed:
+            logger.info(f"Resuming long-form analysis after {len(resumed)} windows")
+        return open(self.checkpoint_path, "a", encoding="utf-8")
+
+    # -- per window ----------------------------------------------------------
+
+    def _analyze_window(self, index, start, samples, is_last):
+        analyzer = self.analyzer
+        features = AnalysisFeatures(samples, self.sr, hop_length=self.hop_length, n_fft=analyzer.frame_size)
+        results = analyzer._run_stages(features, WINDOW_STAGES)
+
+        offset = start / self.sr
+        half_overlap = self.overlap_samples / 2 / self.sr
+        own_from = offset + half_overlap if index else 0.0
+        own_to = np.inf if is_last else offset + len(samples) / self.sr - half_overlap
+
+        def owned(times):
+            times = np.asarray(times, dtype=float) + offset
+            return (times >= own_from) & (times < own_to)
+
+        # notes - extracted against this window's own chord/beat grid, then shifted
+        events = analyzer._extract_note_events(results)
+        events = events[owned(events['time'])]
+
+        onsets = np.asarray(results['pitch_analysis']['onset_times'], dtype=float)
+        beats = librosa.frames_to_time(features.beat_frames, sr=self.sr, hop_length=self.hop_length)
+        chord_times = np.asarray(results['harmonic_analysis']['chord_times'], dtype=float)
+        keep_chords = owned(chord_times)
+
+        # beat-synchronous chroma for the structure stage, as global frame indices
+        frame_offset = start // self.hop_length
+        segment_frames = features.beat_boundaries[:-1][keep_chords] + frame_offset
+        segment_chroma = features.beat_chroma[:, keep_chords]
+
+        # harmonic chroma over the owned span, for the global key/pitch-class profile
+        chroma = features.harmonic_chroma
+        frame_times = librosa.frames_to_time(np.arange(chroma.shape[1]), sr=self.sr,
+                                             hop_length=self.hop_length)
+        owned_chroma = chroma[:, owned(frame_times)]
+
+        rhythm = results['rhythm_analysis']
+        owned_seconds = min(own_to, offset + len(samples) / self.sr) - own_from
+        return {
+            "index": index,
+            "start": offset,
+            "end": offset + len(samples) / self.sr,
+            "owned": [own_from, own_from + owned_seconds],
+            "code_lines": analyzer._format_note_events(events, time_offset=offset),
+            "onset_times": (onsets[owned(onsets)] + offset).tolist(),
+            "beats": (beats[owned(beats)] + offset).tolist(),
+            "chords": np.asarray(results['harmonic_analysis']['chord_progressions'])[keep_chords].tolist(),
+            "chord_times": (chord_times[keep_chords] + offset).tolist(),
+            "segment_frames": segment_frames.tolist(),
+            "segment_chroma": segment_chroma.T.tolist(),
+            "end_frame": int(frame_offset + chroma.shape[1]),
+            "chroma_sum": owned_chroma.sum(axis=1).tolist(),
+            "chroma_frames": int(owned_chroma.shape[1]),
+            "bpm": results['tempo_analysis']['bpm'] if len(beats) else None,
+            "owned_seconds": owned_seconds,
+            "rhythm_complexity": rhythm['complexity'],
+            "rhythm_patterns": rhythm['patterns'],
+        }
+
+    def __iter__(self):
+        if self._done:
+            yield from self.windows
+            return
+
+        checkpoint = self._open_checkpoint()
+        try:
+            resumed = len(self.windows)
+            for index, (start, samples, is_last) in enumerate(self._iter_windows()):
+                if index < resumed:
+                    yield self.windows[index]
+                    continue
+                window = self._analyze_window(index, start, samples, is_last)
+                self.windows.append(window)
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(window) + "\n")
+                    checkpoint.flush()
+                    os.fsync(checkpoint.fileno())
+                yield window
+            self._done = True
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+
+    # -- stitching ------------------------------------------------------------
+
+    def result(self):
+        """stitched analysis of the whole recording (runs any windows not processed yet)"""
+        if not self._done:
+            for _ in self:
+                pass
+
+        analyzer = self.analyzer
+        windows = self.windows
+
+        beats = np.array([t for w in windows for t in w["beats"]])
+        tempos = [(w["bpm"], w["owned_seconds"]) for w in windows if w["bpm"] is not None]
+        bpm = _weighted_median(*zip(*tempos)) if tempos else 120.0
+
+        frames = sum(w["chroma_frames"] for w in windows)
+        mean_chroma = np.sum([w["chroma_sum"] for w in windows], axis=0) / max(frames, 1)
+
+        weights = np.array([w["owned_seconds"] for w in windows])
+        complexity = float(np.average([w["rhythm_complexity"] for w in windows], weights=weights))
+        pattern_strength = {}
+        for w, weight in zip(windows, weights):
+            for pattern in w["rhythm_patterns"]:
+                pattern_strength[pattern['tempo_bin']] = pattern_strength.get(pattern['tempo_bin'], 0.0) + \
+                    pattern['strength'] * weight
+        patterns = [{'tempo_bin': tempo_bin, 'strength': strength / weights.sum()}
+                    for tempo_bin, strength in sorted(pattern_strength.items())]
+
+        # structure once over the stitched beat grid - at ~2 beats/s this is
+        # tiny even for multi-hour recordings
+        segment_frames = [f for w in windows for f in w["segment_frames"]]
+        segment_chroma = [c for w in windows for c in w["segment_chroma"]]
+        structure_features = AnalysisFeatures(np.zeros(0, dtype=np.float32), self.sr, hop_length=self.hop_length)
+        structure_features.__dict__.update(
+            beat_chroma=np.array(segment_chroma, dtype=float).reshape(-1, 12).T,
+            beat_boundaries=np.array(segment_frames + [windows[-1]["end_frame"]], dtype=int),
+        )
+
+        analysis_results = {
+            'tempo_analysis': {
+                'bpm': max(60, min(200, round(bpm))),
+                'beats': beats.tolist(),
+                'stability': float(np.std([t for t, _ in tempos])) if tempos else 0.0,
+                'time_signature': analyzer._estimate_time_signature(beats),
+            },
+            'pitch_analysis': {
+                'onset_times': [t for w in windows for t in w["onset_times"]],
+                'pitch_classes': analyzer._extract_pitch_classes(mean_chroma[:, np.newaxis]),
+            },
+            'rhythm_analysis': {
+                'complexity': complexity,
+                'patterns': patterns,
+            },
+            'harmonic_analysis': {
+                'key': analyzer._estimate_key(mean_chroma),
+                'chord_progressions': [c for w in windows for c in w["chords"]],
+                'chord_times': [t for w in windows for t in w["chord_times"]],
+            },
+            'structure_analysis': analyzer._analyze_structure(structure_features),
+        }
+
+        code_lines = analyzer._code_header(analysis_results)
+        code_lines.extend(line for w in windows for line in w["code_lines"])
+        results = analyzer._build_results(analysis_results, "\n".join(code_lines))
+        results["long_form"] = {
+            "windows": len(windows),
+            "window_seconds": self.window_samples / self.sr,
+            "overlap_seconds": self.overlap_samples / self.sr,
+        }
+        return results
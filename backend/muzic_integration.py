@@ -5,133 +5,542 @@ Integrates Microsoft's Muzic AI music understanding capabilities
 
 import os
 import numpy as np
+
+import analysis_cache
+analysis_cache.configure()  # has to happen before librosa loads anything
 import librosa
 import json
 import logging
+import multiprocessing
+import pickle
+import scipy.sparse
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import cached_property
+from multiprocessing import shared_memory
 
-# Optional imports with fallbacks
-try:
-    import pretty_midi
-    PRETTY_MIDI_AVAILABLE = True
-except ImportError:
-    PRETTY_MIDI_AVAILABLE = False
-    pretty_midi = None
-
-try:
-    from music21 import stream, note, chord, meter, tempo, key
-    MUSIC21_AVAILABLE = True
-except ImportError:
-    MUSIC21_AVAILABLE = False
-
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModel
-    TORCH_AVAILABLE = True
-except ImportError:
-    TORCH_AVAILABLE = False
-    torch = None
-
-try:
-    from sklearn.preprocessing import StandardScaler
-    from sklearn.svm import SVC
-    from sklearn.ensemble import RandomForestClassifier
-    import pickle
-    SKLEARN_AVAILABLE = True
-    logger.info("PASS Scikit-learn available for timbre analysis")
-except ImportError:
-    SKLEARN_AVAILABLE = False
-    logger.warning("WARN Scikit-learn not available. Timbre analysis will be limited.")
+from lazy_imports import LazyModule, available
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Optional dependencies - probed without importing them (see lazy_imports.py);
+# each one is only imported the first time something actually uses it
+PRETTY_MIDI_AVAILABLE = available("pretty_midi")
+pretty_midi = LazyModule("pretty_midi") if PRETTY_MIDI_AVAILABLE else None
+
+MUSIC21_AVAILABLE = available("music21")
+
+TORCH_AVAILABLE = available("torch", "transformers")
+torch = LazyModule("torch") if TORCH_AVAILABLE else None
+
+# the timbre classifier is a pickled sklearn model, unpickling imports sklearn
+SKLEARN_AVAILABLE = available("sklearn")
+if SKLEARN_AVAILABLE:
+    logger.info("PASS Scikit-learn available for timbre analysis")
+else:
+    logger.warning("WARN Scikit-learn not available. Timbre analysis will be limited.")
+
+class AnalysisFeatures:
+    """
+    Per-track feature context shared by the analyzer stages.
+
+    Every spectral representation is computed lazily on first access and
+    memoized, so the STFT, CQT, chroma and onset envelopes are each computed
+    at most once per analysis no matter how many stages read them.
+    """
+
+    def __init__(self, y, sr, hop_length=512, n_fft=2048, hpss_margin=(1.0, 5.0)):
+        self.y = y
+        self.sr = sr
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.hpss_margin = hpss_margin
+
+    @cached_property
+    def stft(self):
+        """Complex STFT of the full mix"""
+        return librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.hop_length)
+
+    @cached_property
+    def _hpss_stft(self):
+        # same decomposition librosa.effects.hpss does, but we keep the spectra
+        return librosa.decompose.hpss(self.stft, margin=self.hpss_margin)
+
+    @cached_property
+    def y_harmonic(self):
+        return librosa.istft(self._hpss_stft[0], n_fft=self.n_fft, hop_length=self.hop_length,
+                             dtype=self.y.dtype, length=len(self.y))
+
+    @cached_property
+    def y_percussive(self):
+        return librosa.istft(self._hpss_stft[1], n_fft=self.n_fft, hop_length=self.hop_length,
+                             dtype=self.y.dtype, length=len(self.y))
+
+    @cached_property
+    def harmonic_magnitude(self):
+        """Magnitude spectrogram of the harmonic component (straight from HPSS)"""
+        return np.abs(self._hpss_stft[0])
+
+    @cached_property
+    def harmonic_cqt(self):
+        """Constant-Q magnitude of the harmonic component, laid out for chroma_cqt"""
+        return np.abs(librosa.cqt(self.y_harmonic, sr=self.sr, hop_length=self.hop_length,
+                                  n_bins=7 * 36, bins_per_octave=36))
+
+    @cached_property
+    def harmonic_chroma(self):
+        return librosa.feature.chroma_cqt(C=self.harmonic_cqt, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def harmonic_onset_envelope(self):
+        return librosa.onset.onset_strength(y=self.y_harmonic, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def percussive_onset_envelope(self):
+        return librosa.onset.onset_strength(y=self.y_percussive, sr=self.sr, hop_length=self.hop_length)
+
+    @cached_property
+    def _beat_track(self):
+        return librosa.beat.beat_track(onset_envelope=self.percussive_onset_envelope, sr=self.sr,
+                                       hop_length=self.hop_length)
+
+    @cached_property
+    def tempo_estimate(self):
+        """Global tempo from the beat tracker, as a 1-element array"""
+        return np.atleast_1d(self._beat_track[0]).astype(float)
+
+    @cached_property
+    def beat_frames(self):
+        """Beat positions (frame indices) from the percussive onset envelope"""
+        return np.asarray(self._beat_track[1], dtype=int)
+
+    @cached_property
+    def beat_boundaries(self):
+        """Frame boundaries of the beat segments, padded out to the start and end of the track"""
+        return librosa.util.fix_frames(self.beat_frames, x_min=0, x_max=self.harmonic_chroma.shape[1])
+
+    @cached_property
+    def beat_chroma(self):
+        """Harmonic chroma aggregated (median) over each beat segment - one column per beat"""
+        return librosa.util.sync(self.harmonic_chroma, self.beat_boundaries, aggregate=np.median)
+
+
+# result key -> analyzer stage; the stages only read the shared features.
+# ordered cheapest first so progressive results (iter_analysis) show up early
+ANALYSIS_STAGES = {
+    'tempo_analysis': '_analyze_tempo',
+    'harmonic_analysis': '_analyze_harmony',
+    'rhythm_analysis': '_analyze_rhythm_patterns',
+    'pitch_analysis': '_analyze_pitch_advanced',
+    'structure_analysis': '_analyze_structure',
+}
+
+# features read by more than one stage - computed once in the parent and
+# handed to the stage workers through shared memory in parallel mode
+SHARED_FEATURES = (
+    'y', 'y_harmonic', 'y_percussive', 'harmonic_magnitude', 'harmonic_chroma',
+    'harmonic_onset_envelope', 'percussive_onset_envelope', 'tempo_estimate', 'beat_frames',
+)
+
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# Krumhansl-Schmuckler key profiles
+MAJOR_KEY_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_KEY_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# chord qualities as (label suffix, intervals above the root)
+CHORD_QUALITIES = (
+    ('', (0, 4, 7)),         # major
+    ('m', (0, 3, 7)),        # minor
+    ('7', (0, 4, 7, 10)),    # dominant 7th
+    ('sus4', (0, 5, 7)),
+    ('dim', (0, 3, 6)),
+)
+
+
+def _build_key_templates():
+    """24 rotated key profiles (C major, C minor, C# major, ...), z-scored so a
+    dot product with a z-scored chroma profile is its Pearson correlation"""
+    names, rows = [], []
+    for i, pitch_class in enumerate(PITCH_CLASSES):
+        for mode, profile in (('major', MAJOR_KEY_PROFILE), ('minor', MINOR_KEY_PROFILE)):
+            names.append(f"{pitch_class} {mode}")
+            rows.append(np.roll(profile, i))
+    templates = np.array(rows)
+    templates -= templates.mean(axis=1, keepdims=True)
+    templates /= np.linalg.norm(templates, axis=1, keepdims=True)
+    return names, templates
+
+
+def _build_chord_templates():
+    """binary chord templates for every root x quality, unit-normalised for cosine scoring"""
+    names, rows = [], []
+    for suffix, intervals in CHORD_QUALITIES:
+        for root, pitch_class in enumerate(PITCH_CLASSES):
+            template = np.zeros(12)
+            template[[(root + step) % 12 for step in intervals]] = 1.0
+            names.append(pitch_class + suffix)
+            rows.append(template)
+    templates = np.array(rows)
+    return names, templates / np.linalg.norm(templates, axis=1, keepdims=True)
+
+
+# built once at import - scoring is then a single matrix multiply per call
+KEY_NAMES, KEY_TEMPLATES = _build_key_templates()
+CHORD_NAMES, CHORD_TEMPLATES = _build_chord_templates()
+
+
+def _share_arrays(arrays):
+    """copy arrays into fresh shared memory blocks; returns (specs, blocks)"""
+    specs, blocks = {}, []
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+        specs[name] = (block.name, arr.shape, arr.dtype.str)
+        blocks.append(block)
+    return specs, blocks
+
+
+def _attach_arrays(specs):
+    """map shared blocks created by _share_arrays; returns (arrays, blocks)"""
+    arrays, blocks = {}, []
+    for name, (block_name, shape, dtype) in specs.items():
+        # pool workers share the parent's resource tracker, so attaching here
+        # doesn't hand ownership over - the parent still unlinks the block
+        block = shared_memory.SharedMemory(name=block_name)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        blocks.append(block)
+    return arrays, blocks
+
+
+def knn_recurrence(features, k, block_size=256):
+    """
+    Sparse mutual k-nearest-neighbour recurrence graph over feature columns.
+
+    Distances are computed a block of rows at a time, so memory stays
+    O(block_size * n + n * k) instead of the dense n x n of
+    librosa.segment.recurrence_matrix. Links get a Gaussian affinity scaled by
+    the median neighbour distance; the diagonal and adjacent columns are excluded.
+    """
+    X = features / np.maximum(np.linalg.norm(features, axis=0, keepdims=True), 1e-10)
+    n = X.shape[1]
+    k = min(k, n - 2)
+    cols = np.empty((n, k), dtype=int)
+    dists = np.empty((n, k))
+    for start in range(0, n, block_size):
+        rows = np.arange(start, min(start + block_size, n))
+        # squared euclidean distance between unit vectors = 2 - 2 cos
+        d = np.maximum(2.0 - 2.0 * (X[:, rows].T @ X), 0.0)
+        for offset in (-1, 0, 1):
+            neighbour = rows + offset
+            ok = (neighbour >= 0) & (neighbour < n)
+            d[np.flatnonzero(ok), neighbour[ok]] = np.inf
+        nearest = np.argpartition(d, k - 1, axis=1)[:, :k]
+        cols[rows] = nearest
+        dists[rows] = np.take_along_axis(d, nearest, axis=1)
+    
+    bandwidth = max(np.median(dists[np.isfinite(dists)]) if np.isfinite(dists).any() else 1.0, 1e-10)
+    affinity = np.where(np.isfinite(dists), np.exp(-dists / bandwidth), 0.0)
+    R = scipy.sparse.csr_matrix((affinity.ravel(), (np.repeat(np.arange(n), k), cols.ravel())), shape=(n, n))
+    R.eliminate_zeros()
+    # keep mutual links only
+    return R.minimum(R.T).tocsr()
+
+
+_stage_analyzers = {}
+
+
+def _run_shared_stage(method_name, specs, sr, hop_length, n_fft, settings):
+    """run one analyzer stage in a pool worker against features in shared memory"""
+    settings_key = tuple(sorted(settings.items()))
+    analyzer = _stage_analyzers.get(settings_key)
+    if analyzer is None:
+        analyzer = _stage_analyzers[settings_key] = MuzicEnhancedAnalyzer(**settings)
+
+    arrays, blocks = _attach_arrays(specs)
+    try:
+        features = AnalysisFeatures(arrays['y'], sr, hop_length=hop_length, n_fft=n_fft)
+        features.__dict__.update(arrays)  # pre-seed the cached properties
+        result = getattr(analyzer, method_name)(features)
+        # pickle here so nothing in the result still points into shared memory
+        payload = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        del features, result
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+    return payload
+
+
 class MuzicEnhancedAnalyzer:
     """
     Enhanced music analyzer using Muzic-inspired techniques
     """
     
-    def __init__(self):
+    # pitch engines for _analyze_pitch_advanced, slowest/most accurate first
+    PITCH_ENGINES = ('pyin', 'onset_pyin', 'hps')
+    
+    # per-beat self-transition probability of the chord HMM used when chord_smoothing is on
+    CHORD_SELF_TRANSITION = 0.8
+    
+    # nearest neighbours per beat in the sparse structure recurrence graph
+    STRUCTURE_NEIGHBORS = 8
+    # normalised affinity above which a section counts as a repeat of an earlier one
+    SECTION_REPEAT_THRESHOLD = 0.5
+    
+    def __init__(self, workers=1, pitch_engine='pyin', chord_smoothing=False, structure_segments=8):
         self.sample_rate = 22050
         self.hop_length = 512
         self.frame_size = 2048
         
+        if pitch_engine not in self.PITCH_ENGINES:
+            raise ValueError(f"Unknown pitch engine {pitch_engine!r}, expected one of {self.PITCH_ENGINES}")
+        self.pitch_engine = pitch_engine
+        # frames after each onset that onset_pyin fills in
+        self.onset_pitch_frames = 4
+        # Viterbi-smooth the frame-wise chord labels instead of taking the raw argmax
+        self.chord_smoothing = bool(chord_smoothing)
+        # number of segments the structure stage splits the track into
+        if int(structure_segments) < 1:
+            raise ValueError(f"structure_segments must be at least 1, got {structure_segments}")
+        self.structure_segments = int(structure_segments)
+        
+        # workers > 1 fans the analysis stages out over a process pool
+        self.workers = max(1, int(workers or 1))
+        self._executor = None
+        
         # Initialize instrument classifier
         self.instrument_classifier = None
         self.timbre_scaler = None
         
         # Load pre-trained models if available
         self._load_timbre_models()
+
+    def _load_timbre_models(self):
+        """Load the optional timbre classifier if one has been trained"""
+        model_path = os.path.join("models", "timbre_classifier.pkl")
+        if not SKLEARN_AVAILABLE or not os.path.exists(model_path):
+            return
+        try:
+            with open(model_path, "rb") as fh:
+                saved = pickle.load(fh)
+            self.instrument_classifier = saved.get("classifier")
+            self.timbre_scaler = saved.get("scaler")
+        except Exception as e:
+            logger.warning(f"Could not load timbre models: {e}")
+
+    def close(self):
+        """shut down the stage worker pool, if one was started"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _stage_settings(self):
+        """constructor arguments that stage workers need to rebuild an equivalent analyzer"""
+        return {
+            'pitch_engine': self.pitch_engine,
+            'chord_smoothing': self.chord_smoothing,
+            'structure_segments': self.structure_segments,
+        }
+
+    def _run_stages(self, features, stages=None):
+        """run the analysis stages (all of ANALYSIS_STAGES by default) and collect their results"""
+        return dict(self._iter_stages(features, stages))
+
+    def _iter_stages(self, features, stages=None):
+        """yield (result key, result) per stage in ANALYSIS_STAGES order, in this process or fanned out over the pool"""
+        stages = ANALYSIS_STAGES if stages is None else {key: ANALYSIS_STAGES[key] for key in ANALYSIS_STAGES
+                                                         if key in stages}
+        if self.workers <= 1:
+            for key, method in stages.items():
+                yield key, getattr(self, method)(features)
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+        # computing the shared features here (HPSS, CQT chroma, onset envelopes)
+        # keeps them from being recomputed in every worker that needs them
+        specs, blocks = _share_arrays({name: getattr(features, name) for name in SHARED_FEATURES})
+        futures = {}
+        try:
+            futures = {
+                key: self._executor.submit(_run_shared_stage, method, specs, features.sr,
+                                           features.hop_length, features.n_fft,
+                                           self._stage_settings())
+                for key, method in stages.items()
+            }
+            for key, future in futures.items():
+                yield key, pickle.loads(future.result())
+        finally:
+            # the consumer may stop early - don't pull the blocks out from under running stages
+            for future in futures.values():
+                future.cancel()
+            wait(futures.values())
+            for block in blocks:
+                block.close()
+                block.unlink()
         
-    def analyze_audio_enhanced(self, audio_path):
+    def analyze_audio_enhanced(self, audio_path, on_stage=None):
         """
         Enhanced audio analysis using advanced music understanding techniques
         inspired by Muzic's MusicBERT and CLaMP approaches
+        
+        on_stage, if given, is called as on_stage(event, payload) for every
+        partial result from iter_analysis as soon as it is ready.
         """
         try:
-            # Load audio
-            y, sr = librosa.load(audio_path, sr=self.sample_rate)
-            
-            # Advanced harmonic-percussive separation
-            y_harmonic, y_percussive = librosa.effects.hpss(y, margin=(1.0, 5.0))
-            
-            # Multi-level analysis
-            analysis_results = {
-                'tempo_analysis': self._analyze_tempo(y_percussive, sr),
-                'pitch_analysis': self._analyze_pitch_advanced(y_harmonic, sr),
-                'rhythm_analysis': self._analyze_rhythm_patterns(y_percussive, sr),
-                'harmonic_analysis': self._analyze_harmony(y_harmonic, sr),
-                'structure_analysis': self._analyze_structure(y, sr)
-            }
-            
-            # Generate enhanced ChordCraft code
-            code_lines = self._generate_enhanced_code(analysis_results)
-            generated_code = "\n".join(code_lines)
-            
-            # Return comprehensive analysis results
-            return {
-                "generated_code": generated_code,
-                "tempo": analysis_results['tempo_analysis']['bpm'],
-                "key": analysis_results['harmonic_analysis']['key'],
-                "time_signature": analysis_results['tempo_analysis']['time_signature'],
-                "chord_progression": analysis_results['harmonic_analysis']['chord_progressions'],
-                "musical_features": {
-                    "total_notes": len(analysis_results['pitch_analysis']['onset_times']),
-                    "dominant_pitches": analysis_results['pitch_analysis']['pitch_classes'],
-                    "rhythm_complexity": analysis_results['rhythm_analysis']['complexity'],
-                    "sections": analysis_results['structure_analysis']['sections']
-                },
-                "harmony_analysis": {
-                    "key": analysis_results['harmonic_analysis']['key'],
-                    "chord_progressions": analysis_results['harmonic_analysis']['chord_progressions']
-                },
-                "rhythm_analysis": {
-                    "complexity": analysis_results['rhythm_analysis']['complexity'],
-                    "patterns": analysis_results['rhythm_analysis']['patterns']
-                },
-                "analysis_type": "muzic_enhanced"
-            }
+            for event, payload in self.iter_analysis(audio_path):
+                if on_stage is not None:
+                    on_stage(event, payload)
+                if event == 'result':
+                    return payload
             
         except Exception as e:
             logger.error(f"Enhanced analysis error: {e}")
-            return {
-                "generated_code": f"// Error in enhanced analysis: {e}",
-                "tempo": 120,
-                "key": "C major",
-                "time_signature": "4/4",
-                "chord_progression": [],
-                "musical_features": {},
-                "harmony_analysis": {},
-                "rhythm_analysis": {},
-                "analysis_type": "muzic_error",
-                "error": str(e)
+            return self._error_results(e)
+    
+    def iter_analysis(self, audio_path):
+        """
+        Run the analysis and yield (event, payload) pairs as each stage finishes
+        
+        Events arrive cheapest first: 'tempo', 'key', 'chords', 'rhythm',
+        'notes' and 'structure', each with a JSON-serialisable payload, and
+        finally 'result' with the same dict analyze_audio_enhanced returns.
+        Errors are raised, not turned into an error result.
+        """
+        # Load audio - uploads arrive as streams, which audioread-only formats
+        # (M4A/AAC, MP3 on older libsndfile) can't be decoded from directly
+        from audio_codec import _load_whole
+        y, sr = _load_whole(audio_path, sr=self.sample_rate, mono=True)
+        
+        # Shared feature context - harmonic-percussive separation, CQT,
+        # chroma and onset envelopes are computed once and reused by every stage
+        features = AnalysisFeatures(y, sr, hop_length=self.hop_length, n_fft=self.frame_size)
+        
+        # Multi-level analysis
+        analysis_results = {}
+        for key, result in self._iter_stages(features):
+            analysis_results[key] = result
+            yield from self._stage_events(key, analysis_results)
+        
+        # Generate enhanced ChordCraft code
+        code_lines = self._generate_enhanced_code(analysis_results)
+        yield 'result', self._build_results(analysis_results, "\n".join(code_lines))
+    
+    def _stage_events(self, key, analysis):
+        """Progressive events for a finished stage"""
+        result = analysis[key]
+        if key == 'tempo_analysis':
+            yield 'tempo', {
+                'bpm': result['bpm'],
+                'time_signature': result['time_signature'],
+                'beats': result['beats'],
+                'stability': result['stability']
             }
+        elif key == 'harmonic_analysis':
+            yield 'key', {'key': result['key']}
+            yield 'chords', {
+                'chord_progression': result['chord_progressions'],
+                'chord_times': result['chord_times']
+            }
+        elif key == 'rhythm_analysis':
+            yield 'rhythm', {'complexity': result['complexity'], 'patterns': result['patterns']}
+        elif key == 'pitch_analysis':
+            # notes need the beat grid and chords, which come from earlier stages
+            yield 'notes', {
+                'notes': self._format_note_events(self._extract_note_events(analysis)),
+                'total_notes': len(result['onset_times']),
+                'dominant_pitches': result['pitch_classes']
+            }
+        elif key == 'structure_analysis':
+            yield 'structure', result
+    
+    def analyze_long_form(self, audio_path, window_seconds=30.0, overlap_seconds=5.0,
+                          checkpoint_path=None, on_window=None):
+        """
+        Windowed analysis for recordings too long to analyse in one piece
+        
+        The audio is decoded and analysed in overlapping windows, so peak memory
+        depends on the window size rather than the recording length. See
+        long_form.LongFormAnalysis for the stitching and checkpoint details;
+        on_window is called with each window's partial results as they finish.
+        """
+        from long_form import LongFormAnalysis
+        
+        try:
+            analysis = LongFormAnalysis(self, audio_path, window_seconds=window_seconds,
+                                        overlap_seconds=overlap_seconds, checkpoint_path=checkpoint_path)
+            for window in analysis:
+                if on_window is not None:
+                    on_window(window)
+            return analysis.result()
+        except Exception as e:
+            logger.error(f"Long-form analysis error: {e}")
+            return self._error_results(e)
     
-    def _analyze_tempo(self, y_percussive, sr):
+    def _build_results(self, analysis_results, generated_code):
+        """Public result dict for a finished analysis"""
+        return {
+            "generated_code": generated_code,
+            "tempo": analysis_results['tempo_analysis']['bpm'],
+            "key": analysis_results['harmonic_analysis']['key'],
+            "time_signature": analysis_results['tempo_analysis']['time_signature'],
+            "chord_progression": analysis_results['harmonic_analysis']['chord_progressions'],
+            "chord_times": analysis_results['harmonic_analysis']['chord_times'],
+            "musical_features": {
+                "total_notes": len(analysis_results['pitch_analysis']['onset_times']),
+                "dominant_pitches": analysis_results['pitch_analysis']['pitch_classes'],
+                "rhythm_complexity": analysis_results['rhythm_analysis']['complexity'],
+                "sections": analysis_results['structure_analysis']['sections']
+            },
+            "harmony_analysis": {
+                "key": analysis_results['harmonic_analysis']['key'],
+                "chord_progressions": analysis_results['harmonic_analysis']['chord_progressions'],
+                "chord_times": analysis_results['harmonic_analysis']['chord_times']
+            },
+            "rhythm_analysis": {
+                "complexity": analysis_results['rhythm_analysis']['complexity'],
+                "patterns": analysis_results['rhythm_analysis']['patterns']
+            },
+            "analysis_type": "muzic_enhanced"
+        }
+    
+    def _error_results(self, e):
+        """Result dict returned when an analysis fails"""
+        return {
+            "generated_code": f"// Error in enhanced analysis: {e}",
+            "tempo": 120,
+            "key": "C major",
+            "time_signature": "4/4",
+            "chord_progression": [],
+            "musical_features": {},
+            "harmony_analysis": {},
+            "rhythm_analysis": {},
+            "analysis_type": "muzic_error",
+            "error": str(e)
+        }
+    
+    def _analyze_tempo(self, features):
         """Advanced tempo analysis with beat tracking"""
         try:
-            # Multi-level tempo analysis
-            tempo, beats = librosa.beat.beat_track(y=y_percussive, sr=sr, units='time')
+            sr = features.sr
+            onset_env = features.percussive_onset_envelope
+            
+            # Multi-level tempo analysis - the beat grid is shared with the harmony stage
+            tempo = float(features.tempo_estimate[0])
+            beats = librosa.frames_to_time(features.beat_frames, sr=sr, hop_length=features.hop_length)
             
             # Ensure we have a valid tempo
             if tempo <= 0 or np.isnan(tempo):
@@ -140,8 +549,9 @@ class MuzicEnhancedAnalyzer:
                 beats = np.array([0.0, 0.5, 1.0, 1.5])  # Default beat pattern
             
             # Tempo stability analysis
-            hop_length = 512
-            tempo_series = librosa.feature.tempo(y=y_percussive, sr=sr, hop_length=hop_length)
+            tempo_series = librosa.feature.tempo(
+                onset_envelope=onset_env, sr=sr, hop_length=features.hop_length
+            )
             tempo_stability = np.std(tempo_series) if len(tempo_series) > 0 else 0.0
             
             return {
@@ -159,24 +569,15 @@ class MuzicEnhancedAnalyzer:
                 'time_signature': "4/4"
             }
     
-    def _analyze_pitch_advanced(self, y_harmonic, sr):
+    def _analyze_pitch_advanced(self, features):
         """Advanced pitch analysis with chord detection"""
-        # PYIN for fundamental frequency
-        f0, voiced_flag, voiced_probs = librosa.pyin(
-            y_harmonic, 
-            fmin=librosa.note_to_hz('C2'), 
-            fmax=librosa.note_to_hz('C7'), 
-            sr=sr,
-            frame_length=2048
-        )
-        
-        # Chroma features for harmony
-        chroma = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr)
+        sr = features.sr
         
         # Onset detection
         onset_frames = librosa.onset.onset_detect(
-            y=y_harmonic, 
+            onset_envelope=features.harmonic_onset_envelope, 
             sr=sr, 
+            hop_length=features.hop_length,
             units='frames',
             pre_max=20,
             post_max=20,
@@ -185,7 +586,13 @@ class MuzicEnhancedAnalyzer:
             delta=0.2,
             wait=10
         )
-        onset_times = librosa.frames_to_time(onset_frames, sr=sr)
+        onset_times = librosa.frames_to_time(onset_frames, sr=sr, hop_length=features.hop_length)
+        
+        # Fundamental frequency with the configured pitch engine
+        f0, voiced_flag, voiced_probs = self._track_pitch(features, onset_frames)
+        
+        # Chroma features for harmony
+        chroma = features.harmonic_chroma
         
         return {
             'f0': f0,
@@ -196,10 +603,118 @@ class MuzicEnhancedAnalyzer:
             'pitch_classes': self._extract_pitch_classes(chroma)
         }
     
-    def _analyze_rhythm_patterns(self, y_percussive, sr):
+    def _track_pitch(self, features, onset_frames):
+        """f0, voiced_flag, voiced_probs at hop resolution from the selected pitch engine"""
+        if self.pitch_engine == 'pyin':
+            return self._pitch_pyin(features.y_harmonic, features.sr)
+        if self.pitch_engine == 'onset_pyin':
+            return self._pitch_onset_pyin(features, onset_frames)
+        return self._pitch_hps(features)
+    
+    def _pitch_pyin(self, y_harmonic, sr):
+        """Full-resolution PYIN over the whole harmonic signal (most accurate, slowest)"""
+        return librosa.pyin(
+            y_harmonic, 
+            fmin=librosa.note_to_hz('C2'), 
+            fmax=librosa.note_to_hz('C7'), 
+            sr=sr,
+            frame_length=2048
+        )
+    
+    def _pitch_onset_pyin(self, features, onset_frames):
+        """PYIN evaluated only in short windows after each onset
+        
+        _generate_enhanced_code only reads f0 at onset frames, so everything else is
+        left unvoiced. Overlapping windows are merged into one PYIN call per run.
+        """
+        n_frames = 1 + len(features.y_harmonic) // features.hop_length
+        f0 = np.full(n_frames, np.nan)
+        voiced_flag = np.zeros(n_frames, dtype=bool)
+        voiced_probs = np.zeros(n_frames)
+        if len(onset_frames) == 0:
+            return f0, voiced_flag, voiced_probs
+        
+        # frames of context either side so PYIN's padding/Viterbi edges don't reach the onset
+        context = self.frame_size // features.hop_length
+        starts = np.maximum(np.asarray(onset_frames) - context, 0)
+        ends = np.minimum(np.asarray(onset_frames) + self.onset_pitch_frames + context, n_frames)
+        
+        # merge overlapping windows into runs
+        run_starts = [starts[0]]
+        run_ends = [ends[0]]
+        for start, end in zip(starts[1:], ends[1:]):
+            if start <= run_ends[-1]:
+                run_ends[-1] = max(run_ends[-1], end)
+            else:
+                run_starts.append(start)
+                run_ends.append(end)
+        
+        for start, end in zip(run_starts, run_ends):
+            segment = features.y_harmonic[start * features.hop_length:end * features.hop_length]
+            seg_f0, seg_voiced, seg_probs = self._pitch_pyin(segment, features.sr)
+            seg_frames = min(len(seg_f0), end - start)
+            f0[start:start + seg_frames] = seg_f0[:seg_frames]
+            voiced_flag[start:start + seg_frames] = seg_voiced[:seg_frames]
+            voiced_probs[start:start + seg_frames] = seg_probs[:seg_frames]
+        
+        return f0, voiced_flag, voiced_probs
+    
+    def _pitch_hps(self, features, n_harmonics=4):
+        """Harmonic product spectrum on the shared harmonic spectrogram, fully vectorised
+        
+        The peak of the log-HPS picks the fundamental bin; each harmonic's peak is then
+        refined by parabolic interpolation and divided back down, so resolution is much
+        finer than the 2048-point FFT bin spacing.
+        """
+        S = features.harmonic_magnitude
+        bin_hz = features.sr / features.n_fft
+        log_S = np.log(S + 1e-10)
+        
+        # log-HPS over the fundamentals whose n-th harmonic is still in the spectrum
+        max_bin = S.shape[0] // n_harmonics
+        hps = log_S[:max_bin].copy()
+        for h in range(2, n_harmonics + 1):
+            hps += log_S[::h][:max_bin]
+        
+        lo = max(1, int(np.floor(librosa.note_to_hz('C2') / bin_hz)))
+        hi = min(max_bin - 1, int(np.ceil(librosa.note_to_hz('C7') / bin_hz)))
+        frames = np.arange(S.shape[1])
+        peak = lo + np.argmax(hps[lo:hi + 1], axis=0)
+        
+        # refine against every harmonic and average, weighted by harmonic magnitude
+        estimate = np.zeros(S.shape[1])
+        weight = np.zeros(S.shape[1])
+        for h in range(1, n_harmonics + 1):
+            centre = np.clip(peak * h, 1, S.shape[0] - 2)
+            # the true harmonic may sit a bin either side of h * peak
+            window = np.stack([log_S[centre + d, frames] for d in (-1, 0, 1)])
+            centre = centre + np.argmax(window, axis=0) - 1
+            centre = np.clip(centre, 1, S.shape[0] - 2)
+            a, b, c = log_S[centre - 1, frames], log_S[centre, frames], log_S[centre + 1, frames]
+            denom = a - 2 * b + c
+            delta = np.where(np.abs(denom) > 1e-12, 0.5 * (a - c) / np.where(denom == 0, 1, denom), 0.0)
+            delta = np.clip(delta, -0.5, 0.5)
+            w = S[centre, frames]
+            estimate += w * (centre + delta) * bin_hz / h
+            weight += w
+        f0 = estimate / np.maximum(weight, 1e-10)
+        
+        # voicing: loud enough relative to the track, and a peak that stands out of the HPS
+        energy_db = librosa.amplitude_to_db(S.max(axis=0), ref=np.max(S) if S.size else 1.0)
+        salience = hps[peak, frames] - np.median(hps[lo:hi + 1], axis=0)
+        voiced_probs = np.clip(salience / (n_harmonics * 8.0), 0.0, 1.0)
+        voiced_probs[energy_db < -40] = 0.0
+        voiced_flag = voiced_probs > 0.5
+        f0 = np.where(voiced_flag, f0, np.nan)
+        return f0, voiced_flag, voiced_probs
+    
+    def _analyze_rhythm_patterns(self, features):
         """Analyze rhythmic patterns and complexity"""
         # Tempogram for rhythm analysis
-        tempogram = librosa.feature.tempogram(y=y_percussive, sr=sr)
+        tempogram = librosa.feature.tempogram(
+            onset_envelope=features.percussive_onset_envelope, sr=features.sr,
+            hop_length=features.hop_length
+        )
         
         # Rhythmic complexity measure
         rhythm_complexity = np.mean(np.std(tempogram, axis=1))
@@ -209,39 +724,83 @@ class MuzicEnhancedAnalyzer:
             'patterns': self._detect_rhythm_patterns(tempogram)
         }
     
-    def _analyze_harmony(self, y_harmonic, sr):
+    def _analyze_harmony(self, features):
         """Analyze harmonic content and progressions"""
-        # Harmonic content analysis
-        harmonic_centroids = librosa.feature.spectral_centroid(y=y_harmonic, sr=sr)
-        harmonic_rolloff = librosa.feature.spectral_rolloff(y=y_harmonic, sr=sr)
+        # Harmonic content analysis - the HPSS spectrogram is reused, no extra STFT
+        S = features.harmonic_magnitude
+        harmonic_centroids = librosa.feature.spectral_centroid(S=S, sr=features.sr, n_fft=features.n_fft)
+        harmonic_rolloff = librosa.feature.spectral_rolloff(S=S, sr=features.sr, n_fft=features.n_fft)
         
         # Key estimation
-        chroma = librosa.feature.chroma_cqt(y=y_harmonic, sr=sr)
+        chroma = features.harmonic_chroma
         key_profile = np.mean(chroma, axis=1)
         estimated_key = self._estimate_key(key_profile)
         
+        # Chords on the beat grid - one label per beat segment with its start time
+        chord_times = librosa.frames_to_time(features.beat_boundaries[:-1], sr=features.sr,
+                                             hop_length=features.hop_length)
+        
         return {
             'key': estimated_key,
             'harmonic_centroids': harmonic_centroids.tolist(),
             'harmonic_rolloff': harmonic_rolloff.tolist(),
-            'chord_progressions': self._detect_chord_progressions(chroma)
+            'chord_progressions': self._detect_chord_progressions(features.beat_chroma),
+            'chord_times': chord_times.tolist()
         }
     
-    def _analyze_structure(self, y, sr):
+    def _analyze_structure(self, features):
         """Analyze musical structure and form"""
-        # Structural segmentation
-        C = librosa.feature.chroma_cqt(y=y, sr=sr)
-        R = librosa.segment.recurrence_matrix(C, mode='affinity')
+        # Structural segmentation on beat-synchronous chroma - a few thousand
+        # columns even for long mixes, instead of one per analysis frame
+        C = features.beat_chroma
+        n_beats = C.shape[1]
+        if n_beats < 2:
+            # silence / very short clips: no beats to cluster, the whole track is one section
+            span = librosa.frames_to_time(features.beat_boundaries[[0, -1]], sr=features.sr,
+                                          hop_length=features.hop_length)
+            return {'boundaries': span.tolist(), 'sections': 1, 'section_labels': ['A']}
         
-        # Detect structural boundaries
-        boundaries = librosa.segment.agglomerative(C, k=8)
-        boundary_times = librosa.frames_to_time(boundaries, sr=sr)
+        # Detect structural boundaries (indices into the beat segments)
+        boundaries = librosa.segment.agglomerative(C, k=min(self.structure_segments, n_beats))
+        boundary_frames = features.beat_boundaries[boundaries]
+        boundary_times = librosa.frames_to_time(boundary_frames, sr=features.sr, hop_length=features.hop_length)
         
         return {
             'boundaries': boundary_times.tolist(),
-            'sections': len(boundaries) - 1
+            'sections': len(boundaries) - 1,
+            'section_labels': self._label_sections(C, boundaries)
         }
     
+    def _label_sections(self, C, boundaries):
+        """Letter labels for the segments, reusing a label when a segment repeats an earlier one"""
+        n_beats = C.shape[1]
+        n_sections = len(boundaries)
+        labels = [chr(ord('A') + i % 26) for i in range(n_sections)]
+        if n_beats < 4 or n_sections < 2:
+            return labels[:n_sections]
+        
+        # Sparse k-NN recurrence - O(beats * k) memory instead of a dense beats x beats matrix
+        R = knn_recurrence(C, self.STRUCTURE_NEIGHBORS)
+        
+        # Section-to-section affinity: sum the recurrence links between every pair of sections
+        section_of_beat = np.searchsorted(boundaries, np.arange(n_beats), side='right') - 1
+        membership = np.zeros((n_sections, n_beats))
+        membership[section_of_beat, np.arange(n_beats)] = 1.0
+        affinity = np.asarray((R @ membership.T).T @ membership.T)
+        
+        sizes = membership.sum(axis=1)
+        affinity /= np.sqrt(np.outer(sizes, sizes))
+        
+        next_label = 0
+        for j in range(n_sections):
+            earlier = affinity[j, :j]
+            if j and earlier.max() > self.SECTION_REPEAT_THRESHOLD * max(affinity[j, j], 1e-10):
+                labels[j] = labels[int(np.argmax(earlier))]
+            else:
+                labels[j] = chr(ord('A') + next_label % 26)
+                next_label += 1
+        return labels
+    
     def _estimate_time_signature(self, beats):
         """Estimate time signature from beat pattern"""
         if len(beats) < 4:
@@ -285,63 +844,50 @@ class MuzicEnhancedAnalyzer:
     
     def _estimate_key(self, chroma_profile):
         """Estimate musical key from chroma profile"""
-        # Krumhansl-Schmuckler key profiles (simplified)
-        major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
-        minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
-        
-        keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+        # Correlate against all 24 key profiles at once
+        profile = np.asarray(chroma_profile, dtype=float)
+        profile = profile - profile.mean()
+        norm = np.linalg.norm(profile)
+        if norm == 0:
+            return 'C major'  # flat profile, no correlation with anything
         
-        best_correlation = -1
-        best_key = 'C major'
-        
-        for i in range(12):
-            # Rotate profiles for each key
-            major_rotated = np.roll(major_profile, i)
-            minor_rotated = np.roll(minor_profile, i)
-            
-            major_corr = np.corrcoef(chroma_profile, major_rotated)[0, 1]
-            minor_corr = np.corrcoef(chroma_profile, minor_rotated)[0, 1]
-            
-            if major_corr > best_correlation:
-                best_correlation = major_corr
-                best_key = f"{keys[i]} major"
-            
-            if minor_corr > best_correlation:
-                best_correlation = minor_corr
-                best_key = f"{keys[i]} minor"
-        
-        return best_key
+        correlations = KEY_TEMPLATES @ (profile / norm)
+        return KEY_NAMES[int(np.argmax(correlations))]
+    
+    def _score_chords(self, chroma):
+        """Cosine similarity of every chroma frame against every chord template (chords x frames)"""
+        norms = np.linalg.norm(chroma, axis=0, keepdims=True)
+        return CHORD_TEMPLATES @ (chroma / np.maximum(norms, 1e-10))
     
     def _detect_chord_progressions(self, chroma):
-        """Detect basic chord progressions"""
-        # Simplified chord detection
-        chord_templates = {
-            'C': [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 0],
-            'F': [1, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0],
-            'G': [0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0, 1],
-            'Am': [1, 0, 0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
-        }
+        """Detect chord progressions by template matching, one label per chroma column"""
+        # Score all columns against the whole chord bank in one matrix multiply
+        scores = self._score_chords(chroma)
         
-        progressions = []
-        for i in range(0, chroma.shape[1], 4):  # Every 4 frames
-            frame_chroma = chroma[:, i] if i < chroma.shape[1] else chroma[:, -1]
-            
-            best_match = 'C'
-            best_score = 0
-            
-            for chord_name, template in chord_templates.items():
-                score = np.dot(frame_chroma, template)
-                if score > best_score:
-                    best_score = score
-                    best_match = chord_name
-            
-            progressions.append(best_match)
+        if self.chord_smoothing and scores.shape[1] > 1:
+            # HMM smoothing - sharpen scores into per-frame likelihoods and
+            # decode the most likely chord path with a sticky transition matrix
+            likelihood = np.exp((scores - scores.max(axis=0, keepdims=True)) / 0.05)
+            likelihood /= likelihood.sum(axis=0, keepdims=True)
+            transition = librosa.sequence.transition_loop(len(CHORD_NAMES), self.CHORD_SELF_TRANSITION)
+            labels = librosa.sequence.viterbi(likelihood, transition)
+        else:
+            labels = np.argmax(scores, axis=0)
         
-        return progressions
+        return [CHORD_NAMES[i] for i in labels]
     
     def _generate_enhanced_code(self, analysis):
         """Generate enhanced ChordCraft code from analysis results"""
-        code_lines = [
+        code_lines = self._code_header(analysis)
+        
+        # Generate note events with enhanced timing and harmony
+        code_lines.extend(self._format_note_events(self._extract_note_events(analysis)))
+        
+        return code_lines
+    
+    def _code_header(self, analysis):
+        """Comment block summarising the analysis at the top of the generated code"""
+        return [
             "// Enhanced ChordCraft Analysis (Muzic-Inspired)",
             f"// Key: {analysis['harmonic_analysis']['key']}",
             f"// Tempo: {analysis['tempo_analysis']['bpm']} BPM ({analysis['tempo_analysis']['time_signature']})",
@@ -349,80 +895,94 @@ class MuzicEnhancedAnalyzer:
             f"// Dominant Pitches: {', '.join(analysis['pitch_analysis']['pitch_classes'])}",
             ""
         ]
+    
+    def _format_note_events(self, events, time_offset=0.0):
+        """PLAY lines for a note event array, with times shifted by time_offset"""
+        return [
+            f"PLAY {event['note']} FOR {event['duration']:.3f}s AT {event['time'] + time_offset:.2f}s "
+            f"// Chord: {event['chord']}"
+            for event in events
+        ]
+    
+    def _extract_note_events(self, analysis):
+        """
+        Map every onset to its pitch frame, beat-quantized duration and chord label
+        in one batch of NumPy operations.
         
-        # Generate note events with enhanced timing and harmony
-        onset_times = analysis['pitch_analysis']['onset_times']
-        f0 = analysis['pitch_analysis']['f0']
-        voiced_flag = analysis['pitch_analysis']['voiced_flag']
-        beats = analysis['tempo_analysis']['beats']
+        Returns a structured array with fields time, frame, f0, duration, note and
+        chord, one row per voiced onset, in onset order.
+        """
+        onset_times = np.asarray(analysis['pitch_analysis']['onset_times'], dtype=float)
+        f0 = np.asarray(analysis['pitch_analysis']['f0'], dtype=float)
+        voiced_flag = np.asarray(analysis['pitch_analysis']['voiced_flag'], dtype=bool)
+        beats = np.asarray(analysis['tempo_analysis']['beats'], dtype=float)
+        chords = analysis['harmonic_analysis']['chord_progressions']
+        chord_times = analysis['harmonic_analysis'].get('chord_times')
         
+        # Nearest pitch frame for every onset (ties go to the earlier frame)
         times = librosa.times_like(f0, sr=self.sample_rate)
+        right = np.clip(np.searchsorted(times, onset_times), 0, max(len(times) - 1, 0))
+        left = np.maximum(right - 1, 0)
+        frames = np.where(np.abs(times[left] - onset_times) <= np.abs(times[right] - onset_times), left, right)
         
-        for i, onset_time in enumerate(onset_times):
-            # Find closest frame
-            frame_idx = np.argmin(np.abs(times - onset_time))
-            
-            if frame_idx < len(voiced_flag) and voiced_flag[frame_idx]:
-                pitch_hz = f0[frame_idx]
-                if not np.isnan(pitch_hz):
-                    note_name = librosa.hz_to_note(pitch_hz)
-                    
-                    # Calculate duration with beat awareness
-                    duration = self._calculate_smart_duration(
-                        onset_time, onset_times, beats, i
-                    )
-                    
-                    # Add harmonic context
-                    chord_context = self._get_chord_context(
-                        onset_time,
-                        analysis['harmonic_analysis']['chord_progressions'],
-                        beats=np.array(beats)
-                    )
-                    
-                    if duration > 0.05:  # Filter very short notes
-                        code_lines.append(
-                            f"PLAY {note_name} FOR {duration:.3f}s AT {onset_time:.2f}s "
-                            f"// Chord: {chord_context}"
-                        )
+        keep = voiced_flag[frames] & ~np.isnan(f0[frames]) if len(frames) else np.zeros(0, dtype=bool)
+        durations = self._smart_durations(onset_times, beats)
+        chord_labels = self._chord_contexts(onset_times, chords, beats, chord_times)
         
-        return code_lines
-    
-    def _calculate_smart_duration(self, onset_time, all_onsets, beats, current_idx):
-        """Calculate note duration with musical intelligence"""
-        # Default duration
-        duration = 0.5
+        frames = frames[keep]
+        durations = durations[keep]
+        keep_times = onset_times[keep]
+        notes = np.atleast_1d(librosa.hz_to_note(f0[frames])) if len(frames) else np.zeros(0, dtype=str)
+        chord_labels = chord_labels[keep]
+        
+        # Filter very short notes
+        long_enough = durations > 0.05
         
-        # Duration until next onset
-        if current_idx < len(all_onsets) - 1:
-            duration = all_onsets[current_idx + 1] - onset_time
+        events = np.zeros(int(long_enough.sum()), dtype=[
+            ('time', float), ('frame', int), ('f0', float), ('duration', float),
+            ('note', notes.dtype if notes.size else 'U1'),
+            ('chord', chord_labels.dtype if chord_labels.size else 'U1'),
+        ])
+        events['time'] = keep_times[long_enough]
+        events['frame'] = frames[long_enough]
+        events['f0'] = f0[frames][long_enough]
+        events['duration'] = durations[long_enough]
+        events['note'] = notes[long_enough]
+        events['chord'] = chord_labels[long_enough]
+        return events
+    
+    def _smart_durations(self, onset_times, beats):
+        """Note durations with musical intelligence: inter-onset gaps snapped to the beat grid"""
+        # Duration until next onset (the last note gets a default half second)
+        durations = np.append(np.diff(onset_times), 0.5)[:len(onset_times)]
         
-        # Quantize to beat grid
+        # Quantize to beat grid - snap to nearest 16th of the average beat
         if len(beats) > 1:
-            beat_duration = np.mean(np.diff(beats))
-            # Snap to nearest beat subdivision
-            duration = round(duration / (beat_duration / 4)) * (beat_duration / 4)
+            step = np.mean(np.diff(beats)) / 4
+            durations = np.round(durations / step) * step
         
         # Reasonable limits
-        return max(0.1, min(duration, 4.0))
+        return np.clip(durations, 0.1, 4.0)
     
-    def _get_chord_context(self, time, chord_progression, beats=None):
-        """Get chord context for a given time using beat grid if available"""
+    def _chord_contexts(self, onset_times, chord_progression, beats, chord_times=None):
+        """Chord label for each onset time, using the beat grid if available"""
         if not chord_progression:
-            return "Unknown"
-
+            return np.full(len(onset_times), "Unknown")
+        
+        labels = np.asarray(chord_progression)
+        
+        # Beat-synchronous chords carry their own start times - look the segment up directly
+        if chord_times is not None and len(chord_times) == len(labels):
+            chord_idx = np.maximum(np.searchsorted(chord_times, onset_times, side='right') - 1, 0)
         # If beat positions are available, map chords to beat segments
-        if beats is not None and len(beats) > 1:
+        elif len(beats) > 1:
             total_beats = len(beats)
-            beat_idx = np.searchsorted(beats, time, side='right') - 1
-            beat_idx = max(0, min(beat_idx, total_beats - 1))
-            chord_idx = int(beat_idx / max(1, total_beats) * len(chord_progression))
-            chord_idx = min(chord_idx, len(chord_progression) - 1)
-            return chord_progression[chord_idx]
-
-        # Fallback: even segmentation across total duration estimate
-        chord_idx = int(time * len(chord_progression) / 10)
-        chord_idx = min(chord_idx, len(chord_progression) - 1)
-        return chord_progression[chord_idx]
+            beat_idx = np.clip(np.searchsorted(beats, onset_times, side='right') - 1, 0, total_beats - 1)
+            chord_idx = (beat_idx / total_beats * len(labels)).astype(int)
+        else:
+            # Fallback: even segmentation across total duration estimate
+            chord_idx = (onset_times * len(labels) / 10).astype(int)
+        return labels[np.minimum(chord_idx, len(labels) - 1)]
 
 
 # Utility functions for Muzic integration
@@ -459,7 +1019,6 @@ def validate_muzic_integration():
     except Exception as e:
         logger.error(f"Muzic integration validation failed: {e}")
         return False
-<<<<<<< Current (Your changes)
 
 class MuzicCodeAnalyzer:
     """Enhanced code analyzer using Muzic-inspired techniques"""
@@ -623,5 +1182,4 @@ class MuzicCodeAnalyzer:
             "intervals": intervals[:10],  # Limit to 10 intervals
             "note_range": f"{min(notes)} to {max(notes)}" if notes else "none"
         }
-=======
->>>>>>> Incoming (Background Agent changes)
+
@@ -0,0 +1,138 @@
+"""
+Neural codec (EnCodec) for ChordCraft
+Loads each model once per process, encodes audio in fixed-length frames under
+torch.inference_mode and can batch the frames of several signals into one
+forward pass
+"""
+
+import logging
+import math
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lazy_imports import LazyModule, available
+
+logger = logging.getLogger(__name__)
+
+# optional - torch + transformers are only needed for include_neural, and only
+# get imported when the first model is loaded
+NEURAL_CODECS_AVAILABLE = available("torch", "transformers")
+torch = LazyModule("torch")
+transformers = LazyModule("transformers")
+# on whenever torch + transformers are installed; CHORDCRAFT_ENABLE_NEURAL=0 switches
+# include_neural off without uninstalling them
+NEURAL_CODECS_ENABLED = os.environ.get("CHORDCRAFT_ENABLE_NEURAL", "1") != "0"
+
+DEFAULT_MODEL = "facebook/encodec_24khz"
+DEFAULT_BANDWIDTH = 6.0  # kbps - 8 codebooks on the 24 kHz model
+FRAME_SECONDS = 5.0  # audio per forward-pass item; frames from many signals share a batch
+MAX_BATCH_FRAMES = 16
+
+
+class NeuralEncoder:
+    """
+    EnCodec at one bandwidth, encoding float audio to (codebooks, frames) codes.
+
+    Signals are cut into frame_seconds pieces (the last one zero-padded) and
+    encoded independently, which is what lets encode_batch() put pieces of
+    different uploads in the same forward pass. Codes come back trimmed to
+    ceil(samples / hop_length) frames per signal.
+    """
+
+    def __init__(self, model, bandwidth: float = DEFAULT_BANDWIDTH, model_name: Optional[str] = None,
+                 frame_seconds: float = FRAME_SECONDS, max_batch: int = MAX_BATCH_FRAMES):
+        config = model.config
+        if float(bandwidth) not in [float(b) for b in config.target_bandwidths]:
+            raise ValueError(f"bandwidth {bandwidth} not supported, expected one of {config.target_bandwidths}")
+
+        self.model = model.eval()
+        self.model_name = model_name or getattr(config, "_name_or_path", "") or "encodec"
+        self.bandwidth = float(bandwidth)
+        self.sample_rate = config.sampling_rate
+        self.codebook_size = config.codebook_size
+        self.hop_length = int(np.prod(config.upsampling_ratios))
+        self.frame_samples = max(int(round(frame_seconds * self.sample_rate / self.hop_length)), 1) * self.hop_length
+        self.max_batch = max_batch
+
+    def _frames(self, y: np.ndarray) -> np.ndarray:
+        """(n, frame_samples) float32, zero-padded at the end"""
+        y = np.asarray(y, dtype=np.float32).reshape(-1)
+        n = math.ceil(len(y) / self.frame_samples)
+        frames = np.zeros((n, self.frame_samples), dtype=np.float32)
+        frames.reshape(-1)[:len(y)] = y
+        return frames
+
+    def encode(self, y: np.ndarray) -> np.ndarray:
+        return self.encode_batch([y])[0]
+
+    def encode_batch(self, signals: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """codes for each signal (mono, at sample_rate), sharing forward passes between them"""
+        frames = [self._frames(y) for y in signals]
+        stacked = np.concatenate(frames) if frames else np.zeros((0, self.frame_samples), dtype=np.float32)
+
+        codes = []
+        with torch.inference_mode():
+            for start in range(0, len(stacked), self.max_batch):
+                batch = torch.from_numpy(stacked[start:start + self.max_batch]).unsqueeze(1)  # (B, 1, T)
+                encoded = self.model.encode(batch, bandwidth=self.bandwidth)
+                codes.append(encoded.audio_codes[0].cpu().numpy())  # (B, codebooks, frame codes)
+        codes = np.concatenate(codes) if codes else np.zeros((0, 0, 0), dtype=np.int64)
+
+        results = []
+        position = 0
+        for y, signal_frames in zip(signals, frames):
+            own = codes[position:position + len(signal_frames)]
+            position += len(signal_frames)
+            # (n, codebooks, f) -> (codebooks, n * f), then drop the padding's codes
+            joined = own.transpose(1, 0, 2).reshape(codes.shape[1], len(own) * codes.shape[2])
+            results.append(joined[:, :math.ceil(len(y) / self.hop_length)].astype(np.int64))
+        return results
+
+
+# ---------------------------------------------------------------------------
+# process-wide cache - weights are loaded once per model name, encoders are
+# cheap wrappers per (model, bandwidth)
+
+_models: Dict[str, object] = {}
+_encoders: Dict[Tuple[str, float], NeuralEncoder] = {}
+_lock = threading.Lock()
+
+
+def _from_pretrained(model_name: str):
+    return transformers.EncodecModel.from_pretrained(model_name)
+
+
+def get_encoder(model_name: str = DEFAULT_MODEL, bandwidth: float = DEFAULT_BANDWIDTH,
+                loader: Optional[Callable[[str], object]] = None) -> NeuralEncoder:
+    """the shared encoder for model_name at bandwidth, loading the model on first use
+
+    safe to call from many threads at once: the model is loaded exactly once.
+    `loader` builds the model from its name (default: EncodecModel.from_pretrained).
+    """
+    if not NEURAL_CODECS_AVAILABLE:
+        raise ImportError("Neural codecs not available. Install torch and transformers.")
+
+    key = (model_name, float(bandwidth))
+    encoder = _encoders.get(key)
+    if encoder is not None:
+        return encoder
+
+    with _lock:
+        encoder = _encoders.get(key)
+        if encoder is None:
+            model = _models.get(model_name)
+            if model is None:
+                logger.info(f"Loading neural codec {model_name}")
+                model = _models[model_name] = (loader or _from_pretrained)(model_name)
+            encoder = _encoders[key] = NeuralEncoder(model, bandwidth, model_name=model_name)
+    return encoder
+
+
+def clear_cache():
+    """forget every loaded model (mainly for tests)"""
+    with _lock:
+        _models.clear()
+        _encoders.clear()
@@ -0,0 +1,60 @@
+# packed storage for neural codec tokens
+# (codebooks, frames) codes are written as one little-endian bitstream, codebook
+# after codebook, `bits` bits per code (10 for EnCodec's 1024-entry codebooks),
+# optionally deflated. Packing and unpacking are pure NumPy - no per-token
+# Python work - and numpy is all it needs, so the decoder can use it too.
+
+import zlib
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+PACKED = "packed"
+PACKED_ZLIB = "packed_zlib"
+PACKED_ENCODINGS = (PACKED, PACKED_ZLIB)
+
+
+def bits_for(codebook_size: Optional[int]) -> Optional[int]:
+    """bits per code for a codebook of this size (None if unknown)"""
+    return max(int(codebook_size - 1).bit_length(), 1) if codebook_size else None
+
+
+def pack_codes(codes, bits: Optional[int] = None, compress: bool = False) -> Tuple[bytes, Dict]:
+    """(packed bytes, layout fields) for a (codebooks, frames) array of non-negative ints
+
+    raises ValueError for anything else (flat lists, negative or non-integer
+    tokens), which callers take as "keep it as JSON".
+    """
+    codes = np.asarray(codes)
+    if codes.ndim != 2 or codes.dtype.kind not in "iu":
+        raise ValueError("packed tokens have to be a (codebooks, frames) integer array")
+    if codes.size and codes.min() < 0:
+        raise ValueError("packed tokens have to be non-negative")
+    largest = int(codes.max()) if codes.size else 0
+    bits = bits or max(largest.bit_length(), 1)
+    if largest >> bits:
+        raise ValueError(f"token {largest} doesn't fit in {bits} bits")
+
+    flat = codes.astype(np.uint32).reshape(-1)
+    planes = ((flat[:, np.newaxis] >> np.arange(bits, dtype=np.uint32)) & 1).astype(np.uint8)
+    data = np.packbits(planes.reshape(-1), bitorder="little").tobytes()
+    if compress:
+        data = zlib.compress(data, 9)
+    return data, {
+        "encoding": PACKED_ZLIB if compress else PACKED,
+        "bits": bits,
+        "codebooks": codes.shape[0],
+        "frames": codes.shape[1],
+    }
+
+
+def unpack_codes(data, bits: int, codebooks: int, frames: int, encoding: str = PACKED) -> np.ndarray:
+    """the (codebooks, frames) int64 array back from pack_codes' bytes (any bytes-like)"""
+    if encoding == PACKED_ZLIB:
+        data = zlib.decompress(data)
+    elif encoding != PACKED:
+        raise ValueError(f"unknown token encoding {encoding!r}")
+    count = codebooks * frames
+    planes = np.unpackbits(np.frombuffer(data, dtype=np.uint8), count=count * bits, bitorder="little")
+    weights = np.left_shift(1, np.arange(bits, dtype=np.int64))
+    return (planes.reshape(count, bits) @ weights).reshape(codebooks, frames)
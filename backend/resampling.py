@@ -0,0 +1,145 @@
+# resampling for the ChordCraft codec - one place to pick speed vs quality
+# every tier passes audio straight through when the rates already match, so the
+# common 44.1 kHz upload never touches a filter.
+#
+#   poly      scipy.signal.resample_poly (Kaiser-windowed polyphase FIR) - slower
+#             than soxr_hq at every rate in benchmark_resample.py (2-3x, far
+#             worse for 48 -> 44.1 kHz's 147/160 ratio) and a weaker filter
+#   soxr_hq   libsoxr HQ, what librosa.load uses by default - fastest, the codec default
+#   soxr_vhq  libsoxr VHQ - steeper filter, slower, for archival encodes
+
+import math
+from typing import Optional
+
+import numpy as np
+
+from lazy_imports import LazyModule
+
+# scipy.signal takes most of a second to import and only the poly tier needs
+# it; soxr is only touched by the soxr tiers
+signal = LazyModule("scipy.signal")
+soxr = LazyModule("soxr")
+
+RESAMPLERS = ("poly", "soxr_hq", "soxr_vhq")
+DEFAULT_RESAMPLER = "soxr_hq"
+
+_SOXR_QUALITY = {"soxr_hq": "HQ", "soxr_vhq": "VHQ"}
+
+
+def validate_resampler(quality: str):
+    if quality not in RESAMPLERS:
+        raise ValueError(f"unknown resampler {quality!r}, expected one of {RESAMPLERS}")
+
+
+def output_length(frames: int, orig_sr: int, target_sr: int) -> int:
+    """frames after resampling - same rounding as librosa.resample"""
+    return int(math.ceil(frames * target_sr / orig_sr))
+
+
+def resample(y: np.ndarray, orig_sr: int, target_sr: int, quality: str = DEFAULT_RESAMPLER,
+             axis: int = -1) -> np.ndarray:
+    """resample a whole signal along `axis` (the time axis)"""
+    validate_resampler(quality)
+    if orig_sr == target_sr:
+        return y
+    n_out = output_length(y.shape[axis], orig_sr, target_sr)
+    if quality == "poly":
+        g = math.gcd(orig_sr, target_sr)
+        y_hat = signal.resample_poly(y, target_sr // g, orig_sr // g, axis=axis)
+    else:
+        # soxr wants time on axis 0, one channel at a time (as librosa calls it)
+        moved = np.moveaxis(y, axis, 0)
+        flat = moved.reshape(moved.shape[0], -1)
+        out = np.stack([soxr.resample(flat[:, c], orig_sr, target_sr, quality=_SOXR_QUALITY[quality])
+                        for c in range(flat.shape[1])], axis=1)
+        y_hat = np.moveaxis(out.reshape((out.shape[0],) + moved.shape[1:]), 0, axis)
+
+    # pad/trim to ceil(n * ratio) like librosa's fix=True
+    length = y_hat.shape[axis]
+    if length > n_out:
+        y_hat = np.take(y_hat, np.arange(n_out), axis=axis)
+    elif length < n_out:
+        pad = [(0, 0)] * y_hat.ndim
+        pad[axis] = (0, n_out - length)
+        y_hat = np.pad(y_hat, pad)
+    return np.ascontiguousarray(y_hat, dtype=y.dtype)
+
+
+def stream_resampler(orig_sr: int, target_sr: int, channels: int,
+                     quality: str = DEFAULT_RESAMPLER) -> Optional[object]:
+    """incremental resampler over (frames, channels) float32 blocks, or None when the rates match
+
+    the returned object has resample_chunk(block, last=False), like soxr.ResampleStream.
+    """
+    validate_resampler(quality)
+    if orig_sr == target_sr:
+        return None
+    if quality == "poly":
+        return PolyphaseStream(orig_sr, target_sr, channels)
+    return soxr.ResampleStream(orig_sr, target_sr, channels, dtype="float32",
+                               quality=_SOXR_QUALITY[quality])
+
+
+class PolyphaseStream:
+    """scipy.signal.resample_poly fed block by block
+
+    same filter and alignment as resample_poly, so the concatenated output
+    matches resampling the whole signal at once (to float rounding). Only a
+    filter's worth of input is held between blocks.
+    """
+
+    def __init__(self, orig_sr: int, target_sr: int, channels: int, dtype=np.float32):
+        g = math.gcd(orig_sr, target_sr)
+        self.up, self.down = target_sr // g, orig_sr // g
+        max_rate = max(self.up, self.down)
+        half_len = 10 * max_rate
+        h = signal.firwin(2 * half_len + 1, 1.0 / max_rate, window=("kaiser", 5.0)).astype(dtype)
+        h *= self.up
+        n_pre_pad = self.down - half_len % self.down
+        self.h = np.concatenate([np.zeros(n_pre_pad, dtype=dtype), h])
+        self.skip = (half_len + n_pre_pad) // self.down  # leading outputs resample_poly drops
+
+        self.dtype = dtype
+        self.buf = np.zeros((0, channels), dtype=dtype)
+        self.buf_start = 0   # input index of buf[0]
+        self.n_in = 0        # input frames seen so far
+        self.next_out = 0    # next upfirdn output index to produce
+
+    def _first_input(self, m: int) -> int:
+        """earliest input frame that output m depends on"""
+        return -(-(m * self.down - len(self.h) + 1) // self.up)
+
+    def resample_chunk(self, block: np.ndarray, last: bool = False) -> np.ndarray:
+        block = np.asarray(block, dtype=self.dtype)
+        if len(block):
+            self.buf = np.concatenate([self.buf, block])
+            self.n_in += len(block)
+
+        if last:
+            stop = self.skip + output_length(self.n_in, self.down, self.up)
+        else:
+            # outputs whose newest input has already arrived
+            stop = (self.n_in * self.up - 1) // self.down + 1 if self.n_in else 0
+        start = self.next_out
+        if stop <= start:
+            return np.zeros((0, self.buf.shape[1]), dtype=self.dtype)
+
+        # upfirdn over the buffered input; it zero-pads beyond the end, which is
+        # what resample_poly does past the last sample too
+        seg = self.buf
+        need = (stop - 1) * self.down // self.up + 1 - self.buf_start
+        if need > len(seg):
+            seg = np.concatenate([seg, np.zeros((need - len(seg), seg.shape[1]), dtype=self.dtype)])
+        offset = self.buf_start * self.up // self.down  # buf_start is kept a multiple of down
+        y = signal.upfirdn(self.h, seg, self.up, self.down, axis=0)[start - offset:stop - offset]
+        self.next_out = stop
+
+        # drop input no later output needs, keeping buf_start a multiple of down
+        keep_from = max(self._first_input(stop), 0) // self.down * self.down
+        if keep_from > self.buf_start:
+            self.buf = self.buf[keep_from - self.buf_start:]
+            self.buf_start = keep_from
+
+        # the first `skip` outputs only exist to centre the filter
+        drop = max(self.skip - start, 0)
+        return np.ascontiguousarray(y[drop:], dtype=self.dtype)
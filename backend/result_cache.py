@@ -0,0 +1,276 @@
+"""
+Content-addressed result cache for ChordCraft
+Maps (upload sha256 + codec parameters) to the finished ChordCraft code so
+repeat uploads of the same audio skip decode/resample/FLAC entirely
+"""
+
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+HASH_BLOCK = 1 << 20  # read size when hashing a stream that wasn't hashed on arrival
+
+
+class HashingBytesIO(io.BytesIO):
+    """BytesIO that hashes everything written to it - lets us hash an upload while it is received"""
+
+    def __init__(self):
+        super().__init__()
+        self._sha = hashlib.sha256()
+
+    def write(self, data) -> int:
+        self._sha.update(data)
+        return super().write(data)
+
+    def hexdigest(self) -> str:
+        return self._sha.hexdigest()
+
+
+def hash_stream(stream) -> str:
+    """sha256 of a whole upload stream (rewound afterwards)"""
+    if isinstance(stream, HashingBytesIO):
+        return stream.hexdigest()
+
+    sha = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        block = stream.read(HASH_BLOCK)
+        if not block:
+            break
+        sha.update(block)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def cache_key(content_sha256: str, **params) -> str:
+    """combine the upload hash with every parameter that changes the output"""
+    material = json.dumps({"content": content_sha256, **params}, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CacheWriter:
+    """collects a result piece by piece and stores it on commit()"""
+
+    def __init__(self, cache: "ResultCache", key: str):
+        self.cache = cache
+        self.key = key
+        self._pieces: List[str] = []
+
+    def write(self, piece: str):
+        self._pieces.append(piece)
+
+    def commit(self):
+        self.cache.put(self.key, "".join(self._pieces))
+        self._pieces = []
+
+    def discard(self):
+        self._pieces = []
+
+
+class ResultCache:
+    """base class - subclasses implement _load/_store, this keeps the counters"""
+
+    backend = "none"
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._load(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key: str, value: str):
+        self._store(key, value)
+
+    def writer(self, key: str) -> CacheWriter:
+        """incremental writer for results that are being streamed out"""
+        return CacheWriter(self, key)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _load(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _store(self, key: str, value: str):
+        raise NotImplementedError
+
+
+class MemoryCache(ResultCache):
+    """in-process LRU capped by total bytes of cached code"""
+
+    backend = "memory"
+
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._size = 0
+
+    def _load(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key: str, value: str):
+        size = len(value)
+        if size > self.max_bytes:
+            return  # would evict everything and still not fit
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        with self._lock:
+            stats.update(entries=len(self._entries), bytes=self._size)
+        return stats
+
+
+class DiskCacheWriter(CacheWriter):
+    """streams a result into a temp file in the cache dir and renames it into place on commit"""
+
+    def __init__(self, cache: "DiskCache", key: str):
+        super().__init__(cache, key)
+        fd, self._tmp_path = tempfile.mkstemp(dir=cache.directory, suffix=".part")
+        self._fh = os.fdopen(fd, "w", encoding="ascii")
+
+    def write(self, piece: str):
+        self._fh.write(piece)
+
+    def commit(self):
+        self._fh.close()
+        self.cache._adopt(self.key, self._tmp_path)
+
+    def discard(self):
+        self._fh.close()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+class DiskCache(ResultCache):
+    """directory of <key>.cc files, LRU-evicted by access time once over max_bytes
+
+    file mtimes are bumped on every hit so they double as the LRU order, which
+    means several worker processes can share one directory.
+    """
+
+    backend = "disk"
+
+    def __init__(self, directory: str, max_bytes: int = 10 * 1024 * 1024 * 1024):
+        super().__init__(max_bytes)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.cc")
+
+    def _load(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="ascii") as fh:
+                value = fh.read()
+            os.utime(path)  # mark as recently used
+            return value
+        except FileNotFoundError:
+            return None
+
+    def _store(self, key: str, value: str):
+        writer = self.writer(key)
+        try:
+            writer.write(value)
+            writer.commit()
+        except Exception:
+            writer.discard()
+            raise
+
+    def writer(self, key: str) -> CacheWriter:
+        return DiskCacheWriter(self, key)
+
+    def _adopt(self, key: str, tmp_path: str):
+        if os.path.getsize(tmp_path) > self.max_bytes:
+            os.unlink(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        self._evict()
+
+    def _scan(self) -> List[os.DirEntry]:
+        return [e for e in os.scandir(self.directory) if e.name.endswith(".cc")]
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in self._scan():
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue  # another worker evicted it first
+                entries.append((st.st_mtime, st.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        sizes = []
+        for entry in self._scan():
+            try:
+                sizes.append(entry.stat().st_size)
+            except FileNotFoundError:
+                pass
+        stats.update(entries=len(sizes), bytes=sum(sizes), directory=self.directory)
+        return stats
+
+
+def create_cache(backend: str, directory: Optional[str] = None,
+                 max_bytes: Optional[int] = None) -> Optional[ResultCache]:
+    """build a cache from config values - "memory", "disk" or "off"/"none" """
+    backend = (backend or "off").lower()
+    if backend in ("off", "none", ""):
+        return None
+    if backend == "memory":
+        return MemoryCache(max_bytes) if max_bytes else MemoryCache()
+    if backend == "disk":
+        directory = directory or os.path.join(tempfile.gettempdir(), "chordcraft-cache")
+        return DiskCache(directory, max_bytes) if max_bytes else DiskCache(directory)
+    raise ValueError(f"Unknown result cache backend: {backend}")
+
+
+def iter_pieces(value: str, size: int = 65536) -> Iterable[str]:
+    """slice a cached result into pieces for a streamed response"""
+    for start in range(0, len(value), size):
+        yield value[start:start + size]
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the persistent filter-bank / numba cache
+"""
+
+import os
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+
+import analysis_cache
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+# fresh interpreter - librosa only picks the cache up if it's configured first
+SCRIPT = """
+import numpy as np
+import muzic_integration, librosa
+y = np.random.default_rng(0).standard_normal(22050 * 2).astype(np.float32)
+C = np.abs(librosa.cqt(y, sr=22050, hop_length=512, n_bins=7 * 36, bins_per_octave=36))
+peaks = np.flatnonzero(librosa.util.localmax(C.sum(axis=0)))
+print(float(C.sum()), len(peaks))
+"""
+
+
+def run(cache_dir):
+    env = dict(os.environ, CHORDCRAFT_ANALYSIS_CACHE_DIR=str(cache_dir))
+    for name in ("LIBROSA_CACHE_DIR", "LIBROSA_CACHE_MMAP", "LIBROSA_CACHE_LEVEL", "NUMBA_CACHE_DIR"):
+        env.pop(name, None)
+    done = subprocess.run([sys.executable, "-c", SCRIPT], cwd=BACKEND, env=env,
+                          capture_output=True, text=True, check=True)
+    return done.stdout.strip().splitlines()[-1]
+
+
+def test_caches_persist_across_processes(tmp_path):
+    first = run(tmp_path)
+    root = tmp_path / analysis_cache.version_key()
+    assert "librosa-" in root.name and "numba-" in root.name
+    files = [p.name for p in root.rglob("*") if p.is_file()]
+    assert any(name.endswith(".nbi") for name in files)  # numba index
+    assert any(name == "output.pkl" for name in files)  # joblib'd filter bank
+    assert run(tmp_path) == first  # loaded from disk, same result
+
+
+def test_off_leaves_environment_alone(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "_configured", None)
+    monkeypatch.delenv("NUMBA_CACHE_DIR", raising=False)
+    assert analysis_cache.configure("off") is None
+    assert "NUMBA_CACHE_DIR" not in os.environ
+    assert analysis_cache.configure("/should/not/be/used") is None  # first call wins
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Behaviour tests for the analysis stages on small synthetic signals
+"""
+
+import io
+import json
+import os
+import sys
+from multiprocessing import shared_memory
+
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+import muzic_integration
+from muzic_integration import AnalysisFeatures, MuzicEnhancedAnalyzer
+
+SR = 22050
+
+
+def wav(y, sr=SR):
+    buf = io.BytesIO()
+    sf.write(buf, np.asarray(y, dtype=np.float32), sr, format="WAV")
+    buf.seek(0)
+    return buf
+
+
+def tone(freq, seconds, sr=SR, amplitude=0.3):
+    t = np.arange(int(seconds * sr)) / sr
+    return amplitude * np.sin(2 * np.pi * freq * t)
+
+
+def plucks(freq, seconds=2.0, notes=4, sr=SR, harmonics=4):
+    """the same harmonic note plucked `notes` times - decaying, so every pluck is an onset"""
+    y = np.zeros(int(seconds * sr))
+    step = len(y) // notes
+    local = np.arange(step) / sr
+    note = sum(np.sin(2 * np.pi * freq * h * local) / h for h in range(1, harmonics + 1)) * np.exp(-local * 3)
+    for i in range(notes):
+        y[i * step:(i + 1) * step] = note
+    return (0.3 * y / np.abs(y).max()).astype(np.float32)
+
+
+def features_for(analyzer, y, sr=SR):
+    return AnalysisFeatures(np.asarray(y, dtype=np.float32), sr, hop_length=analyzer.hop_length,
+                            n_fft=analyzer.frame_size)
+
+
+def arpeggio(seconds=3.0, sr=SR):
+    """C major arpeggio with a click on every note - beats, onsets, pitches and a chord"""
+    notes = [261.63, 329.63, 392.00, 523.25]
+    y = np.zeros(int(seconds * sr))
+    step = int(seconds * sr / 8)
+    for i in range(8):
+        local = np.arange(len(y) - i * step) / sr
+        y[i * step:] += np.exp(-local * 4) * np.sin(2 * np.pi * notes[i % 4] * local)
+        y[i * step:i * step + 64] += 0.5
+    return 0.3 * y / np.abs(y).max()
+
+
+def record_shared_blocks(monkeypatch):
+    """names of the shared memory blocks the analyzer creates from now on"""
+    names = []
+    share = muzic_integration._share_arrays
+
+    def recording(arrays):
+        specs, blocks = share(arrays)
+        names.extend(block.name for block in blocks)
+        return specs, blocks
+
+    monkeypatch.setattr(muzic_integration, "_share_arrays", recording)
+    return names
+
+
+def assert_unlinked(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+@pytest.fixture(scope="module")
+def analyzer():
+    analyzer = MuzicEnhancedAnalyzer()
+    yield analyzer
+    analyzer.close()
+
+
+def test_silence_is_one_section(analyzer):
+    y = np.zeros(3 * SR, dtype=np.float32)
+    features = AnalysisFeatures(y, SR, hop_length=analyzer.hop_length, n_fft=analyzer.frame_size)
+    assert features.beat_chroma.shape[1] == 1
+    structure = analyzer._analyze_structure(features)
+    assert structure["sections"] == 1 and structure["section_labels"] == ["A"]
+    assert structure["boundaries"] == [0.0, pytest.approx(3.0, abs=0.05)]
+
+    results = analyzer.analyze_audio_enhanced(wav(y))
+    assert results["analysis_type"] == "muzic_enhanced"
+    assert results["musical_features"]["sections"] == 1
+
+
+@pytest.mark.parametrize("y", [tone(440, 0.4), np.zeros(SR // 3)], ids=["tone", "silence"])
+def test_sub_second_clips_analyze(analyzer, y):
+    features = AnalysisFeatures(y.astype(np.float32), SR, hop_length=analyzer.hop_length, n_fft=analyzer.frame_size)
+    structure = analyzer._analyze_structure(features)
+    assert structure["section_labels"] and structure["sections"] >= 1
+    assert all(0 <= t <= len(y) / SR + 0.05 for t in structure["boundaries"])
+
+    assert analyzer.analyze_audio_enhanced(wav(y))["analysis_type"] == "muzic_enhanced"
+
+
+def test_process_pool_matches_in_process(analyzer, monkeypatch):
+    y = arpeggio()
+    names = record_shared_blocks(monkeypatch)
+    with MuzicEnhancedAnalyzer(workers=2) as pooled:
+        fanned_out = pooled.analyze_audio_enhanced(wav(y))
+    assert fanned_out["analysis_type"] == "muzic_enhanced"
+    assert json.dumps(fanned_out, sort_keys=True) == json.dumps(analyzer.analyze_audio_enhanced(wav(y)), sort_keys=True)
+    assert_unlinked(names)
+
+
+def test_shared_memory_is_released_early(monkeypatch):
+    names = record_shared_blocks(monkeypatch)
+    with MuzicEnhancedAnalyzer(workers=2) as pooled:
+        # consumer stops after the first event
+        events = pooled.iter_analysis(wav(arpeggio()))
+        assert next(events)[0] == "tempo"
+        events.close()
+        assert_unlinked(names)
+
+        # every stage fails in its worker (the worker can't build its analyzer)
+        names.clear()
+        monkeypatch.setattr(pooled, "_stage_settings", lambda: {"structure_segments": 0})
+        with pytest.raises(ValueError, match="structure_segments"):
+            list(pooled.iter_analysis(wav(arpeggio())))
+        assert_unlinked(names)
+
+
+@pytest.mark.parametrize("engine", MuzicEnhancedAnalyzer.PITCH_ENGINES)
+def test_pitch_engines_find_a_known_pitch(engine):
+    analyzer = MuzicEnhancedAnalyzer(pitch_engine=engine)
+    result = analyzer._analyze_pitch_advanced(features_for(analyzer, plucks(220.0)))
+    f0 = np.asarray(result["f0"])
+    assert result["voiced_flag"].any()
+    voiced = f0[result["voiced_flag"]]
+    # nearly every voiced frame within a quarter tone of A3
+    cents_off = np.abs(1200 * np.log2(voiced / 220.0))
+    assert np.mean(cents_off < 50) > 0.9
+    if engine == "onset_pyin":
+        onset_frames = librosa.time_to_frames(result["onset_times"], sr=SR, hop_length=analyzer.hop_length)
+        assert len(onset_frames) >= 3 and result["voiced_flag"][onset_frames].all()
+    assert result["pitch_classes"][0] == "A"
+
+
+def test_note_events(analyzer):
+    hop = 512
+    f0 = np.full(200, np.nan)
+    f0[:100], f0[150:] = 220.0, 440.0
+    onset_frames = np.array([10, 50, 120, 160])  # the one at 120 is unvoiced
+    analysis = {
+        "pitch_analysis": {"onset_times": (onset_frames * hop / SR).tolist(), "f0": f0, "voiced_flag": ~np.isnan(f0)},
+        "tempo_analysis": {"beats": np.arange(0, 5, 0.5).tolist()},
+        "harmonic_analysis": {"chord_progressions": ["C", "G"], "chord_times": [0.0, 2.0]},
+    }
+    events = analyzer._extract_note_events(analysis)
+    assert events["frame"].tolist() == [10, 50, 160]
+    assert events["note"].tolist() == ["A3", "A3", "A4"]
+    assert events["chord"].tolist() == ["C", "C", "G"]
+    # gap to the next onset (voiced or not) snapped to 16ths of the 0.5s beat; the last note gets 0.5s
+    assert events["duration"] == pytest.approx([0.875, 1.625, 0.5])
+    assert analyzer._format_note_events(events)[0] == "PLAY A3 FOR 0.875s AT 0.23s // Chord: C"
+
+
+def chroma_of(*pitch_classes, noise=0.05):
+    """a chroma column with the given pitch classes lit over a little noise"""
+    column = np.full(12, noise)
+    column[list(pitch_classes)] = 1.0
+    return column
+
+
+def test_chord_and_key_templates(analyzer):
+    c_major, g_major, a_minor = chroma_of(0, 4, 7), chroma_of(7, 11, 2), chroma_of(9, 0, 4)
+    g7 = chroma_of(7, 11, 2, 5)
+    chroma = np.stack([c_major, g_major, a_minor, g7], axis=1)
+    assert analyzer._detect_chord_progressions(chroma) == ["C", "G", "Am", "G7"]
+
+    scale = np.zeros(12)
+    scale[[0, 2, 4, 5, 7, 9, 11]] = [1.0, 0.5, 0.8, 0.5, 0.9, 0.5, 0.4]
+    assert analyzer._estimate_key(scale) == "C major"
+    assert analyzer._estimate_key(np.roll(scale, 7)) == "G major"
+    assert analyzer._estimate_key(np.ones(12)) == "C major"  # flat profile
+
+
+def test_viterbi_smoothing_removes_blips():
+    # C for 6 columns with a one-column wobble towards Em in the middle
+    chroma = np.stack([chroma_of(0, 4, 7)] * 3 + [chroma_of(4, 7, 11, noise=0.5)] + [chroma_of(0, 4, 7)] * 3, axis=1)
+    raw = MuzicEnhancedAnalyzer()._detect_chord_progressions(chroma)
+    assert raw == ["C"] * 3 + ["Em"] + ["C"] * 3
+    assert MuzicEnhancedAnalyzer(chord_smoothing=True)._detect_chord_progressions(chroma) == ["C"] * 7
+
+    # a real change survives smoothing
+    change = np.stack([chroma_of(0, 4, 7)] * 4 + [chroma_of(7, 11, 2)] * 4, axis=1)
+    assert MuzicEnhancedAnalyzer(chord_smoothing=True)._detect_chord_progressions(change) == ["C"] * 4 + ["G"] * 4
+
+
+def triads(chords, seconds_each=2.0, bpm=120, sr=SR):
+    """sustained triads (lists of Hz) back to back, with a click on every beat"""
+    n = int(seconds_each * sr)
+    t = np.arange(n) / sr
+    y = np.concatenate([sum(np.sin(2 * np.pi * f * t) for f in chord) for chord in chords])
+    beat = int(60 / bpm * sr)
+    for start in range(0, len(y), beat):
+        y[start:start + 64] += 2.0
+    return (0.3 * y / np.abs(y).max()).astype(np.float32)
+
+
+def test_chords_follow_the_beat_grid(analyzer):
+    features = features_for(analyzer, triads([[261.63, 329.63, 392.00], [196.00, 246.94, 293.66]]))
+    boundaries = features.beat_boundaries
+    assert boundaries[0] == 0 and boundaries[-1] == features.harmonic_chroma.shape[1]
+
+    # one chroma column per beat segment, the median of that segment's frames
+    C = features.beat_chroma
+    assert C.shape == (12, len(boundaries) - 1)
+    first, second = boundaries[1], boundaries[2]
+    assert np.allclose(C[:, 1], np.median(features.harmonic_chroma[:, first:second], axis=1))
+
+    harmony = analyzer._analyze_harmony(features)
+    chords, times = harmony["chord_progressions"], harmony["chord_times"]
+    assert len(chords) == len(times) == C.shape[1]
+    assert times == pytest.approx(librosa.frames_to_time(boundaries[:-1], sr=SR, hop_length=analyzer.hop_length))
+    change = np.searchsorted(times, 2.0)
+    # the beats either side of the change can straddle both chords
+    assert set(chords[1:change - 1]) == {"C"} and set(chords[change + 1:-1]) == {"G"}
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests for the batch runner
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+from batch import BatchRunner, discover
+
+
+def write_tone(path, seconds=1.0, sr=22050):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    t = np.arange(int(seconds * sr)) / sr
+    sf.write(path, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr)
+
+
+def test_discover_directories_and_manifests(tmp_path):
+    write_tone(str(tmp_path / "lib" / "b" / "two.wav"))
+    write_tone(str(tmp_path / "lib" / "a" / "one.flac"))
+    (tmp_path / "lib" / "notes.txt").write_text("not audio")
+    (tmp_path / "list.txt").write_text("# catalogue\nlib/a/one.flac\n\nlib/b/two.wav\n")
+
+    from_dir = discover([str(tmp_path / "lib")])
+    assert [os.path.basename(p) for p in from_dir] == ["one.flac", "two.wav"]
+    assert discover([str(tmp_path / "list.txt"), str(tmp_path / "lib")]) == from_dir
+
+
+def test_resume_skips_finished_files(tmp_path):
+    for name in ("a/one.wav", "b/two.wav"):
+        write_tone(str(tmp_path / "in" / name))
+    (tmp_path / "in" / "b" / "bad.wav").write_bytes(b"RIFFjunk")
+
+    runner = BatchRunner(tasks=["encode"], output_dir=str(tmp_path / "out"), workers=1, target_sr=8000)
+    stats = runner.run([str(tmp_path / "in")])
+    assert (stats["ok"], stats["failed"], stats["skipped"]) == (2, 1, 0)
+    assert stats["audio_seconds"] == 2.0
+    assert (tmp_path / "out" / "a" / "one.cc").read_text().startswith("Song {")
+
+    with open(runner.manifest_path, "a") as fh:
+        fh.write('{"path": "torn')  # interrupted mid-write
+    stats = runner.run([str(tmp_path / "in")])
+    assert (stats["ok"], stats["failed"], stats["skipped"]) == (0, 1, 2)
+
+    with open(runner.manifest_path) as fh:
+        statuses = [json.loads(line)["status"] for line in fh if line.startswith('{"path": "/')]
+    assert statuses.count("ok") == 2
+
+
+def test_runners_keep_their_own_settings(tmp_path):
+    write_tone(str(tmp_path / "in" / "one.wav"))
+    for sr, stereo in ((8000, True), (16000, False)):
+        out = tmp_path / f"out{sr}"
+        stats = BatchRunner(tasks=["encode"], output_dir=str(out), workers=1,
+                            target_sr=sr, stereo=stereo).run([str(tmp_path / "in")])
+        assert stats["ok"] == 1
+        code = (out / "one.cc").read_text()
+        assert f"sr: {sr}, channels: {2 if stereo else 1}" in code
+
+    # same output dir, different settings - not "done" yet
+    out = str(tmp_path / "out8000")
+    assert BatchRunner(tasks=["encode"], output_dir=out, workers=1, target_sr=8000).run(
+        [str(tmp_path / "in")])["skipped"] == 1
+    stats = BatchRunner(tasks=["encode"], output_dir=out, workers=1, target_sr=16000).run([str(tmp_path / "in")])
+    assert (stats["ok"], stats["skipped"]) == (1, 0)
+
+
+def test_process_pool_workers(tmp_path):
+    for i in range(3):
+        write_tone(str(tmp_path / "in" / f"{i}.wav"), seconds=0.5 + 0.25 * i)
+    (tmp_path / "in" / "bad.wav").write_bytes(b"RIFFjunk")
+
+    stats = BatchRunner(tasks=["encode"], jsonl_path=str(tmp_path / "results.jsonl"), workers=2,
+                        target_sr=8000).run([str(tmp_path / "in")])
+    assert (stats["ok"], stats["failed"]) == (3, 1)
+    with open(tmp_path / "results.jsonl") as fh:
+        records = {os.path.basename(r["path"]): r for r in map(json.loads, fh)}
+    assert records["bad.wav"]["status"] == "failed"
+    for i in range(3):
+        record = records[f"{i}.wav"]
+        assert record["status"] == "ok" and record["audio_seconds"] == pytest.approx(0.5 + 0.25 * i, abs=1e-3)
+        assert record["outputs"]["code"].startswith("Song {") and "sr: 8000" in record["outputs"]["code"]
+
+
+def test_neural_needs_the_neural_codec(tmp_path, monkeypatch):
+    import neural_codec
+
+    monkeypatch.setattr(neural_codec, "NEURAL_CODECS_ENABLED", False)
+    with pytest.raises(ValueError, match="CHORDCRAFT_ENABLE_NEURAL"):
+        BatchRunner(tasks=["encode"], output_dir=str(tmp_path), neural=True)
+    monkeypatch.setattr(neural_codec, "NEURAL_CODECS_AVAILABLE", False)
+    with pytest.raises(ValueError, match="torch and transformers"):
+        BatchRunner(tasks=["encode"], output_dir=str(tmp_path), neural=True)
+    # analysis alone never looks at neural tokens
+    BatchRunner(tasks=["analysis"], output_dir=str(tmp_path), neural=True)
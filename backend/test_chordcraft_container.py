@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for the binary ChordCraft container
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+from chordcraft_container import ChordCraftContainer, ContainerError, convert_file, text_to_container
+from test_chordcraft_decoder import make_code
+
+
+def to_container(code):
+    buf = io.BytesIO()
+    text_to_container(code, buf)
+    return buf.getvalue()
+
+
+def test_text_round_trip_is_exact(tmp_path):
+    code, flac = make_code(seconds=5.0)
+    neural = code[:-2] + ('\n\n  neural: {\n    format: "neural_codec", model: "facebook/encodec_24khz",\n'
+                          '    tokens: 3, compression_ratio: 33.33\n  }\n\n<<NEURAL_TOKENS>>\n[7, -1, 1023]\n}')
+    hand_edited = code.replace('key: "A minor"', "key: Am")
+    segmented, _ = make_code(seconds=5.0, workers=2, segment_seconds=2.0)
+
+    for text in (code, neural, hand_edited, segmented):
+        container = ChordCraftContainer(to_container(text))
+        assert container.to_text() == text
+        assert container.verify()
+        assert container.meta["bpm"] == 96
+    assert ChordCraftContainer(to_container(code)).flac == flac
+    assert len(ChordCraftContainer(to_container(segmented)).segments) == 3
+
+    container = ChordCraftContainer(to_container(neural))
+    assert container.neural_tokens.tolist() == [7, -1, 1023]
+    assert "HEAD" not in container.sections and "TAIL" not in container.sections
+    assert len(to_container(code)) < 0.8 * len(code)
+
+    src, binary, back = tmp_path / "song.cc", tmp_path / "song.ccb", tmp_path / "back.cc"
+    src.write_text(neural)
+    convert_file(str(src), str(binary))
+    convert_file(str(binary), str(back))
+    assert back.read_text() == neural
+
+
+def test_payload_is_zero_copy_and_checked(tmp_path):
+    code, flac = make_code(seconds=8.0)
+    path = tmp_path / "song.ccb"
+    path.write_bytes(to_container(code))
+
+    with ChordCraftContainer.open(str(path)) as container:
+        assert container.flac.obj is container._mmap
+        assert container.flac_offset % 8 == 0
+        assert path.read_bytes()[container.flac_offset:][:container.flac_length] == flac
+        full, sr = sf.read(io.BytesIO(flac), dtype="int16", always_2d=True)
+        assert np.array_equal(container.read(2.0, 3.0, dtype="int16"), full[2 * sr:3 * sr])
+        assert container.verify()
+
+    data = bytearray(path.read_bytes())
+    data[ChordCraftContainer(bytes(data)).flac_offset + 100] ^= 0xFF
+    assert not ChordCraftContainer(bytes(data)).verify()
+    with pytest.raises(ContainerError):
+        ChordCraftContainer(bytes(data[:len(data) // 2]))
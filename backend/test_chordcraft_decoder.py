@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for the ChordCraft v2 decoder
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+from audio_codec import ChordCraftCodec
+from chordcraft_decoder import ChecksumMismatch, ChordCraftDecodeError, ChordCraftDocument
+
+
+def make_code(seconds=3.0, sr=8000, chunk_size=256, **codec_options):
+    t = np.arange(int(seconds * sr)) / sr
+    y = np.stack([0.3 * np.sin(2 * np.pi * 440 * t), 0.2 * np.sin(2 * np.pi * 220 * t)], axis=1)
+    wav = io.BytesIO()
+    sf.write(wav, y.astype(np.float32), sr, format="WAV", subtype="PCM_16")
+    codec = ChordCraftCodec(target_sr=sr, **codec_options)
+    codec.chunk_size = chunk_size
+    flac, _ = codec.encode_lossless(wav.getvalue())
+    code = codec.create_chordcraft_code(wav.getvalue(), bpm=96, key="A minor", version="cc-v2.1")
+    return code, flac
+
+
+def test_header_and_flac_round_trip():
+    code, flac = make_code()
+    doc = ChordCraftDocument(code)
+    assert doc.meta == {"bpm": 96, "key": "A minor", "time": "4/4", "version": "cc-v2.1"}
+    assert doc.chords == "| N | N | N | N |"
+    assert (doc.audio["sr"], doc.audio["channels"], doc.audio["chunks"]) == (8000, 2, len(doc.chunks))
+    assert doc.flac_bytes() == flac
+    assert doc.verify()
+
+
+def test_random_access_matches_full_decode(tmp_path):
+    code, flac = make_code(seconds=20.0)
+    full, sr = sf.read(io.BytesIO(flac), dtype="int16", always_2d=True)
+    path = tmp_path / "song.cc"
+    path.write_text(code)
+
+    with ChordCraftDocument.open(str(path)) as doc:
+        assert np.array_equal(doc.read(12.5, 13.0, dtype="int16"), full[int(12.5 * sr):13 * sr])
+        assert np.array_equal(np.concatenate(list(doc.iter_blocks(block_frames=4096, dtype="int16"))), full)
+
+        reader = doc.payload_reader()
+        with sf.SoundFile(reader) as snd:
+            snd.seek(15 * sr)
+            snd.read(100)
+        assert reader.decoded_chunks < len(doc.chunks) / 2
+
+
+def test_corruption_is_detected():
+    code, _ = make_code()
+    doc = ChordCraftDocument(code)
+    start, _ = doc.chunks[2]
+    tampered = code[:start + 8] + ("A" if code[start + 8] != "A" else "B") + code[start + 9:]
+    assert not ChordCraftDocument(tampered).verify()
+    with pytest.raises(ChecksumMismatch):
+        ChordCraftDocument(tampered).flac_bytes()
+
+    missing = code.replace("<<PAYLOAD:FLAC:3>>", "<<PAYLOAD:FLAC:9>>")
+    with pytest.raises(ChordCraftDecodeError):
+        ChordCraftDocument(missing)
+
+
+def test_segmented_code_decodes_like_a_single_flac():
+    code, flac = make_code(seconds=10.0, workers=3, segment_seconds=1.5)
+    full, sr = sf.read(io.BytesIO(flac), dtype="int16", always_2d=True)
+    doc = ChordCraftDocument(code)
+
+    assert doc.segmented and len(doc.segments) == 7
+    assert [info["start"] for info in doc.segments] == [i * 12000 for i in range(7)]
+    assert doc.verify() and doc.duration == 10.0
+    assert np.array_equal(doc.decode(workers=2, dtype="int16"), full)
+    assert np.array_equal(doc.read(1.25, 4.5, dtype="int16"), full[10000:36000])
+    assert np.array_equal(np.concatenate(list(doc.iter_blocks(block_frames=5000, dtype="int16"))), full)
+
+    # dropping the last segment must not pass for a shorter song
+    cut = code[:code.rindex("\n\n  segment: {")] + code[code.rindex("\n\n  audio_end"):]
+    with pytest.raises(ChordCraftDecodeError):
+        ChordCraftDocument(cut)
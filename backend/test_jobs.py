@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tests for the background job queue
+"""
+
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+import jobs
+from jobs import DONE, FAILED, TIMEOUT, JobQueue, QueueFullError
+
+
+# job functions - module level so the spawned workers can import them
+
+def echo(job_id, value):
+    return value
+
+
+def sleepy(job_id, seconds):
+    time.sleep(seconds)
+    return "woke up"
+
+
+def crash(job_id):
+    os._exit(1)
+
+
+def wait_for(job_queue, job_id, timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = job_queue.get(job_id)
+        if job.finished:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} didn't finish")
+
+
+def wav_upload(seconds=1.0, sr=22050):
+    buf = io.BytesIO()
+    t = np.arange(int(seconds * sr)) / sr
+    sf.write(buf, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr, format="WAV")
+    buf.seek(0)
+    return buf
+
+
+def test_queue_full_and_timeout():
+    job_queue = JobQueue(max_workers=1, max_queue_depth=1, job_timeout=0.5)
+    try:
+        job = job_queue.submit("encode", sleepy, 5.0)
+        with pytest.raises(QueueFullError):
+            job_queue.submit("encode", echo, 1)
+        job = wait_for(job_queue, job.id)
+        assert job.status == TIMEOUT and "0.5" in job.error
+        # the slot is free again
+        assert wait_for(job_queue, job_queue.submit("encode", echo, 7).id).result == 7
+    finally:
+        job_queue.shutdown()
+
+
+def test_worker_crash_recovery():
+    job_queue = JobQueue(max_workers=1)
+    try:
+        job = wait_for(job_queue, job_queue.submit("encode", crash).id)
+        assert (job.status, job.error) == (FAILED, "worker_crashed")
+        job = wait_for(job_queue, job_queue.submit("encode", echo, "fine").id)
+        assert (job.status, job.result) == (DONE, "fine")
+    finally:
+        job_queue.shutdown()
+
+
+def test_finished_jobs_expire(tmp_path):
+    job_queue = JobQueue(result_ttl=0.2, state_dir=str(tmp_path))
+    job = job_queue.completed("encode", "code")
+    assert job_queue.get(job.id).result == "code"
+    assert (tmp_path / f"{job.id}.json").exists()
+    time.sleep(0.3)
+    assert job_queue.get(job.id) is None
+    assert not (tmp_path / f"{job.id}.json").exists()
+
+
+def test_state_is_shared_between_processes(tmp_path):
+    # two queues on one state dir stand in for two gunicorn workers
+    owner, other = JobQueue(max_workers=1, state_dir=str(tmp_path)), JobQueue(state_dir=str(tmp_path))
+    try:
+        job = owner.submit("encode", echo, "hello")
+        assert other.get(job.id).status in ("queued", "running", DONE)
+        wait_for(owner, job.id)
+        seen = other.get(job.id)
+        assert (seen.status, seen.result) == (DONE, "hello")
+    finally:
+        owner.shutdown()
+
+    # a job whose owner died before finishing reads as failed
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    job_id = "ab" * 16
+    (tmp_path / f"{job_id}.json").write_text(json.dumps({
+        "job_id": job_id, "kind": "analysis", "status": "running", "stage": "analyzing",
+        "progress": 0.4, "created_at": time.time(), "started_at": time.time(), "finished_at": None,
+        "owner": dead.pid,
+    }))
+    lost = other.get(job_id)
+    assert (lost.status, lost.error) == (FAILED, "worker_lost")
+    assert other.get("../../etc/passwd") is None
+
+
+def test_full_queue_is_rejected_by_the_api(monkeypatch):
+    import app as app_module
+
+    monkeypatch.setattr(app_module, "job_queue", JobQueue(max_queue_depth=0))
+    app_module.limiter.enabled = False
+    try:
+        response = app_module.app.test_client().post(
+            "/analyze?async=1", data={"audio": (wav_upload(), "tone.wav")})
+    finally:
+        app_module.limiter.enabled = True
+    assert response.status_code == 503
+    assert response.get_json()["error"] == "queue_full"
+    assert response.headers["Retry-After"] == "30"
+
+
+def test_analysis_jobs_use_the_configured_pitch_engine(monkeypatch):
+    import app as app_module
+
+    submitted = []
+
+    class Recorder(JobQueue):
+        def submit(self, kind, fn, *args, **kwargs):
+            submitted.append((kind, fn, args))
+            return self.completed(kind, None)
+
+    monkeypatch.setattr(app_module, "job_queue", Recorder())
+    monkeypatch.setitem(app_module.app.config, "PITCH_ENGINE", "hps")
+    app_module.limiter.enabled = False
+    try:
+        response = app_module.app.test_client().post(
+            "/analyze?async=1&kind=analysis", data={"audio": (wav_upload(), "tone.wav")})
+    finally:
+        app_module.limiter.enabled = True
+    assert response.status_code == 202
+    kind, fn, (data, settings) = submitted[0]
+    assert (kind, fn, settings) == ("analysis", jobs.analyze_job, {"pitch_engine": "hps"})
+
+    results = jobs.analyze_job("job", data, settings)
+    assert results["analysis_type"] != "muzic_error"
+    assert jobs._analyzer_cache[(("pitch_engine", "hps"),)].pitch_engine == "hps"
+
+
+def test_analysis_timeout_is_not_swallowed():
+    # in this process first: the alarm lands inside the analyzer's stages, whose
+    # `except Exception` fallbacks used to turn it into default results
+    data = wav_upload(seconds=10.0).getvalue()
+    jobs.analyze_job("warm", wav_upload().getvalue())
+    with pytest.raises(jobs.JobTimeoutError):
+        jobs._run("job", 0.3, jobs.analyze_job, (data,), {})
+
+    job_queue = JobQueue(max_workers=1, job_timeout=1.0)
+    try:
+        job = wait_for(job_queue, job_queue.submit("analysis", jobs.analyze_job, data).id)
+        assert (job.status, job.result) == (TIMEOUT, None)
+        assert job_queue.stats()[TIMEOUT] == 1
+    finally:
+        job_queue.shutdown()
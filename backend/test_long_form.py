@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests for windowed long-form analysis
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+from long_form import LongFormAnalysis
+from muzic_integration import MuzicEnhancedAnalyzer
+
+
+def make_wav(seconds, sr=22050):
+    t = np.arange(int(seconds * sr)) / sr
+    y = 0.3 * np.sin(2 * np.pi * 261.63 * t) * (np.sin(2 * np.pi * 2 * t) > 0)
+    buf = io.BytesIO()
+    sf.write(buf, y.astype(np.float32), sr, format="WAV")
+    return buf.getvalue()
+
+
+def test_windows_cover_the_recording():
+    analysis = LongFormAnalysis(MuzicEnhancedAnalyzer(), make_wav(7.3), window_seconds=2.0, overlap_seconds=0.5)
+    windows = list(analysis._iter_windows())
+
+    assert [is_last for _, _, is_last in windows] == [False] * (len(windows) - 1) + [True]
+    assert all(len(samples) == analysis.window_samples for _, samples, _ in windows[:-1])
+    starts = [start for start, _, _ in windows]
+    assert np.all(np.diff(starts) == analysis.hop_samples)
+    assert starts[-1] + len(windows[-1][1]) == int(7.3 * 22050)
+
+
+def test_checkpoint_resume(tmp_path):
+    analyzer = MuzicEnhancedAnalyzer(pitch_engine="hps")
+    data = make_wav(6.0)
+    checkpoint = str(tmp_path / "run.jsonl")
+
+    first = LongFormAnalysis(analyzer, data, window_seconds=2.5, overlap_seconds=0.5,
+                             checkpoint_path=checkpoint)
+    windows = iter(first)
+    next(windows)
+    next(windows)
+    windows.close()  # simulate the run dying after two windows
+    with open(checkpoint, "a") as fh:
+        fh.write('{"index": 2, "torn')
+
+    resumed = LongFormAnalysis(analyzer, data, window_seconds=2.5, overlap_seconds=0.5,
+                               checkpoint_path=checkpoint)
+    analysed = []
+    original = resumed._analyze_window
+    resumed._analyze_window = lambda index, *args: analysed.append(index) or original(index, *args)
+    result = resumed.result()
+
+    assert analysed and analysed[0] == 2
+    fresh = LongFormAnalysis(analyzer, data, window_seconds=2.5, overlap_seconds=0.5).result()
+    assert result == fresh
+    assert result["long_form"]["windows"] == len(resumed.windows)
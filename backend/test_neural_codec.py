@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the EnCodec neural path, on a tiny randomly initialised model
+"""
+
+import os
+import sys
+import threading
+
+import numpy as np
+import soundfile as sf
+import torch
+import transformers
+
+sys.path.append(os.path.dirname(__file__))
+
+import neural_codec
+from neural_codec import DEFAULT_BANDWIDTH, DEFAULT_MODEL, NeuralEncoder, get_encoder
+
+
+def tiny_model():
+    torch.manual_seed(0)
+    config = transformers.EncodecConfig(
+        num_filters=2, hidden_size=8, num_lstm_layers=1,
+        target_bandwidths=[1.5, 3.0, DEFAULT_BANDWIDTH], sampling_rate=24000,
+    )
+    return transformers.EncodecModel(config)
+
+
+def test_model_is_loaded_once_across_threads():
+    neural_codec.clear_cache()
+    loads = []
+
+    def loader(name):
+        loads.append(name)
+        return tiny_model()
+
+    encoders = []
+    threads = [threading.Thread(target=lambda: encoders.append(get_encoder("tiny", 1.5, loader=loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == ["tiny"]
+    assert all(encoder is encoders[0] for encoder in encoders)
+    assert get_encoder("tiny", 3.0, loader=loader).model is encoders[0].model
+    assert loads == ["tiny"]
+    neural_codec.clear_cache()
+
+
+def test_batched_encode_matches_one_at_a_time():
+    encoder = NeuralEncoder(tiny_model(), bandwidth=1.5, frame_seconds=0.5, max_batch=3)
+    rng = np.random.default_rng(0)
+    signals = [0.1 * rng.standard_normal(n).astype(np.float32) for n in (24000, 7001, 30000)]
+
+    batched = encoder.encode_batch(signals)
+    for y, codes in zip(signals, batched):
+        assert codes.shape[1] == -(-len(y) // encoder.hop_length)
+        assert np.array_equal(codes, encoder.encode(y))
+        assert codes.min() >= 0 and codes.max() < encoder.model.config.codebook_size
+
+
+def test_encode_decode_round_trip(monkeypatch):
+    import audio_codec
+    from chordcraft_decoder import ChordCraftDocument
+    from test_chordcraft_decoder import make_code
+
+    neural_codec.clear_cache()
+    encoder = get_encoder("tiny", 1.5, loader=lambda name: tiny_model())
+    t = np.arange(24000 + 777) / 24000
+    y = (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+    codes = encoder.encode(y)
+    with torch.inference_mode():
+        direct = encoder.model.encode(torch.from_numpy(y)[None, None], bandwidth=1.5).audio_codes
+        audio = encoder.model.decode(torch.from_numpy(codes)[None, None], [None]).audio_values
+    assert codes.shape == (direct.shape[2], -(-len(y) // encoder.hop_length))
+    assert audio.shape[-1] == codes.shape[1] * encoder.hop_length
+    assert np.isfinite(audio.numpy()).all()
+
+    # through the codec and back out of a ChordCraft code
+    monkeypatch.setattr(audio_codec, "NEURAL_CODECS_ENABLED", True)
+    codec = audio_codec.ChordCraftCodec(target_sr=8000)
+    tokens, meta = codec.encode_neural(make_code(seconds=1.0)[1], model_name="tiny", bandwidth=1.5)
+    tokens = np.asarray(tokens)
+    assert tokens.shape[0] == codes.shape[0] and meta["codebook_size"] == encoder.codebook_size
+    line, count, packing = audio_codec.format_tokens(tokens, meta["codebook_size"])
+    code, _ = make_code(seconds=1.0)
+    code = code[:-2] + audio_codec.format_neural_block("tiny", meta["compression_ratio"], line, count, packing) + "\n}"
+    assert np.array_equal(ChordCraftDocument(code).neural_tokens, tokens)
+    neural_codec.clear_cache()
+
+
+def test_batch_runner_shares_neural_encodes(tmp_path, monkeypatch):
+    import audio_codec
+    from batch import NEURAL_GROUP, BatchRunner
+    from chordcraft_decoder import ChordCraftDocument
+
+    # the tiny model stands in for the pretrained default
+    neural_codec.clear_cache()
+    encoder = get_encoder(DEFAULT_MODEL, DEFAULT_BANDWIDTH, loader=lambda name: tiny_model())
+    monkeypatch.setattr(audio_codec, "NEURAL_CODECS_ENABLED", True)
+    batches = []
+    encode_batch = encoder.encode_batch
+    monkeypatch.setattr(encoder, "encode_batch", lambda signals: batches.append(len(signals)) or encode_batch(signals))
+
+    (tmp_path / "in").mkdir()
+    for i, seconds in enumerate((1.0, 0.4, 0.7, 1.3, 0.9)):
+        t = np.arange(int(seconds * 22050)) / 22050
+        sf.write(str(tmp_path / "in" / f"{i}.wav"), (0.3 * np.sin(2 * np.pi * (220 + 110 * i) * t)).astype(np.float32),
+                 22050)
+
+    stats = BatchRunner(tasks=["encode"], output_dir=str(tmp_path / "out"), workers=1, target_sr=8000,
+                        neural=True).run([str(tmp_path / "in")])
+    assert stats["ok"] == 5 and stats["failed"] == 0
+    # one batch per group of files, then the group's codes come from the batch
+    assert batches == [NEURAL_GROUP, 5 - NEURAL_GROUP]
+
+    codec = audio_codec.ChordCraftCodec(target_sr=8000)
+    for i in range(5):
+        with open(tmp_path / "out" / f"{i}.cc", encoding="utf-8") as fh:
+            tokens = ChordCraftDocument(fh.read()).neural_tokens
+        alone, _ = codec.encode_neural(str(tmp_path / "in" / f"{i}.wav"))
+        assert np.array_equal(tokens, np.asarray(alone))
+    neural_codec.clear_cache()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for packed neural token storage
+"""
+
+import io
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+from audio_codec import format_neural_block, format_tokens
+from chordcraft_container import ChordCraftContainer, text_to_container
+from chordcraft_decoder import ChordCraftDocument
+from neural_tokens import bits_for, pack_codes, unpack_codes
+from test_chordcraft_decoder import make_code
+
+
+def test_pack_round_trip():
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 1024, (8, 377))
+    assert bits_for(1024) == 10 and bits_for(1000) == 10 and bits_for(2) == 1
+
+    for compress in (False, True):
+        data, packing = pack_codes(codes, bits=10, compress=compress)
+        out = unpack_codes(data, packing["bits"], packing["codebooks"], packing["frames"], packing["encoding"])
+        assert out.dtype == np.int64 and np.array_equal(out, codes)
+    assert len(pack_codes(codes, bits=10)[0]) == (codes.size * 10 + 7) // 8
+
+    # bits default to what the largest code needs
+    assert pack_codes([[0, 5], [3, 1]])[1]["bits"] == 3
+    for bad in ([1, 2, 3], [[1, -2]], [[0.5, 1.0]]):
+        with pytest.raises(ValueError):
+            pack_codes(bad)
+    with pytest.raises(ValueError):
+        pack_codes([[1024]], bits=10)
+
+
+def test_packed_tokens_in_codes():
+    codes = np.random.default_rng(1).integers(0, 1024, (4, 250))
+    line, count, packing = format_tokens(codes, codebook_size=1024)
+    assert count == codes.size and packing["bits"] == 10
+    assert len(line) * 2.5 < len(json.dumps(codes.tolist()))
+    # flat tokens can't be packed and stay JSON
+    assert format_tokens([1, -2, 3]) == ("[1, -2, 3]", 3, None)
+
+    code, _ = make_code(seconds=2.0)
+    code = code[:-2] + format_neural_block("facebook/encodec_24khz", 75.0, line, count, packing) + "\n}"
+    doc = ChordCraftDocument(code)
+    assert doc.neural["encoding"] == "packed" and doc.neural["frames"] == 250
+    assert np.array_equal(doc.neural_tokens, codes)
+
+    buf = io.BytesIO()
+    text_to_container(code, buf)
+    container = ChordCraftContainer(buf.getvalue())
+    assert container.to_text() == code
+    assert "TAIL" not in container.sections
+    assert np.array_equal(container.neural_tokens, codes)
+
+
+def test_neural_path_can_be_switched_off(monkeypatch):
+    import audio_codec
+
+    env = {k: v for k, v in os.environ.items() if k != "CHORDCRAFT_ENABLE_NEURAL"}
+    flags = []
+    for value in (None, "0"):
+        if value is not None:
+            env["CHORDCRAFT_ENABLE_NEURAL"] = value
+        done = subprocess.run([sys.executable, "-c", "import neural_codec; print(neural_codec.NEURAL_CODECS_ENABLED)"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                              capture_output=True, text=True, check=True)
+        flags += done.stdout.split()
+    assert flags == ["True", "False"]
+
+    # asked for but disabled: the code just has no neural block
+    monkeypatch.setattr(audio_codec, "NEURAL_CODECS_ENABLED", False)
+    codec = audio_codec.ChordCraftCodec(target_sr=8000)
+    wav = io.BytesIO()
+    sf.write(wav, np.zeros(8000, dtype=np.float32), 8000, format="WAV")
+    assert "<<NEURAL_TOKENS>>" not in codec.create_chordcraft_code(wav.getvalue(), include_neural=True)
+    with pytest.raises(RuntimeError, match="CHORDCRAFT_ENABLE_NEURAL"):
+        codec.encode_neural(wav.getvalue())
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the codec's resampling tiers
+"""
+
+import math
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+sys.path.append(os.path.dirname(__file__))
+
+from audio_codec import ChordCraftCodec
+from resampling import RESAMPLERS, output_length, resample, stream_resampler
+
+
+def test_polyphase_stream_matches_resample_poly():
+    rng = np.random.default_rng(0)
+    for orig_sr, target_sr in ((48000, 44100), (22050, 44100), (44100, 24000)):
+        x = rng.standard_normal((orig_sr + 123, 2)).astype(np.float32)
+        g = math.gcd(orig_sr, target_sr)
+        expected = resample_poly(x, target_sr // g, orig_sr // g, axis=0)
+
+        stream = stream_resampler(orig_sr, target_sr, 2, "poly")
+        pieces, pos = [], 0
+        for size in rng.integers(1, 7000, 50):
+            pieces.append(stream.resample_chunk(x[pos:pos + size]))
+            pos += size
+        pieces.append(stream.resample_chunk(x[pos:], last=True))
+        out = np.concatenate(pieces)
+
+        assert len(out) == output_length(len(x), orig_sr, target_sr) == len(expected)
+        assert np.allclose(out, expected, atol=1e-6)
+
+
+def test_matching_rates_skip_resampling():
+    y = np.random.default_rng(1).standard_normal(1000).astype(np.float32)
+    for quality in RESAMPLERS:
+        assert stream_resampler(44100, 44100, 2, quality) is None
+        assert resample(y, 44100, 44100, quality) is y
+        assert resample(y, 44100, 22050, quality).shape == (500,)
+
+    with pytest.raises(ValueError):
+        ChordCraftCodec(resampler="sinc_best")
+
+
+def test_backends_are_imported_on_first_use():
+    script = ("import sys, resampling; print('loaded:', *(m for m in ('soxr', 'scipy.signal') if m in sys.modules)); "
+              "resampling.resample(resampling.np.zeros(100), 48000, 44100); print('loaded:', 'soxr' in sys.modules)")
+    done = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                          capture_output=True, text=True, check=True)
+    before, after = [line.split("loaded:", 1)[1].split() for line in done.stdout.splitlines() if "loaded:" in line]
+    assert before == [] and after == ["True"]
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Tests for the content-addressed /analyze result cache
+"""
+
+import io
+import os
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+
+from result_cache import (DiskCache, HashingBytesIO, MemoryCache, cache_key,
+                          create_cache, hash_stream)
+
+
+def test_upload_hash_matches_rehash():
+    """hashing while receiving gives the same digest as reading the upload back"""
+    received = HashingBytesIO()
+    for piece in (b"RIFF", b"\x00" * 1000, b"WAVE"):
+        received.write(piece)
+    plain = io.BytesIO(received.getvalue())
+    assert hash_stream(received) == hash_stream(plain)
+    assert plain.tell() == 0
+
+
+def test_cache_key_depends_on_codec_params():
+    base = cache_key("abc", target_sr=44100, stereo=True, chunk_size=65536, version="cc-v2.1")
+    assert base == cache_key("abc", version="cc-v2.1", chunk_size=65536, stereo=True, target_sr=44100)
+    assert base != cache_key("abc", target_sr=48000, stereo=True, chunk_size=65536, version="cc-v2.1")
+    assert base != cache_key("abd", target_sr=44100, stereo=True, chunk_size=65536, version="cc-v2.1")
+
+
+def test_memory_cache_lru_eviction():
+    cache = MemoryCache(max_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    assert cache.get("a") == "aaaa"  # a is now most recently used
+    cache.put("c", "cccc")           # evicts b
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (2, 1, 2, 8)
+
+
+def test_disk_cache_streamed_writes_and_eviction(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=10)
+    writer = cache.writer("a")
+    for piece in ("aa", "aa"):
+        writer.write(piece)
+    writer.commit()
+    os.utime(tmp_path / "a.cc", (1, 1))  # make a the oldest entry
+
+    cache.put("b", "bbbb")
+    cache.put("c", "cccc")
+    assert cache.get("a") is None
+    assert cache.get("b") == "bbbb"
+
+    discarded = cache.writer("d")
+    discarded.write("dd")
+    discarded.discard()
+    assert sorted(os.listdir(tmp_path)) == ["b.cc", "c.cc"]
+
+
+def test_create_cache_backends(tmp_path):
+    assert create_cache("off") is None
+    assert isinstance(create_cache("memory"), MemoryCache)
+    assert isinstance(create_cache("disk", directory=str(tmp_path)), DiskCache)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Cold-start budget for the backend - importing app must stay cheap
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.abspath(__file__))
+# generous for slow CI boxes - app used to take over a second here with scipy.signal alone
+IMPORT_BUDGET_MS = float(os.environ.get("CHORDCRAFT_IMPORT_BUDGET_MS", 1000))
+# only imported on first use (see lazy_imports.py)
+HEAVY_MODULES = ("torch", "transformers", "music21", "pretty_midi", "sklearn", "scipy.signal")
+
+
+def import_app(*args):
+    return subprocess.run([sys.executable, *args], cwd=BACKEND, capture_output=True, text=True, check=True)
+
+
+def test_heavy_modules_are_not_imported():
+    script = f"import sys, app; print('loaded:', *(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    assert import_app("-c", script).stdout.rsplit("loaded:", 1)[1].split() == []
+
+
+def test_app_import_time_budget():
+    # best of three fresh interpreters, from python -X importtime's cumulative column (us)
+    timings = []
+    for _ in range(3):
+        report = import_app("-X", "importtime", "-c", "import app").stderr
+        timings.append(int(re.search(r"\|\s*(\d+) \| app$", report, re.MULTILINE).group(1)) / 1000)
+    slowest = sorted(re.findall(r"\|\s*(\d+) \| ( ?\S.*)$", report, re.MULTILINE),
+                     key=lambda row: -int(row[0]))[:10]
+    assert min(timings) < IMPORT_BUDGET_MS, \
+        f"import app took {min(timings):.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms); slowest: {slowest}"
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tests for the streamed /analyze responses
+"""
+
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+sys.path.append(os.path.dirname(__file__))
+
+import app as app_module
+from result_cache import MemoryCache
+
+
+def wav_upload(seconds=1.0, sr=22050, format="WAV"):
+    buf = io.BytesIO()
+    t = np.arange(int(seconds * sr)) / sr
+    sf.write(buf, (0.3 * np.sin(2 * np.pi * 440 * t)).astype(np.float32), sr, format=format)
+    buf.seek(0)
+    return buf
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(app_module, "result_cache", None)
+    app_module.limiter.enabled = False
+    try:
+        yield app_module.app.test_client()
+    finally:
+        app_module.limiter.enabled = True
+
+
+def test_stream_matches_json(client):
+    upload = wav_upload().getvalue()
+    response = client.post("/analyze", data={"audio": (io.BytesIO(upload), "tone.wav")})
+    assert response.status_code == 200
+    code = response.get_json()["code"]
+
+    streamed = client.post("/analyze?stream=1", data={"audio": (io.BytesIO(upload), "tone.wav")})
+    assert streamed.status_code == 200
+    assert streamed.mimetype == app_module.CHORDCRAFT_MIME
+    assert streamed.is_streamed and "Content-Length" not in streamed.headers
+    assert streamed.get_data() == code.encode("utf-8")
+
+
+def test_stream_failure_ends_the_response(client, monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr(app_module, "result_cache", cache)
+
+    def failing(**kwargs):
+        yield "Song {\n"
+        yield "  meta: { bpm: 120 }\n"
+        raise RuntimeError("encoder died")
+
+    monkeypatch.setattr(app_module.codec, "iter_chordcraft_code", failing)
+    upload = wav_upload()
+    key = app_module.result_key(io.BytesIO(upload.getvalue()))
+    response = client.post("/analyze?stream=1", data={"audio": (upload, "tone.wav")})
+    # headers were already out: the body just stops, short of the closing brace
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "Song {\n  meta: { bpm: 120 }\n"
+    assert cache.get(key) is None
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_events_arrive_stage_by_stage(client):
+    response = client.post("/analyze?events=1", data={"audio": (wav_upload(2.0), "tone.wav")})
+    assert response.status_code == 200
+    assert response.mimetype == app_module.EVENT_STREAM_MIME
+    events = parse_events(response.get_data(as_text=True))
+    assert [event for event, _ in events] == ["tempo", "key", "chords", "rhythm", "notes", "structure", "result"]
+    result = events[-1][1]
+    assert result["analysis_type"] == "muzic_enhanced"
+    assert result["key"] == events[1][1]["key"] and result["tempo"] == events[0][1]["bpm"]
+
+
+def test_events_for_uploads_only_audioread_can_open(client, monkeypatch):
+    import librosa
+
+    # like M4A: nothing decodes it from a stream, only from a path on disk
+    load = librosa.load
+    opened = []
+
+    def path_only_load(path, **kwargs):
+        if hasattr(path, "read"):
+            raise RuntimeError("audioread needs a filename")
+        opened.append(path)
+        return load(path, **kwargs)
+
+    monkeypatch.setattr(librosa, "load", path_only_load)
+    response = client.post("/analyze?events=1", data={"audio": (wav_upload(2.0, format="MP3"), "tone.mp3")})
+    events = parse_events(response.get_data(as_text=True))
+    assert events[-1][0] == "result" and events[-1][1]["analysis_type"] == "muzic_enhanced"
+    # spooled to one temp file, which is gone again
+    assert len(opened) == 1 and not os.path.exists(opened[0])
+
+
+def test_event_stream_failure_sends_an_error(client, monkeypatch):
+    closed = []
+
+    class FailingAnalyzer:
+        def iter_analysis(self, upload):
+            try:
+                yield "tempo", {"bpm": 120}
+                raise RuntimeError("pitch tracker died")
+            finally:
+                closed.append(True)
+
+    monkeypatch.setattr(app_module, "get_enhanced_analyzer", FailingAnalyzer)
+    response = client.post("/analyze?events=1", data={"audio": (wav_upload(), "tone.wav")})
+    events = parse_events(response.get_data(as_text=True))
+    assert events == [("tempo", {"bpm": 120}),
+                      ("error", {"success": False, "error": "analysis_failed: pitch tracker died"})]
+    assert closed == [True]
+
+
+def test_cached_codes_carry_the_current_build_date(client, monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr(app_module, "result_cache", cache)
+    today = ["2026-01-01"]
+    monkeypatch.setattr(app_module.time, "strftime", lambda fmt, *args: today[0])
+
+    def analyze(query=""):
+        response = client.post("/analyze" + query, data={"audio": (wav_upload(), "tone.wav")})
+        assert response.status_code == 200
+        return response.get_data(as_text=True) if query else response.get_json()["code"]
+
+    first = analyze()
+    assert "2026-01-01" in first
+    assert analyze() == first and analyze("?stream=1") == first
+
+    # past midnight: the fresh code and the cached one agree on the new date
+    today[0] = "2026-01-02"
+    fresh = analyze("?stream=1")
+    assert "2026-01-02" in fresh and "2026-01-01" not in fresh
+    assert analyze() == fresh
+    assert fresh.replace("2026-01-02", "2026-01-01") == first
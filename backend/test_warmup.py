@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Tests for the startup warmup
+"""
+
+import os
+import runpy
+import sys
+
+sys.path.append(os.path.dirname(__file__))
+
+from audio_codec import ChordCraftCodec
+from muzic_integration import MuzicEnhancedAnalyzer
+from warmup import WARMUP_SR, synthetic_audio, warm_up
+
+
+class BrokenCodec:
+    def create_chordcraft_code(self, *args, **kwargs):
+        raise RuntimeError("no codec today")
+
+
+def test_warm_up_runs_codec_and_analyzer():
+    y = synthetic_audio(seconds=2.0)
+    assert len(y) == 2 * WARMUP_SR and 0 < abs(y).max() <= 0.3 + 1e-6
+
+    analyzer = MuzicEnhancedAnalyzer()
+    timings = warm_up(codec=ChordCraftCodec(), analyzer=analyzer, seconds=2.0)
+    assert set(timings) == {"codec", "analyzer"}
+    assert all(t is not None and t > 0 for t in timings.values())
+    assert analyzer._executor is None
+
+    # a component that fails is reported, not raised
+    assert warm_up(codec=BrokenCodec()) == {"codec": None}
+
+
+def test_gunicorn_preloads_except_for_gevent(monkeypatch):
+    config = os.path.join(os.path.dirname(__file__), "gunicorn.conf.py")
+    monkeypatch.delenv("CHORDCRAFT_PRELOAD", raising=False)
+    monkeypatch.delenv("GUNICORN_CMD_ARGS", raising=False)
+
+    def preload(*argv):
+        monkeypatch.setattr(sys, "argv", ["gunicorn", *argv, "app:app"])
+        return runpy.run_path(config)["preload_app"]
+
+    assert preload("--workers", "2")
+    assert not preload("-k", "gevent", "--workers", "2")
+    assert not preload("--worker-class=eventlet")
+    monkeypatch.setenv("GUNICORN_CMD_ARGS", "-k gevent")
+    assert not preload()
+    monkeypatch.setenv("CHORDCRAFT_PRELOAD", "1")
+    assert preload("-k", "gevent")
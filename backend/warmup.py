@@ -0,0 +1,91 @@
+# warmup for the web workers - run the codec and the analyzer once on a short
+# synthetic clip so the first real /analyze doesn't pay for librosa's numba JIT
+# (beat tracking, pyin's viterbi), soxr/FLAC setup and the CQT filter banks.
+#
+# under gunicorn this runs in the master before it forks (see gunicorn.conf.py),
+# so every worker starts with the compiled code and warmed caches already in
+# memory, shared copy-on-write.
+
+import gc
+import io
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+WARMUP_SR = 22050  # not the codec rate, so the resampler gets warmed too
+WARMUP_SECONDS = 3.0
+
+
+def synthetic_audio(seconds: float = WARMUP_SECONDS, sr: int = WARMUP_SR) -> np.ndarray:
+    """C major arpeggio with decaying notes and a click on every beat - enough for
+    every analysis stage to find beats, onsets, pitches and a chord"""
+    notes = [261.63, 329.63, 392.00, 523.25]  # C4, E4, G4, C5
+    n = int(seconds * sr)
+    t = np.arange(n) / sr
+    note_len = seconds / 8
+    y = np.zeros(n)
+    for i in range(8):
+        start = int(i * note_len * sr)
+        local = t[:n - start]
+        y[start:] += np.exp(-local * 4) * np.sin(2 * np.pi * notes[i % 4] * local)
+        y[start:start + 64] += 0.5  # click
+    return (0.3 * y / np.max(np.abs(y))).astype(np.float32)
+
+
+def synthetic_wav(seconds: float = WARMUP_SECONDS, sr: int = WARMUP_SR) -> bytes:
+    buf = io.BytesIO()
+    sf.write(buf, synthetic_audio(seconds, sr), sr, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+
+def warm_up(codec=None, analyzer=None, seconds: float = WARMUP_SECONDS) -> Dict[str, Optional[float]]:
+    """run each given component once; returns seconds taken per component (None if it failed)
+
+    failures are logged, never raised - a worker that can't warm up still serves.
+    """
+    wav = synthetic_wav(seconds)
+    timings = {}
+    if codec is not None:
+        timings["codec"] = _timed("codec", lambda: codec.create_chordcraft_code(io.BytesIO(wav), bpm=120))
+    if analyzer is not None:
+        timings["analyzer"] = _timed("analyzer", lambda: _analyze(analyzer, wav))
+    return timings
+
+
+def _analyze(analyzer, wav: bytes):
+    try:
+        results = analyzer.analyze_audio_enhanced(io.BytesIO(wav))
+        if results.get("analysis_type") == "muzic_error":
+            raise RuntimeError(results.get("error", "analysis failed"))
+    finally:
+        # a stage pool started now would be inherited half-broken by forked workers;
+        # the analyzer starts a fresh one on its next request
+        analyzer.close()
+
+
+def _timed(name: str, fn) -> Optional[float]:
+    start = time.perf_counter()
+    try:
+        fn()
+    except Exception as e:
+        logger.warning(f"Warmup of {name} failed: {e}")
+        return None
+    elapsed = time.perf_counter() - start
+    logger.info(f"Warmed up {name} in {elapsed:.2f}s")
+    return elapsed
+
+
+def freeze_for_fork():
+    """move everything allocated so far out of the garbage collector's reach
+
+    the collector writes to every object it visits, which would copy the
+    master's warmed pages into each worker one by one; frozen objects are
+    never visited. call it last thing before forking.
+    """
+    gc.collect()
+    gc.freeze()
@@ -21,6 +21,21 @@ export interface AudioPayload {
   model?: string;
   tokens?: number;
   compressionRatio?: number;
+  segmentFrames?: number;
+  // bit-packed neural tokens (see backend/neural_tokens.py)
+  encoding?: 'packed' | 'packed_zlib';
+  bits?: number;
+  codebooks?: number;
+  frames?: number;
+}
+
+// one independently encoded FLAC file of a segmented payload (<<PAYLOAD:FLAC:s.n>>)
+export interface FlacSegment {
+  index: number;
+  start: number;
+  frames: number;
+  sha256?: string;
+  data: ArrayBuffer;
 }
 
 export interface ChordCraftSong {
@@ -31,6 +46,7 @@ export interface ChordCraftSong {
   audio?: AudioPayload;
   neural?: AudioPayload;
   flacData?: ArrayBuffer;
+  flacSegments?: FlacSegment[];
   neuralTokens?: number[];
 }
 
@@ -85,6 +101,7 @@ export class ChordCraftDecoder {
       const shaMatch = audioStr.match(/sha256:\s*"([^"]+)"/);
       const chunksMatch = audioStr.match(/chunks:\s*(\d+)/);
       const chunkSizeMatch = audioStr.match(/chunk_size:\s*(\d+)/);
+      const segmentFramesMatch = audioStr.match(/segment_frames:\s*(\d+)/);
 
       audio = {
         format: (formatMatch?.[1] as 'flac' | 'neural_codec') || 'flac',
@@ -92,7 +109,8 @@ export class ChordCraftDecoder {
         channels: parseInt(channelsMatch?.[1] || '2'),
         sha256: shaMatch?.[1],
         chunks: parseInt(chunksMatch?.[1] || '0'),
-        chunkSize: parseInt(chunkSizeMatch?.[1] || '65536')
+        chunkSize: parseInt(chunkSizeMatch?.[1] || '65536'),
+        segmentFrames: segmentFramesMatch ? parseInt(segmentFramesMatch[1]) : undefined
       };
     }
 
@@ -105,6 +123,10 @@ export class ChordCraftDecoder {
       const modelMatch = neuralStr.match(/model:\s*"([^"]+)"/);
       const tokensMatch = neuralStr.match(/tokens:\s*(\d+)/);
       const compressionMatch = neuralStr.match(/compression_ratio:\s*([\d.]+)/);
+      const encodingMatch = neuralStr.match(/encoding:\s*"([^"]+)"/);
+      const bitsMatch = neuralStr.match(/bits:\s*(\d+)/);
+      const codebooksMatch = neuralStr.match(/codebooks:\s*(\d+)/);
+      const framesMatch = neuralStr.match(/frames:\s*(\d+)/);
 
       neural = {
         format: 'neural_codec',
@@ -112,19 +134,35 @@ export class ChordCraftDecoder {
         channels: 1,
         model: modelMatch?.[1],
         tokens: parseInt(tokensMatch?.[1] || '0'),
-        compressionRatio: parseFloat(compressionMatch?.[1] || '0')
+        compressionRatio: parseFloat(compressionMatch?.[1] || '0'),
+        encoding: encodingMatch?.[1] as 'packed' | 'packed_zlib' | undefined,
+        bits: bitsMatch ? parseInt(bitsMatch[1]) : undefined,
+        codebooks: codebooksMatch ? parseInt(codebooksMatch[1]) : undefined,
+        frames: framesMatch ? parseInt(framesMatch[1]) : undefined
       };
     }
 
     // Extract FLAC data if present
     let flacData: ArrayBuffer | undefined;
-    if (audio?.format === 'flac' && audio.chunks) {
+    let flacSegments: FlacSegment[] | undefined;
+    if (audio?.format === 'flac' && audio.segmentFrames) {
+      flacSegments = await this.extractFlacSegments(code);
+    } else if (audio?.format === 'flac' && audio.chunks) {
       flacData = await this.extractFlacData(code, audio);
     }
 
     // Extract neural tokens if present
     let neuralTokens: number[] | undefined;
-    if (neural) {
+    if (neural?.encoding) {
+      const tokensMatch = code.match(/<<NEURAL_TOKENS>>\s*([A-Za-z0-9+/=]+)/);
+      if (tokensMatch) {
+        try {
+          neuralTokens = await this.unpackTokens(tokensMatch[1], neural);
+        } catch (e) {
+          console.warn('Failed to unpack neural tokens:', e);
+        }
+      }
+    } else if (neural) {
       const tokensMatch = code.match(/<<NEURAL_TOKENS>>\s*(\[.*?\])/s);
       if (tokensMatch) {
         try {
@@ -141,6 +179,7 @@ export class ChordCraftDecoder {
       audio,
       neural,
       flacData,
+      flacSegments,
       neuralTokens
     };
   }
@@ -149,38 +188,102 @@ export class ChordCraftDecoder {
    * Extract and reconstruct FLAC data from code chunks (robust whitespace handling)
    */
   private async extractFlacData(code: string, audio: AudioPayload): Promise<ArrayBuffer> {
-    const marker = /<<PAYLOAD:FLAC:(\d+)>>/g;
-    let match: RegExpExecArray | null;
-    const found: { idx: number; pos: number; end?: number }[] = [];
+    const bytes = this.base64ToBytes(this.collectChunks(code, null, audio.chunks || 0));
+    await this.checkSha256(bytes, audio.sha256, "audio data");
+    return bytes.buffer;
+  }
 
-    while ((match = marker.exec(code)) !== null) {
-      found.push({ idx: Number(match[1]), pos: match.index + match[0].length });
+  /**
+   * Extract the FLAC files of a segmented payload, in order
+   * (segment: { ... } header, then <<PAYLOAD:FLAC:s.n>> chunks, closed by audio_end: { ... })
+   */
+  private async extractFlacSegments(code: string): Promise<FlacSegment[]> {
+    const header = /segment:\s*\{\s*index:\s*(\d+),\s*start:\s*(\d+),\s*frames:\s*(\d+),\s*sha256:\s*"([0-9a-f]*)",\s*chunks:\s*(\d+)\s*\}/g;
+    const segments: FlacSegment[] = [];
+    let match: RegExpExecArray | null;
+    while ((match = header.exec(code)) !== null) {
+      const index = Number(match[1]);
+      const start = Number(match[2]);
+      if (index !== segments.length + 1) throw new Error(`Segment ${index} out of order - audio data may be corrupted`);
+      const expectedStart = segments.length ? segments[segments.length - 1].start + segments[segments.length - 1].frames : 0;
+      if (start !== expectedStart) throw new Error(`Segment ${index} doesn't follow on from the previous one`);
+
+      const bytes = this.base64ToBytes(this.collectChunks(code, index, Number(match[5])));
+      await this.checkSha256(bytes, match[4], `segment ${index}`);
+      segments.push({ index, start, frames: Number(match[3]), sha256: match[4] || undefined, data: bytes.buffer });
     }
-    // Compute segment ends by looking at next marker or EOF
-    for (let i = 0; i < found.length; i++) {
-      found[i].end = i + 1 < found.length ? found[i + 1].pos - (">>".length + String(found[i + 1].idx).length + "PAYLOAD:FLAC:".length + 2) : code.length;
+
+    // a code cut off between segments would otherwise play as a shorter song
+    const end = code.match(/audio_end:\s*\{\s*segments:\s*(\d+),\s*frames:\s*(\d+)\s*\}/);
+    const frames = segments.reduce((total, s) => total + s.frames, 0);
+    if (!end || Number(end[1]) !== segments.length || Number(end[2]) !== frames) {
+      throw new Error("Segmented audio is incomplete - the code may have been truncated");
     }
+    return segments;
+  }
 
-    // Gather chunks by index (1..N)
-    const parts: string[] = new Array((audio.chunks || 0)).fill("");
-    for (let i = 0; i < found.length; i++) {
-      const { idx, pos, end } = found[i];
-      if (!end) continue;
-      const raw = code.slice(pos, end).replace(/\s+/g, "");
-      if (idx >= 1 && idx <= parts.length) parts[idx - 1] = raw;
+  /**
+   * Base64 of chunks 1..count, in index order - <<PAYLOAD:FLAC:n>> chunks when
+   * segment is null, <<PAYLOAD:FLAC:segment.n>> chunks otherwise
+   */
+  private collectChunks(code: string, segment: number | null, count: number): string {
+    const marker = /<<PAYLOAD:FLAC:(?:(\d+)\.)?(\d+)>>/g;
+    // a chunk runs until the first line that isn't base64 - the next marker,
+    // a segment header, the closing brace or the neural block
+    const body = /(?:[ \t]*[A-Za-z0-9+/=]*[ \t]*\r?\n)*(?:[ \t]*[A-Za-z0-9+/=]+[ \t]*$)?/y;
+    const parts: string[] = new Array(count).fill("");
+    let match: RegExpExecArray | null;
+    while ((match = marker.exec(code)) !== null) {
+      const chunkSegment = match[1] === undefined ? null : Number(match[1]);
+      const idx = Number(match[2]);
+      if (chunkSegment !== segment || idx < 1 || idx > count) continue;
+      body.lastIndex = marker.lastIndex;
+      parts[idx - 1] = (body.exec(code)?.[0] || "").replace(/\s+/g, "");
     }
+    return parts.join("");
+  }
 
-    const b64 = parts.join("");
+  private base64ToBytes(b64: string): Uint8Array {
     const bin = atob(b64);
     const bytes = new Uint8Array(bin.length);
     for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+    return bytes;
+  }
 
-    if (audio.sha256 && typeof crypto !== "undefined" && crypto.subtle) {
+  private async checkSha256(bytes: Uint8Array, expected: string | undefined, what: string): Promise<void> {
+    if (expected && typeof crypto !== "undefined" && crypto.subtle) {
       const hash = await crypto.subtle.digest("SHA-256", bytes);
       const hex = Array.from(new Uint8Array(hash)).map(b => b.toString(16).padStart(2,"0")).join("");
-      if (hex !== audio.sha256) throw new Error("Checksum mismatch - audio data may be corrupted");
+      if (hex !== expected) throw new Error(`Checksum mismatch - ${what} may be corrupted`);
     }
-    return bytes.buffer;
+  }
+
+  /**
+   * Unpack bit-packed neural tokens: a little-endian bitstream of `bits`-bit
+   * codes, codebook after codebook (optionally zlib'd). Returns them flat,
+   * codebooks * frames long, in the same codebook-major order.
+   */
+  private async unpackTokens(b64: string, neural: AudioPayload): Promise<number[]> {
+    const { encoding, bits = 0, codebooks = 0, frames = 0 } = neural;
+    let bytes = this.base64ToBytes(b64);
+    if (encoding === 'packed_zlib') {
+      const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+      bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+    } else if (encoding !== 'packed') {
+      throw new Error(`Unknown token encoding ${encoding}`);
+    }
+
+    const count = codebooks * frames;
+    if (!bits || bytes.length * 8 < count * bits) throw new Error('Packed neural tokens are truncated');
+    const tokens = new Array<number>(count);
+    for (let i = 0, bit = 0; i < count; i++) {
+      let value = 0;
+      for (let b = 0; b < bits; b++, bit++) {
+        value |= ((bytes[bit >> 3] >> (bit & 7)) & 1) << b;
+      }
+      tokens[i] = value;
+    }
+    return tokens;
   }
 
   /**
@@ -195,7 +298,15 @@ export class ChordCraftDecoder {
     let audioBuffer: AudioBuffer;
 
     // Try lossless first (guaranteed identical)
-    if (song.flacData) {
+    if (song.flacSegments) {
+      try {
+        audioBuffer = await this.decodeFlacSegments(song.flacSegments);
+        song.flacSegments = undefined;
+      } catch (e) {
+        console.warn('FLAC decode failed, falling back to neural:', e);
+        audioBuffer = await this.decodeNeural(song.neuralTokens || []);
+      }
+    } else if (song.flacData) {
       try {
         audioBuffer = await this.decodeFlac(song.flacData);
         // Memory cleanup: null out large data after decode
@@ -227,6 +338,9 @@ export class ChordCraftDecoder {
    */
   async decodeToArrayBuffer(song: ChordCraftSong): Promise<ArrayBuffer> {
     // 1) Try lossless FLAC if present
+    if (song.flacSegments && song.audio?.format === "flac") {
+      return this.audioBufferToWav(await this.decodeFlacSegments(song.flacSegments));
+    }
     if (song.flacData && song.audio?.format === "flac") {
       // Try native decode first (Chrome/Edge)
       if (this.audioContext) {
@@ -363,6 +477,29 @@ export class ChordCraftDecoder {
     }
   }
 
+  /**
+   * Decode each segment of a segmented payload and join them into one AudioBuffer
+   */
+  private async decodeFlacSegments(segments: FlacSegment[]): Promise<AudioBuffer> {
+    if (!this.audioContext) throw new Error('AudioContext not available');
+
+    const parts: AudioBuffer[] = [];
+    for (const segment of segments) {
+      parts.push(await this.decodeFlac(segment.data.slice(0))); // decodeFlac may transfer it
+    }
+    const channels = Math.max(...parts.map(p => p.numberOfChannels));
+    const length = parts.reduce((total, p) => total + p.length, 0);
+    const joined = this.audioContext.createBuffer(channels, length, parts[0].sampleRate);
+    let offset = 0;
+    for (const part of parts) {
+      for (let ch = 0; ch < channels; ch++) {
+        joined.copyToChannel(part.getChannelData(Math.min(ch, part.numberOfChannels - 1)), ch, offset);
+      }
+      offset += part.length;
+    }
+    return joined;
+  }
+
   /**
    * Decode neural codec tokens to AudioBuffer
    */
@@ -413,7 +550,7 @@ export class ChordCraftDecoder {
    * Get playback strategy for a song
    */
   getPlaybackStrategy(song: ChordCraftSong): 'lossless' | 'neural' | 'synthetic' {
-    if (song.flacData) return 'lossless';
+    if (song.flacData || song.flacSegments) return 'lossless';
     if (song.neuralTokens) return 'neural';
     return 'synthetic';
   }
@@ -434,6 +571,12 @@ export class ChordCraftDecoder {
    * Verify checksum integrity for identical playback guarantee
    */
   async verifyChecksum(song: ChordCraftSong): Promise<{ valid: boolean; hash: string; expected: string }> {
+    if (song.flacSegments) {
+      // checked per segment while parsing; report the joined hashes
+      const hashes = await Promise.all(song.flacSegments.map(s => this.sha256Hex(s.data)));
+      const expected = song.flacSegments.map(s => s.sha256 || '').join(',');
+      return { valid: hashes.join(',') === expected, hash: hashes.join(','), expected };
+    }
     if (!song.flacData || !song.audio?.sha256) {
       return { valid: false, hash: '', expected: song.audio?.sha256 || '' };
     }
@@ -456,7 +599,9 @@ export class ChordCraftDecoder {
    * Get file size estimate for code
    */
   getSizeEstimate(song: ChordCraftSong): { lossless: number; neural: number; total: number } {
-    const lossless = song.flacData ? song.flacData.byteLength : 0;
+    const lossless = song.flacSegments
+      ? song.flacSegments.reduce((total, s) => total + s.data.byteLength, 0)
+      : song.flacData ? song.flacData.byteLength : 0;
     const neural = song.neuralTokens ? song.neuralTokens.length * 2 : 0; // 2 bytes per token
     const total = lossless + neural;
     
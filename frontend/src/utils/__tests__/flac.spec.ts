@@ -27,3 +27,34 @@ describe("FLAC chunks", () => {
     expect((song.flacData as ArrayBuffer).byteLength).toBe(bytes.length);
   });
 });
+
+const makeSegmentedCode = (segments: string[][], frames = 100) => `
+Song {
+  meta: { bpm: 120, key: "C", time: "4/4" }
+  analysis: { chords: | N | N | N | N | }
+  audio: {
+    format: "flac", sr: 44100, channels: 2,
+    segment_frames: ${frames}, chunk_size: 4
+  }
+${segments.map((chunks, s) => `
+  segment: { index: ${s + 1}, start: ${s * frames}, frames: ${frames}, sha256: "", chunks: ${chunks.length} }
+${chunks.map((chunk, i) => `<<PAYLOAD:FLAC:${s + 1}.${i + 1}>>\n${chunk}`).join("\n")}`).join("\n")}
+
+  audio_end: { segments: ${segments.length}, frames: ${segments.length * frames} }
+}
+`;
+
+describe("segmented FLAC", () => {
+  it("keeps each segment's payload separate", async () => {
+    const song = await chordCraftDecoder.parseChordCraftCode(
+      makeSegmentedCode([[btoa("abc"), btoa("def")], [btoa("ghi")]]));
+    expect(song.flacData).toBeUndefined();
+    expect(song.flacSegments?.map(s => [s.index, s.start, s.data.byteLength])).toEqual([[1, 0, 6], [2, 100, 3]]);
+    expect(chordCraftDecoder.getPlaybackStrategy(song)).toBe("lossless");
+  });
+
+  it("rejects a truncated code", async () => {
+    const code = makeSegmentedCode([[btoa("abc")], [btoa("def")]]).replace(/\n\s*audio_end:[^}]*\}/, "");
+    await expect(chordCraftDecoder.parseChordCraftCode(code)).rejects.toThrow(/truncated/);
+  });
+});
@@ -0,0 +1,36 @@
+// src/utils/__tests__/neural.spec.ts
+import { describe, it, expect } from "vitest";
+import { chordCraftDecoder } from "../ChordCraftDecoder";
+
+// 2 codebooks x 3 frames of 10-bit codes, packed by backend/neural_tokens.py
+const CODES = [0, 1, 1023, 512, 7, 300];
+const PACKED = "AATwP4AHsAQ=";
+
+const makeCode = (tokens: string, fields: string) => `
+Song {
+  meta: { bpm: 120, key: "C", time: "4/4" }
+  analysis: { chords: | N | N | N | N | }
+
+  neural: {
+    format: "neural_codec", model: "encodec_24khz",
+    tokens: 6, compression_ratio: 1.00${fields}
+  }
+
+<<NEURAL_TOKENS>>
+${tokens}
+}
+`;
+
+describe("neural tokens", () => {
+  it("unpacks bit-packed tokens", async () => {
+    const song = await chordCraftDecoder.parseChordCraftCode(
+      makeCode(PACKED, `,\n    encoding: "packed", bits: 10, codebooks: 2, frames: 3`));
+    expect(song.neural?.codebooks).toBe(2);
+    expect(song.neuralTokens).toEqual(CODES);
+  });
+
+  it("still reads JSON tokens", async () => {
+    const song = await chordCraftDecoder.parseChordCraftCode(makeCode(JSON.stringify(CODES), ""));
+    expect(song.neuralTokens).toEqual(CODES);
+  });
+});